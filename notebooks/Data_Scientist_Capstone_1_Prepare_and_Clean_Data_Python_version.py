@@ -20,7 +20,72 @@ import sys
 import pandas as pd
 import numpy as np
 import glob
-import sqlite3
+
+import spa_aggregates
+import spa_compact
+import spa_features
+import spa_ingest
+import spa_master_data
+import spa_prepare
+import spa_profiling
+import spa_reports
+import spa_sketches
+import spa_storage
+
+# %% [markdown]
+# Run Configuration
+# 
+# - Full mode: All the Excel files in the data folder are read again and the table in the database is rebuilt.
+# - Incremental mode: Only the files that are new or changed since the last run are read. The files already loaded are registered in a manifest table of the database (name, size and hash).
+# 
+# - Streaming mode: The files are cleaned and stored one day (or chunk of rows) at a time. The columns and the scope filter are applied before the merge, so the memory needed depends on the size of one file and not on the whole history. It can be combined with the incremental mode.
+# 
+# The transactional Excel files are read in parallel with several processes, and through a columnar cache: only the columns needed for the analysis are read, and later runs load the cached copy instead of parsing the workbook again.
+
+# %%
+# Define run mode and database name
+# The data is stored in the table SPA_Historic_Manual_Requests_Data (see spa_storage), and can be read with the view SPA_Historic_Manual_Requests
+incremental_mode = False
+db_name = "SPA_Data_Analytics.db"  # SQLite databases are usually .db files
+
+# Folder of the columnar cache of the Excel files (None to read them without cache)
+cache_dir = "cache"
+
+# Number of processes to read the transactional files in parallel (None = all CPU cores, 1 = sequential)
+n_workers = None
+
+# Streaming mode and number of rows per chunk (None = one chunk per file)
+streaming_mode = False
+chunk_rows = None
+
+# Keep the statistics sketches of each PLP and Material up to date (approximate statistics of script 2, see spa_sketches)
+keep_sketches = True
+
+# Keep the feature store of script 3 up to date (previous gaps and calendar features of each request, see spa_features)
+keep_features = True
+
+# Profiling of the run (see spa_profiling): the time and memory of each stage are saved in the table SPA_Run_Reports.
+# trace_memory also measures the peak memory allocated by Python in each stage (slower), and
+# profile_mode profiles the whole run with "cprofile" or "pyinstrument" (None = only the stage timers)
+trace_memory = False
+profile_mode = None
+
+# Key columns to merge transactional data and master data
+merge_keys = spa_master_data.MERGE_KEYS
+
+# Only the master data valid on this date is used (None = all rows)
+master_valid_on = None
+
+# List of columns to keep for the analysis
+# Denominación comes from the transactional data: the master data index only keeps the attributes needed
+columns_to_keep = [
+    "SFab","GLin","UbiLínea", "Material", "Denominación", "Status", "Tipo Sum", "Consumo",
+    "F.Creac", "H.Creac", "F.Conf OT", "H.Conf OT", "Ubic.proc.",
+    "Tp.alm.proc.", "UbicDest", "ÁrSumProd.", "Válido de", "Válido a", "Cap. Sumin", "source_file"
+]
+
+# Columns read from the transactional Excel files: the columns to keep plus the merge keys
+read_columns = sorted(set(columns_to_keep) | set(merge_keys))
 
 # %% [markdown]
 # Import the Data Files
@@ -30,42 +95,127 @@ import sqlite3
 # - Master date with excel: One file
 
 # %%
-# Import all the Excel Files that are in the data folder (Transactional data)
-
-excel_files = glob.glob("data/*.xlsx")
-df_transactional_all_data = pd.concat([pd.read_excel(f) for f in excel_files], ignore_index=True)
-
-# Display the first rows
-df_transactional_all_data.head()
+# The workflow is under the main guard: the parallel reading of the files starts worker processes that import this script
+if __name__ == "__main__":
+    profiler = spa_profiling.RunProfiler("script_1", trace_memory=trace_memory, profile=profile_mode)
+    profiler.stage("select_files")
+
+    # Import all the Excel Files that are in the data folder (Transactional data)
+
+    excel_files = sorted(glob.glob("data/*.xlsx"))
+
+    conn = spa_storage.connect(db_name)
+    # History table of an older version: copied to the typed table, and kept with another name
+    spa_storage.migrate_legacy_history(conn)
+    if incremental_mode and (not spa_ingest.load_manifest(conn) or spa_ingest.load_watermarks(conn).empty
+                             or spa_storage.history_row_count(conn) == 0
+                             or spa_storage.history_row_count(conn, spa_storage.FIRST_REQUEST_TABLE) == 0):
+        # Nothing registered yet (first run or tables created by an older version): full load
+        print("Manifest, watermarks or first requests are empty, running in full mode.")
+        incremental_mode = False
+
+    if incremental_mode:
+        # Only new or changed files. The rows of a changed file are replaced
+        new_files, changed_files, fingerprints = spa_ingest.select_new_or_changed_files(conn, excel_files)
+        print(f"New files: {len(new_files)}, changed files: {len(changed_files)}, "
+              f"already loaded: {len(excel_files) - len(fingerprints)}")
+        files_to_load = new_files + changed_files
+    else:
+        fingerprints = {f: spa_ingest.file_fingerprint(f) for f in excel_files}
+        changed_files = []
+        files_to_load = excel_files
+    conn.close()
+
+    if not files_to_load:
+        print("No new data files to load.")
+        profiler.finish(db_name)
+        sys.exit(0)
+
+    # Remove the cached copies of files that were deleted or changed
+    if cache_dir is not None:
+        print("Stale cache entries removed:", spa_ingest.evict_stale_cache_entries(cache_dir))
+
+    # Streaming mode: clean and store each file before reading the next one
+    if streaming_mode:
+        profiler.stage("streaming")
+        # Master data index with only the rows in scope, so the lookup also filters the rows
+        master_index = spa_master_data.MasterDataIndex.from_excel(
+            "master_data/Parasum_iTLS.xlsx", valid_on=master_valid_on, in_scope_only=True, cache_dir=cache_dir
+        )
+        conn = spa_storage.connect(db_name)
+        if incremental_mode:
+            changed_names = [fingerprints[f]["file_name"] for f in changed_files]
+            changed_days = spa_aggregates.days_of_files(conn, changed_names)
+            spa_ingest.remove_files(conn, changed_names)
+        else:
+            spa_ingest.clear_manifest(conn)
+        rows_per_file = spa_prepare.stream_files_to_sqlite(
+            files_to_load, master_index, conn, columns_to_keep,
+            read_columns=read_columns, cache_dir=cache_dir,
+            replace=not incremental_mode, chunk_rows=chunk_rows, keep_sketches=keep_sketches,
+            keep_features=keep_features
+        )
+        if keep_sketches and changed_files:
+            # Rows of changed files were replaced: the sketches are built again from the history
+            spa_sketches.rebuild_sketches(conn)
+        if changed_files:
+            # The days of the replaced rows may have no new rows
+            spa_aggregates.refresh_aggregates(conn, changed_days)
+            if keep_features:
+                spa_features.refresh_features(conn, changed_days)
+        spa_ingest.record_ingested_files(conn, fingerprints, rows_per_file)
+        conn.commit()
+        conn.close()
+        print(f"Streaming: {sum(rows_per_file.values())} rows stored in {db_name}, table: {spa_storage.HISTORY_TABLE}")
+        profiler.finish(db_name)
+        sys.exit(0)
+
+    # Read the files in parallel (n_workers processes) and show the time spent on each one
+    profiler.stage("read_excel")
+    frames, parse_times = spa_ingest.read_excel_files(files_to_load, columns=read_columns,
+                                                      cache_dir=cache_dir, max_workers=n_workers)
+    for f, seconds in parse_times.items():
+        print(f"Read {f} in {seconds:.2f} s")
+
+    # Keep the name of the source file in each row, needed to replace the rows of a changed file
+    df_transactional_all_data = pd.concat(
+        [frame.assign(source_file=fingerprints[f]["file_name"]) for f, frame in zip(files_to_load, frames)],
+        ignore_index=True
+    )
+
+    # Display the first rows
+    df_transactional_all_data.head()
 
 # %%
-# Import Excel file with Master data
+    # Import Excel file with Master data
+
+    profiler.stage("master_data")
 
-# Path to the file
-file_path = "master_data/Parasum_iTLS.xlsx"
+    # Path to the file
+    file_path = "master_data/Parasum_iTLS.xlsx"
 
-# Read the Excel file
-df_master_data = pd.read_excel(file_path)
+    # Read the Excel file and keep only the attributes needed in an index by the key columns
+    master_index = spa_master_data.MasterDataIndex.from_excel(file_path, valid_on=master_valid_on, cache_dir=cache_dir)
 
-# Display the first rows
-print(df_master_data.head())
+    # Display the first rows
+    print(master_index.table.head())
 
 
 # %% [markdown]
 # Merge Data
 # 
 # The 2 files have complementary columns that should be used in the analysis and prediction model. It is necessary to group them in one data frame
+# The master data attributes are added to each request by a lookup in the master data index (same result as a left merge)
 
 # %%
-# Merge the 2 data frames using the Key colums: SFab, GLin, UbiLínea and Material. Both columns are in the 2 file types.
-df_manual_requests = pd.merge(
-    df_transactional_all_data,
-    df_master_data,
-    on=["SFab", "GLin", "UbiLínea", "Material"],
-    how="left"  # or "inner" depending on your needs
-)
+    # Merge the 2 data frames using the Key colums: SFab, GLin, UbiLínea and Material. Both columns are in the 2 file types.
+    profiler.stage("merge")
+    df_manual_requests = master_index.enrich(
+        df_transactional_all_data,
+        how="left"  # or "inner" depending on your needs
+    )
 
-df_manual_requests.head()
+    df_manual_requests.head()
 
 # %% [markdown]
 # Filter Data 1 - Columns
@@ -74,23 +224,19 @@ df_manual_requests.head()
 # Note: All the column names are in Spanish.
 
 # %%
-# Subset the data frame with only the necessary columns for the analysis
+    # Subset the data frame with only the necessary columns for the analysis
+    profiler.stage("filter")
 
-# List of columns to keep
-columns_to_keep = [
-    "SFab","GLin","UbiLínea", "Material", "Denominación_x", "Status", "Tipo Sum", "Consumo",
-    "F.Creac", "H.Creac", "F.Conf OT", "H.Conf OT", "Ubic.proc.",
-    "Tp.alm.proc.", "UbicDest", "ÁrSumProd.", "Válido de", "Válido a", "Cap. Sumin"
-]
+    # The list of columns to keep is defined in the Run Configuration, because it is also used to read the Excel files
 
-# Subset the DataFrame
-df_manual_requests = df_manual_requests[df_manual_requests.columns.intersection(columns_to_keep)]
+    # Subset the DataFrame
+    df_manual_requests = df_manual_requests[df_manual_requests.columns.intersection(columns_to_keep)]
 
-df_manual_requests.head()
+    df_manual_requests.head()
 
 # %%
-# Check the matrix size
-df_manual_requests.shape
+    # Check the matrix size
+    df_manual_requests.shape
 
 # %% [markdown]
 # Clean Data: Drop Missing Values
@@ -99,14 +245,14 @@ df_manual_requests.shape
 # 
 
 # %%
-# Drop rows with any NaN values
-df_manual_requests = df_manual_requests.dropna()
+    # Drop rows with any NaN values
+    df_manual_requests = df_manual_requests.dropna()
 
-df_manual_requests.head()
+    df_manual_requests.head()
 
 # %%
-# Check the matrix size
-df_manual_requests.shape
+    # Check the matrix size
+    df_manual_requests.shape
 
 # %% [markdown]
 # Filter Data 2 - Rows
@@ -123,22 +269,15 @@ df_manual_requests.shape
 
 # %%
 
-df_manual_requests_scope = df_manual_requests[
-    (df_manual_requests["Tipo Sum"].isin(["NO", "WN"])) &
-    (df_manual_requests["SFab"].isin([401, 402, 441, 431])) &
-    (df_manual_requests["ÁrSumProd."].astype(str).str.startswith(("10", "09", "08")))
-]
+    # The scope values are defined in spa_prepare, also used by the streaming mode
+    df_manual_requests_scope = spa_prepare.filter_scope(df_manual_requests)
 
-# Rename columns to better understand the analysis
-df_manual_requests_scope = df_manual_requests_scope.rename(columns={
-    'Denominación_x': 'Denominacion',
-    'UbicDest': 'PLP',
-    'ÁrSumProd.': 'PVB'
-})
+    # Rename columns to better understand the analysis: Denominación_x, UbicDest and ÁrSumProd.
+    df_manual_requests_scope = df_manual_requests_scope.rename(columns=spa_prepare.RENAME_COLUMNS)
 
-# Check the matrix size and first rows
-print(df_manual_requests_scope.shape)
-df_manual_requests_scope.head()
+    # Check the matrix size and first rows
+    print(df_manual_requests_scope.shape)
+    df_manual_requests_scope.head()
 
 # %% [markdown]
 # Add calculated Data
@@ -149,45 +288,73 @@ df_manual_requests_scope.head()
 # Time between MatReq: Duration in time between the first Material Request and the Second Material Request
 
 # %%
-# Make a copy to avoid SettingWithCopyWarning
-df = df_manual_requests_scope.copy()
-
-# Create two new col's in order to store the datetime in a format that can be used
-# Specify the format (example: YYYY-MM-DD for date, HH:MM:SS for time)
-df['datetime_creac'] = pd.to_datetime(df['F.Creac'] + ' ' + df['H.Creac'], format='%d.%m.%y %H:%M:%S', errors='coerce')
-df['datetime_conf'] = pd.to_datetime(df['F.Conf OT'] + ' ' + df['H.Conf OT'], format='%d.%m.%y %H:%M', errors='coerce')
-
+    # Make a copy to avoid SettingWithCopyWarning
+    profiler.stage("supply_time")
+    df = df_manual_requests_scope.copy()
 
-# Calculate Supply Time
-df['Supply_time'] = df['datetime_conf'] - df['datetime_creac']
+    # Create two new col's in order to store the datetime in a format that can be used (datetime_creac and datetime_conf)
+    # and calculate the Supply Time, also in hours
+    df = spa_prepare.add_supply_time(df)
 
-# Calculate Supply Time in hours
-df['Supply_time_hours'] = df['Supply_time'].dt.total_seconds() / 3600
+    print(df[['datetime_creac', 'datetime_conf', 'Supply_time', 'Supply_time_hours']].head(10))
 
-print(df[['datetime_creac', 'datetime_conf', 'Supply_time', 'Supply_time_hours']].head(10))
-
-# Save stats_df to Excel for internal analysis
-df.to_excel('SPA_Tiempos_entre_Peticion_y_Entrega_a_punto_consumo.xlsx', index=False)
+    # Save stats_df to Excel for internal analysis. In incremental mode df has only the new rows, so the file is not overwritten
+    # The file is written row by row and only if its content changed (see spa_reports)
+    if not incremental_mode:
+        reports = spa_reports.ReportBatch()
+        reports.add(df, 'SPA_Tiempos_entre_Peticion_y_Entrega_a_punto_consumo.xlsx')
+        reports.write()
 
 
 
 # %%
-# Calculate Time betwen Material Requests
-
-# Sort by PLP and datetime_creac
-df = df.sort_values(by=['PLP', 'datetime_creac'])
+    # Compact the data frame (see spa_compact): repeated strings as categories, smaller numeric types, and
+    # without Supply_time, that is redundant with Supply_time_hours. The text date and time columns
+    # F.Creac/H.Creac and F.Conf OT/H.Conf OT are kept: they are stored as they were read from the files
+    profiler.stage("compact")
+    df = spa_compact.compact_frame(df, keep=['F.Creac', 'H.Creac', 'F.Conf OT', 'H.Conf OT'], label="cleaned")
 
-# Calculate time difference in hours between consecutive rows for each PLP
-df['time_between_MatReqs'] = df.groupby('PLP')['datetime_creac'].diff().dt.total_seconds() / 3600
-
-
-# Drop rows where 'time_between_reqs' is NaN
-df = df.dropna(subset=['time_between_MatReqs'])
-
-# Verify
-print(df.shape)
-
-print(df.head(20))
+# %%
+    # Calculate Time betwen Material Requests
+
+    # Sort by PLP and datetime_creac
+    profiler.stage("time_between_requests")
+    df = df.sort_values(by=['PLP', 'datetime_creac'])
+
+    # Calculate time difference in hours between consecutive rows for each PLP
+    # In incremental mode the first request of each PLP is compared with the last one already stored,
+    # and the PLPs with late-arriving requests (older than the last one stored) are recalculated.
+    # The rows of changed files are deleted first, and their PLPs recalculated without them
+    conn = spa_storage.connect(db_name)
+    if incremental_mode:
+        changed_names = [fingerprints[f]["file_name"] for f in changed_files]
+        changed_days = spa_aggregates.days_of_files(conn, changed_names)
+        spa_ingest.remove_files(conn, changed_names)
+        late_plps = spa_ingest.find_late_plps(df, spa_ingest.load_watermarks(conn))
+        df['time_between_MatReqs'] = spa_ingest.incremental_time_between_requests(conn, df)
+        # Days of the daily aggregates to calculate again, before the first requests are dropped
+        # (a late PLP can have only first requests in the batch)
+        aggregate_days = changed_days + spa_aggregates.affected_days(conn, df, late_plps)
+    else:
+        late_plps = []
+        aggregate_days = None
+        df['time_between_MatReqs'] = spa_ingest.time_between_requests(df)
+
+    # Keep the first and last request of each PLP for the next run, also for the PLPs with only one request.
+    # The first request of each PLP (no previous request) is stored apart, for late-arriving data
+    spa_ingest.update_watermarks(conn, df, replace=not incremental_mode)
+    spa_ingest.store_first_requests(conn, df, replace=not incremental_mode)
+    conn.commit()
+    conn.close()
+
+
+    # Drop rows where 'time_between_reqs' is NaN
+    df = df.dropna(subset=['time_between_MatReqs'])
+
+    # Verify
+    print(df.shape)
+
+    print(df.head(20))
 
 
 # %% [markdown]
@@ -196,24 +363,47 @@ print(df.head(20))
 # The Data is now prepared for the analysis process done in another Python script.
 # 
 # In this part, this data is stored in a local sql database in one single table.
+# The table has a typed schema (datetimes as integer epochs, PLP and Material as codes) and indexes on (PLP, datetime_creac) and Material.
+# In incremental mode the new rows are appended, and the manifest is updated with the files loaded.
 
 # %%
-# Define database name and table name
-db_name = "SPA_Data_Analytics.db"  # SQLite databases are usually .db files
-table_name = "SPA_Historic_Manual_Requests"
-
-
-# Create a connection to the SQLite database
-conn = sqlite3.connect(db_name)
-
-# Store the DataFrame in the database
-df.to_sql(table_name, conn, if_exists='replace', index=False)
-
-# Commit and close the connection
-conn.commit()
-conn.close()
-
-print(f"Data successfully stored in {db_name}, table: {table_name}")
+    # Create a connection to the SQLite database (WAL mode, schema created if needed)
+    profiler.stage("write_history")
+    conn = spa_storage.connect(db_name)
+
+    # Store the DataFrame in the database, in batches inside one transaction
+    spa_storage.write_history(conn, df, replace=not incremental_mode)
+    if not incremental_mode:
+        spa_ingest.clear_manifest(conn)
+
+    # Merge the new rows into the statistics sketches (the PLPs with late data are built again from the history)
+    profiler.stage("sketches")
+    if keep_sketches:
+        if changed_files:
+            spa_sketches.rebuild_sketches(conn)
+        else:
+            spa_sketches.update_sketches(conn, df, replace=not incremental_mode, rebuild_plps=late_plps)
+
+    # Daily aggregates used by the reports of script 2: all the days in full mode, only the days affected otherwise
+    profiler.stage("aggregates")
+    spa_aggregates.refresh_aggregates(conn, aggregate_days)
+
+    # Features of script 3: the requests from the first affected day are calculated again (all in full mode)
+    if keep_features:
+        profiler.stage("features")
+        spa_features.refresh_features(conn, aggregate_days)
+
+    # Register the files loaded
+    spa_ingest.record_ingested_files(conn, fingerprints, df['source_file'].value_counts().to_dict())
+
+    # Commit and close the connection
+    conn.commit()
+    conn.close()
+
+    print(f"Data successfully stored in {db_name}, table: {spa_storage.HISTORY_TABLE}")
+
+    # Time and memory of each stage, saved in the table SPA_Run_Reports
+    profiler.finish(db_name)
 
 
 
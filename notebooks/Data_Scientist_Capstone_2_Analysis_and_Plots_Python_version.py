@@ -12,14 +12,22 @@
 # %%
 # Import libraries
 
+import os
 import sys
 import pandas as pd
 import numpy as np
 
-import sqlite3
-
 import matplotlib.pyplot as plt
 
+import spa_aggregates
+import spa_compact
+import spa_plots
+import spa_profiling
+import spa_reports
+import spa_sketches
+import spa_stats
+import spa_storage
+
 # %% [markdown]
 # LOAD Data from Database
 # 
@@ -29,45 +37,27 @@ import matplotlib.pyplot as plt
 # -----------------------------
 # 1. Load Data from SQLite
 # -----------------------------
-def load_data_from_sqlite(db_name: str, table_name: str) -> pd.DataFrame:
-    """
-    Load data from a SQLite database table into a pandas DataFrame.
-
-    Args:
-        db_name (str): Name of the SQLite database file.
-        table_name (str): Name of the table to load.
-
-    Returns:
-        pd.DataFrame: DataFrame containing the table data.
+def load_data_from_sqlite(db_name: str, columns: list = None, plps: list = None, materials: list = None,
+                          date_from=None, date_to=None) -> pd.DataFrame:
     """
-    conn = sqlite3.connect(db_name)
-    df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-    conn.close()
-    return df
-
-
-# %% [markdown]
-# Filter Data
-# 
-# In order to analyse step by step, it is necessary to filter the data into different deeps
+    Load the history of Material Requests from the SQLite database into a pandas DataFrame.
 
-# %%
-# -----------------------------
-# 2. Filter Data
-# -----------------------------
-def filter_by_column(df: pd.DataFrame, column: str, values: list) -> pd.DataFrame:
-    """
-    Filter a DataFrame by matching values in a specific column.
+    The columns and the filters are sent to SQLite as a parameterized query, so only the rows
+    and columns needed are read (and not the whole table filtered later in pandas). The text
+    columns are loaded as categories and the numbers with smaller types (see spa_compact).
 
     Args:
-        df (pd.DataFrame): Input DataFrame.
-        column (str): Column name to filter on.
-        values (list): List of values to keep.
+        db_name (str): Name of the SQLite database file.
+        columns (list): Columns to load (default all).
+        plps (list): Load only these PLPs (optional).
+        materials (list): Load only these Materials (optional).
+        date_from: Load requests created from this date, included (optional).
+        date_to: Load requests created before this date, not included (optional).
 
     Returns:
-        pd.DataFrame: Filtered DataFrame.
+        pd.DataFrame: DataFrame containing the requested data.
     """
-    return df[df[column].isin(values)]
+    return spa_compact.compact_frame(spa_storage.load_history(db_name, columns, plps, materials, date_from, date_to))
 
 
 # %% [markdown]
@@ -77,26 +67,26 @@ def filter_by_column(df: pd.DataFrame, column: str, values: list) -> pd.DataFram
 
 # %%
 # -----------------------------
-# 3. Compute Statistics
+# 2. Compute Statistics
 # -----------------------------
-def compute_stats(df: pd.DataFrame, group_cols: list, target_col: str) -> pd.DataFrame:
+def compute_stats_from_sqlite(db_name: str, group_cols: list, target_cols: list, chunk_rows: int,
+                              plps: list = None) -> pd.DataFrame:
     """
-    Compute median, std, min, and max for a target column grouped by specified columns.
+    Compute the statistics of several target columns reading the history from the database by chunks.
 
     Args:
-        df (pd.DataFrame): Input DataFrame.
+        db_name (str): Name of the SQLite database file.
         group_cols (list): Columns to group by.
-        target_col (str): Column to compute statistics on.
+        target_cols (list): Columns to compute statistics on.
+        chunk_rows (int): Rows per chunk.
+        plps (list): Use only these PLPs (optional).
 
     Returns:
-        pd.DataFrame: DataFrame with computed statistics.
+        pd.DataFrame: Statistics of all the target columns (see spa_stats.grouped_stats).
     """
-    return df.groupby(group_cols)[target_col].agg(
-        median='median',
-        std='std',
-        min='min',
-        max='max'
-    ).reset_index()
+    chunks = spa_storage.iter_history_chunks(db_name, chunk_rows, columns=group_cols + target_cols,
+                                             plps=plps, order_by=group_cols[:1])
+    return spa_stats.grouped_stats_by_chunks(chunks, group_cols, target_cols)
 
 
 # %% [markdown]
@@ -106,9 +96,9 @@ def compute_stats(df: pd.DataFrame, group_cols: list, target_col: str) -> pd.Dat
 
 # %%
 # -----------------------------
-# 4. Plot Histogram
+# 3. Plot Histogram
 # -----------------------------
-def plot_histogram(data, title: str, xlabel: str, ylabel: str, bins: int = 10):
+def plot_histogram(data, title: str, xlabel: str, ylabel: str, bins=10, output_path: str = None, weights=None):
     """
     Plot a histogram for the given data.
 
@@ -117,10 +107,17 @@ def plot_histogram(data, title: str, xlabel: str, ylabel: str, bins: int = 10):
         title (str): Title of the plot.
         xlabel (str): Label for the x-axis.
         ylabel (str): Label for the y-axis.
-        bins (int): Number of bins in the histogram.
+        bins (int or array-like): Number of bins in the histogram, or their edges.
+        output_path (str): Save the plot to this file (.png or .svg) without showing it (optional).
+        weights (array-like): Count of each value of data (optional, for data already counted by bins).
     """
+    if output_path is not None:
+        # Headless mode: no window, the figure is saved to a file
+        spa_plots.render_histogram(data, title, xlabel, ylabel, output_path, bins=bins, weights=weights)
+        return
+
     plt.figure(figsize=(8, 6))
-    plt.hist(data, bins=bins, color='skyblue', edgecolor='black')
+    plt.hist(data, bins=bins, weights=weights, color='skyblue', edgecolor='black')
     plt.title(title)
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
@@ -128,6 +125,86 @@ def plot_histogram(data, title: str, xlabel: str, ylabel: str, bins: int = 10):
     plt.show()
 
 
+def histogram_from_sqlite(db_name: str, column: str, chunk_rows: int, bins: int = 10) -> tuple:
+    """
+    Histogram of a column of the whole history, reading only that column from the database by chunks.
+
+    A first pass finds the range of the values and a second one counts the values of each bin, so
+    the counts and edges are the same as the ones of the histogram of all the values in memory.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        column (str): Column of the histogram.
+        chunk_rows (int): Rows per chunk.
+        bins (int): Number of bins.
+
+    Returns:
+        tuple: (counts, edges) as NumPy arrays.
+    """
+    low, high = np.inf, -np.inf
+    for chunk in spa_storage.iter_history_chunks(db_name, chunk_rows, columns=[column]):
+        values = chunk[column].dropna()
+        if not values.empty:
+            low, high = min(low, values.min()), max(high, values.max())
+    if low > high:
+        return np.histogram([], bins=bins)
+
+    edges = np.histogram_bin_edges([low, high], bins=bins)
+    counts = np.zeros(bins, dtype="int64")
+    for chunk in spa_storage.iter_history_chunks(db_name, chunk_rows, columns=[column]):
+        counts += np.histogram(chunk[column].dropna(), bins=edges)[0]
+    return counts, edges
+
+
+def plot_all_plps(df: pd.DataFrame, db_name: str, column: str, title: str, xlabel: str, ylabel: str,
+                  chunk_rows: int = None, output_path: str = None, stats_backend: str = "exact"):
+    """
+    Plot the histogram of a column for all the PLPs.
+
+    Args:
+        df (pd.DataFrame): History loaded in memory, or None to count the values from the database.
+        db_name (str): Name of the SQLite database file.
+        column (str): Column to plot.
+        title (str): Title of the plot.
+        xlabel (str): Label for the x-axis.
+        ylabel (str): Label for the y-axis.
+        chunk_rows (int): Rows per chunk when df is None.
+        output_path (str): Save the plot to this file (.png or .svg) without showing it (optional).
+        stats_backend (str): "aggregates" reads the counts from the histogram table of spa_aggregates.
+    """
+    if df is not None:
+        plot_histogram(df[column], title, xlabel, ylabel, output_path=output_path)
+        return
+    if stats_backend == "aggregates":
+        # Bins of BIN_WIDTH hours kept by script 1, each drawn at its middle with its count
+        bins = spa_aggregates.load_histogram(db_name, column)
+        plot_histogram(bins['bin_start'] + spa_aggregates.BIN_WIDTH / 2, title, xlabel, ylabel,
+                       output_path=output_path, weights=bins['count'])
+        return
+    counts, edges = histogram_from_sqlite(db_name, column, chunk_rows)
+    # One value in the middle of each bin, weighted by its count, gives the same bars
+    plot_histogram((edges[:-1] + edges[1:]) / 2, title, xlabel, ylabel, bins=edges, output_path=output_path,
+                   weights=counts)
+
+
+def plot_path(plots_dir: str, name: str, fmt: str = 'png') -> str:
+    """
+    Path of a plot file in the plots folder (created if needed).
+
+    Args:
+        plots_dir (str): Folder of the plots. None shows the plots instead of saving them.
+        name (str): Name of the plot.
+        fmt (str): 'png' or 'svg'.
+
+    Returns:
+        str: Path of the file, or None if plots_dir is None.
+    """
+    if plots_dir is None:
+        return None
+    os.makedirs(plots_dir, exist_ok=True)
+    return os.path.join(plots_dir, f"{name}.{fmt}")
+
+
 # %% [markdown]
 # Save Data to Excel
 # 
@@ -135,17 +212,19 @@ def plot_histogram(data, title: str, xlabel: str, ylabel: str, bins: int = 10):
 
 # %%
 # -----------------------------
-# 5. Save to Excel
+# 4. Save to Excel
 # -----------------------------
 def save_to_excel(df: pd.DataFrame, filename: str):
     """
-    Save a DataFrame to an Excel file.
+    Save a DataFrame to an Excel file (streaming writer, see spa_reports).
+
+    The main workflow collects its reports in a spa_reports.ReportBatch and writes them together.
 
     Args:
         df (pd.DataFrame): DataFrame to save.
         filename (str): Output Excel file name.
     """
-    df.to_excel(filename, index=False)
+    spa_reports.write_report(df, filename)
 
 
 # %% [markdown]
@@ -162,55 +241,108 @@ def save_to_excel(df: pd.DataFrame, filename: str):
 # Main Workflow
 # -----------------------------
 if __name__ == "__main__":
-    # Database and table details
+    # Database details and columns used in the analysis
     db_name = "SPA_Data_Analytics.db"
-    table_name = "SPA_Historic_Manual_Requests"
-
-    # Load data
-    df_loaded = load_data_from_sqlite(db_name, table_name)
-    print("Data loaded successfully.")
-    #print(df_loaded.head())
-
-    # Compute overall stats for Supply_time_hours
-    stats_supply = compute_stats(df_loaded, ['PLP', 'Material'], 'Supply_time_hours')
-    save_to_excel(stats_supply, 'SPA_Estadisticas_Tiempo_entre_Peticion_y_Entrega.xlsx')
+    analysis_columns = ['PLP', 'Material', 'Supply_time_hours', 'time_between_MatReqs']
+
+    # Rows per chunk for the statistics of all PLPs (e.g. 500000 when the history doesn't fit in memory).
+    # None loads the whole history at once.
+    chunk_rows = None
+
+    # Backend of the statistics:
+    # - "exact": from the history.
+    # - "sketch": approximate medians from the sketches kept by script 1 (exact std, min and max).
+    # - "aggregates": from the daily aggregate tables kept by script 1 (median estimated from the histogram bins).
+    # The last two don't read the history.
+    stats_backend = "exact"
+
+    # Folder of the plots: None shows each plot in a window, a folder saves them as files without
+    # a display (headless) and also saves one histogram per PLP, rendered by plot_workers processes
+    plots_dir = None
+    plot_format = 'png'
+    plot_workers = None
+
+    # Reports of the run, written together at the end (unchanged reports are not written again).
+    # Formats: 'xlsx', 'csv' and/or 'parquet'
+    report_formats = ['xlsx']
+    reports = spa_reports.ReportBatch()
+
+    # Profiling of the run (see spa_profiling and the same options in script 1)
+    trace_memory = False
+    profile_mode = None
+    profiler = spa_profiling.RunProfiler("script_2", trace_memory=trace_memory, profile=profile_mode)
+
+    # Load data: the whole history is only loaded for the exact statistics without chunks. Otherwise the
+    # histograms of all the PLPs are counted by chunks, so the memory doesn't grow with the history
+    profiler.stage("load")
+    if stats_backend == "exact" and not chunk_rows:
+        df_loaded = load_data_from_sqlite(db_name, columns=analysis_columns)
+        print("Data loaded successfully.")
+        #print(df_loaded.head())
+    else:
+        df_loaded = None
+    histogram_chunk_rows = chunk_rows or 100000
+
+    # Compute the stats of all PLPs and both target columns in one pass.
+    # The stats of the MVP PLPs and of one PLP are taken from this result.
+    profiler.stage("statistics")
+    group_cols = ['PLP', 'Material']
+    target_cols = ['Supply_time_hours', 'time_between_MatReqs']
+    if stats_backend == "sketch":
+        stats_all = spa_sketches.load_sketch_stats(db_name, target_cols)
+    elif stats_backend == "aggregates":
+        stats_all = spa_aggregates.load_aggregate_stats(db_name, target_cols)
+    elif chunk_rows:
+        stats_all = compute_stats_from_sqlite(db_name, group_cols, target_cols, chunk_rows)
+    else:
+        stats_all = spa_stats.grouped_stats(df_loaded, group_cols, target_cols)
+
+    # Overall stats for Supply_time_hours
+    profiler.stage("supply_time_plots")
+    stats_supply = spa_stats.select_stats(stats_all, 'Supply_time_hours')
+    reports.add(stats_supply, 'SPA_Estadisticas_Tiempo_entre_Peticion_y_Entrega.xlsx', report_formats)
     print("All PLP Statistics:",stats_supply)
 
     # Plot overall histogram
-    plot_histogram(df_loaded['Supply_time_hours'],
-                   title='Histogram of Supply Time - All PLPs',
-                   xlabel='Time (hours)',
-                   ylabel='Frequency')
+    plot_all_plps(df_loaded, db_name, 'Supply_time_hours',
+                  title='Histogram of Supply Time - All PLPs',
+                  xlabel='Time (hours)',
+                  ylabel='Frequency',
+                  chunk_rows=histogram_chunk_rows,
+                  stats_backend=stats_backend,
+                  output_path=plot_path(plots_dir, 'Supply_Time_All_PLPs', plot_format))
 
     # Filter MVP PLPs
     mvp_plps = ['10DD_409P2', '10CI_319P4', '10CD_320P1', '10CI_321P4', '10CD_322P1', '10SG_016P1']
-    subset_df = filter_by_column(df_loaded, 'PLP', mvp_plps)
+    subset_df = load_data_from_sqlite(db_name, columns=analysis_columns, plps=mvp_plps)
 
     # Compute stats for MVP PLPs
-    stats_mvp = compute_stats(subset_df, ['PLP', 'Material'], 'Supply_time_hours')
-    save_to_excel(stats_mvp, 'SPA_Estadisticas_Tiempo_MVPs_T10.xlsx')
+    stats_mvp = spa_stats.select_stats(stats_all, 'Supply_time_hours', 'PLP', mvp_plps)
+    reports.add(stats_mvp, 'SPA_Estadisticas_Tiempo_MVPs_T10.xlsx', report_formats)
     print("MVP Statistics:",stats_mvp)
 
     # Plot MVP histogram
     plot_histogram(subset_df['Supply_time_hours'],
                    title='Histogram of Supply Time - MVP PLPs T10',
                    xlabel='Time (hours)',
-                   ylabel='Frequency')
+                   ylabel='Frequency',
+                   output_path=plot_path(plots_dir, 'Supply_Time_MVP_T10', plot_format))
 
     # Filter MVP PLP = 10DD_409P2 Only one PLP
     mvp_plp_only_one = ['10DD_409P2']
-    subset_df_only_one = filter_by_column(df_loaded, 'PLP', mvp_plp_only_one)
+    subset_df_only_one = load_data_from_sqlite(db_name, columns=analysis_columns, plps=mvp_plp_only_one)
 
     # Compute stats for MVP PLPs
-    stats_mvp_only_one = compute_stats(subset_df_only_one, ['PLP', 'Material'], 'Supply_time_hours')
-    save_to_excel(stats_mvp_only_one, 'SPA_Estadisticas_Tiempo_MVP_10DD_409P2.xlsx')
+    stats_mvp_only_one = spa_stats.select_stats(stats_all, 'Supply_time_hours', 'PLP', mvp_plp_only_one)
+    reports.add(stats_mvp_only_one, 'SPA_Estadisticas_Tiempo_MVP_10DD_409P2.xlsx', report_formats)
     print("MVP 10DD_409P2 Statistics:",stats_mvp_only_one)
 
     # Plot MVP histogram
     plot_histogram(subset_df_only_one['Supply_time_hours'],
                    title='Histogram of Supply Time - MVP PLP 10DD_409P2',
                    xlabel='Time (hours)',
-                   ylabel='Frequency')
+                   ylabel='Frequency',
+                   output_path=plot_path(plots_dir, 'Supply_Time_MVP_10DD_409P2', plot_format))
     
 
 
@@ -227,32 +359,56 @@ if __name__ == "__main__":
 
 # %%
     # Repeat for time_between_MatReqs
-    stats_requests = compute_stats(df_loaded, ['PLP', 'Material'], 'time_between_MatReqs')
-    save_to_excel(stats_requests, 'SPA_Estadisticas_Frecuencia_Peticiones.xlsx')
+    profiler.stage("time_between_plots")
+    stats_requests = spa_stats.select_stats(stats_all, 'time_between_MatReqs')
+    reports.add(stats_requests, 'SPA_Estadisticas_Frecuencia_Peticiones.xlsx', report_formats)
     print("All PLP Statistics:",stats_requests)
 
-    plot_histogram(df_loaded['time_between_MatReqs'],
-                   title='Histogram of Frequency of Requests - All PLPs',
-                   xlabel='Time between requests (hours)',
-                   ylabel='Frequency')
+    plot_all_plps(df_loaded, db_name, 'time_between_MatReqs',
+                  title='Histogram of Frequency of Requests - All PLPs',
+                  xlabel='Time between requests (hours)',
+                  ylabel='Frequency',
+                  chunk_rows=histogram_chunk_rows,
+                  stats_backend=stats_backend,
+                  output_path=plot_path(plots_dir, 'Frequency_Requests_All_PLPs', plot_format))
 
-    stats_requests_mvp = compute_stats(subset_df, ['PLP', 'Material'], 'time_between_MatReqs')
-    save_to_excel(stats_requests_mvp, 'SPA_Estadisticas_Frecuencia_Peticiones_MVP.xlsx')
+    stats_requests_mvp = spa_stats.select_stats(stats_all, 'time_between_MatReqs', 'PLP', mvp_plps)
+    reports.add(stats_requests_mvp, 'SPA_Estadisticas_Frecuencia_Peticiones_MVP.xlsx', report_formats)
     print("MVP PLP Statistics:",stats_requests_mvp)
 
     plot_histogram(subset_df['time_between_MatReqs'],
                    title='Histogram of Frequency of Requests - MVP PLP T10',
                    xlabel='Time between requests (hours)',
-                   ylabel='Frequency')
+                   ylabel='Frequency',
+                   output_path=plot_path(plots_dir, 'Frequency_Requests_MVP_T10', plot_format))
 
-    stats_requests_only_one = compute_stats(subset_df_only_one, ['PLP', 'Material'], 'time_between_MatReqs')
-    save_to_excel(stats_requests_only_one, 'SPA_Estadisticas_Frecuencia_Peticiones_MVP.xlsx')
+    stats_requests_only_one = spa_stats.select_stats(stats_all, 'time_between_MatReqs', 'PLP', mvp_plp_only_one)
+    reports.add(stats_requests_only_one, 'SPA_Estadisticas_Frecuencia_Peticiones_MVP_10DD_409P2.xlsx', report_formats)
     print("MVP PLP Statistics:",stats_requests_only_one)
 
     plot_histogram(subset_df_only_one['time_between_MatReqs'],
                    title='Histogram of Frequency of Requests - MVP PLPs 10DD_409P2',
                    xlabel='Time between requests (hours)',
-                   ylabel='Frequency')
+                   ylabel='Frequency',
+                   output_path=plot_path(plots_dir, 'Frequency_Requests_MVP_10DD_409P2', plot_format))
+
+    # Chart pack with one histogram per PLP (headless mode only)
+    profiler.stage("plot_pack")
+    if plots_dir is not None:
+        df_plps = load_data_from_sqlite(db_name, columns=['PLP'] + target_cols)
+        for column, title, xlabel in [('Supply_time_hours', 'Histogram of Supply Time', 'Time (hours)'),
+                                      ('time_between_MatReqs', 'Histogram of Frequency of Requests',
+                                       'Time between requests (hours)')]:
+            pack = spa_plots.render_plp_histograms(df_plps, column, os.path.join(plots_dir, 'plp'), title, xlabel,
+                                                   fmt=plot_format, max_workers=plot_workers)
+            print(f"{len(pack['files'])} histograms of {column} saved in {pack['seconds']:.1f} s")
+
+    # Write all the reports of the run
+    profiler.stage("write_reports")
+    reports.write()
+
+    # Time and memory of each stage, saved in the table SPA_Run_Reports
+    profiler.finish(db_name)
 
 # %% [markdown]
 # Conclusions of Time between Requests:
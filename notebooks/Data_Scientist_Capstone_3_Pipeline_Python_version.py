@@ -14,10 +14,16 @@
 import pandas as pd
 import numpy as np
 
-import sqlite3
-
-
-from sklearn.model_selection import train_test_split, GridSearchCV
+import spa_compact
+import spa_features
+import spa_group_models
+import spa_models
+import spa_profiling
+import spa_storage
+import spa_tree_inference
+import spa_tuning
+
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
@@ -30,18 +36,24 @@ from sklearn.metrics import mean_squared_error, r2_score
 # The database is based in sql lite. This database is generated in the Python script Data_Scientist_Capstone_1_Prepare_and_Clean_Data.jpynb
 
 # %%
-# Database and table details
+# Database details
 db_name = "SPA_Data_Analytics.db"
-table_name = "SPA_Historic_Manual_Requests"
 
-# Connect to the SQLite database
-conn = sqlite3.connect(db_name)
+# Profiling of the run (see spa_profiling and the same options in script 1)
+trace_memory = False
+profile_mode = None
+profiler = spa_profiling.RunProfiler("script_3", trace_memory=trace_memory, profile=profile_mode)
+profiler.stage("load")
 
-# Read the table into a DataFrame
-df_loaded = pd.read_sql(f"SELECT * FROM {table_name}", conn)
+# Read only the columns used by the models (features and target, see Pipeline 1) and the PLP and Material of each
+# request (for the prediction examples), indexed by the rowid of the history.
+# The frames are compacted (see spa_compact): text columns as categories and floats as float32 when no value changes
+model_columns = ['Consumo', 'Cap. Sumin', 'Supply_time_hours', 'time_between_MatReqs']
+df_loaded = spa_compact.compact_frame(spa_storage.load_history(db_name, columns=['PLP', 'Material'] + model_columns,
+                                                               row_id=True).set_index('row_id'))
 
-# Close the connection
-conn.close()
+# The fitted models are saved in this registry (versions with metadata), None to not save them
+registry_dir = "models"
 
 # Display the DataFrame
 print(df_loaded.head())
@@ -53,6 +65,7 @@ print(df_loaded.head())
 
 # %%
 # Relevant columns
+profiler.stage("pipeline_1")
 features = ['Consumo', 'Cap. Sumin', 'Supply_time_hours'] # These variables are "Median of consumption parts per day in the Production process", "Number of parts for each contanier in the Request" and "Supply Time"
 target = 'time_between_MatReqs'
 
@@ -81,6 +94,9 @@ r2 = r2_score(y_test, y_pred)
 print(f"RandomForest RMSE: {rmse:.2f}")
 print(f"R² Score: {r2:.2f}")
 
+if registry_dir:
+    spa_models.save_model(pipeline, "rf", features, target, X_train, y_train, {"rmse": rmse, "r2": r2}, registry_dir)
+
 
 # %% [markdown]
 # CONCLUSION Pipeline 1:
@@ -104,6 +120,7 @@ print(f"R² Score: {r2:.2f}")
 # -------------------------------
 # 1. RandomForest with GridSearch
 # -------------------------------
+profiler.stage("tuning")
 rf_pipeline = Pipeline([
     ('scaler', StandardScaler()),  # optional for trees
     ('model', RandomForestRegressor(random_state=42))
@@ -115,7 +132,9 @@ rf_params = {
     'model__min_samples_split': [2, 5]
 }
 
-rf_grid = GridSearchCV(rf_pipeline, rf_params, cv=3, scoring='r2', n_jobs=-1)
+# Search mode: "grid" (GridSearchCV), "warm_start" (same result as "grid", faster) or "halving" (fastest, see spa_tuning)
+tuning_mode = "warm_start"
+rf_grid = spa_tuning.make_search(rf_pipeline, rf_params, tuning_mode, cv=3, scoring='r2', n_jobs=-1)
 rf_grid.fit(X_train, y_train)
 
 print("Best RF Params:", rf_grid.best_params_)
@@ -127,6 +146,38 @@ rf_r2 = r2_score(y_test, rf_pred)
 
 print(f"RandomForest -> RMSE: {rf_rmse:.2f}, R²: {rf_r2:.2f}")
 
+# Compact inference of the tuned model (flat arrays of nodes): same predictions, faster for a few rows
+rf_compact = spa_tree_inference.CompactPipeline(rf_grid.best_estimator_)
+print("Compact inference identical to scikit-learn:", np.array_equal(rf_compact.predict(X_test), rf_pred))
+
+if registry_dir:
+    spa_models.save_model(rf_grid.best_estimator_, "rf_grid", features, target, X_train, y_train,
+                          {"rmse": rf_rmse, "r2": rf_r2}, registry_dir)
+
+# Score the tuned model on the history by chunks (the memory needed doesn't grow with the history).
+# The training rows are skipped: only the held-out rows (and the ones stored after the load) are scored
+profiler.stage("history_scoring")
+train_ids = X_train.index
+n_rows, sse, sum_y, sum_y2 = 0, 0.0, 0.0, 0.0
+for chunk in spa_storage.iter_history_chunks(db_name, chunk_rows=100000, columns=model_columns, row_id=True):
+    chunk = chunk[~chunk['row_id'].isin(train_ids)]
+    if chunk.empty:
+        continue
+    chunk_y = chunk[target].to_numpy()
+    chunk_pred = rf_grid.predict(chunk[features])
+    n_rows += len(chunk)
+    sse += float(np.sum((chunk_y - chunk_pred) ** 2))
+    sum_y += float(np.sum(chunk_y))
+    sum_y2 += float(np.sum(chunk_y ** 2))
+
+if n_rows == 0:
+    print("No held-out rows in the history to score the RandomForest")
+else:
+    history_rmse = np.sqrt(sse / n_rows)
+    history_r2 = 1 - sse / (sum_y2 - sum_y ** 2 / n_rows)
+    print(f"RandomForest on the held-out rows of the history ({n_rows} rows) -> RMSE: {history_rmse:.2f}, "
+          f"R²: {history_r2:.2f}")
+
 
 # %% [markdown]
 # CONCLUSION Pipeline 2:
@@ -144,6 +195,7 @@ print(f"RandomForest -> RMSE: {rf_rmse:.2f}, R²: {rf_r2:.2f}")
 # -------------------------------
 # 2. GradientBoosting
 # -------------------------------
+profiler.stage("gradient_boosting")
 gb_pipeline = Pipeline([
     ('scaler', StandardScaler()),  # optional for boosting
     ('model', GradientBoostingRegressor(random_state=42))
@@ -156,12 +208,113 @@ gb_r2 = r2_score(y_test, gb_pred)
 
 print(f"GradientBoosting -> RMSE: {gb_rmse:.2f}, R²: {gb_r2:.2f}")
 
+if registry_dir:
+    spa_models.save_model(gb_pipeline, "gb", features, target, X_train, y_train, {"rmse": gb_rmse, "r2": gb_r2},
+                          registry_dir)
+
 
 # %% [markdown]
 # CONCLUSION Pipeline 3:
 # 
 # RandomForest still slightly outperforms GradientBoosting in this case
 
+# %% [markdown]
+# Prediction with the registered model
+# 
+# The tuned RandomForest is loaded from the registry (no training) and predicts the time between requests of one PLP and Material (the first request of the test set).
+# Other scripts can do the same with `spa_models.load_model("rf_grid").predict_one(...)`.
+# To predict for many PLPs in near real time, the same model can be served locally with `python spa_prediction_service.py --model rf_grid`.
+
+# %%
+profiler.stage("registry_prediction")
+if registry_dir:
+    predictor = spa_models.load_model("rf_grid", registry_dir=registry_dir, compact=True)
+    example_row = df_loaded.loc[X_test.index[0]]
+    example = predictor.predict_one(example_row['PLP'], example_row['Material'], consumo=float(example_row['Consumo']),
+                                    cap_sumin=float(example_row['Cap. Sumin']),
+                                    supply_time_hours=float(example_row['Supply_time_hours']))
+    print(f"Predicted time between requests of {example_row['PLP']} / {example_row['Material']}: {example:.2f} hours "
+          f"(model version {predictor.metadata['version']})")
+
+# %% [markdown]
+# Pipeline 4
+# 
+# One model per group of PLPs (next step of the conclusions): the PLPs are grouped by plant (SFab), by the prefix of the PVB or by their behaviour (clusters of the statistics of each PLP), and one RandomForest with the best parameters of Pipeline 2 is trained for each group, in parallel.
+# The group models are saved in the registry, and the groups whose data did not change since the last run are not trained again.
+# They are trained on the training rows of Pipeline 2 and evaluated on its test rows (the PLPs of no group use the tuned RandomForest), so both results can be compared.
+
+# %%
+# Train the models per group (needs the registry)
+group_models = False
+# Grouping of the PLPs: "sfab", "pvb" or "behaviour" (the behaviour uses the history of the target of each PLP)
+group_by = "sfab"
+group_workers = None  # None uses all the CPU cores
+profiler.stage("group_models")
+
+if group_models and registry_dir:
+    df_groups = spa_compact.compact_frame(spa_storage.load_history(db_name, columns=['PLP', 'SFab', 'PVB'] + model_columns,
+                                                                   row_id=True).set_index('row_id'), label="groups")
+    df_groups_train = df_groups.loc[X_train.index]
+    plp_group = spa_group_models.plp_groups(df_groups_train, by=group_by)
+    group_results = spa_group_models.train_group_models(df_groups_train, plp_group, rf_grid.best_estimator_, features,
+                                                        target, partition=group_by, registry_dir=registry_dir,
+                                                        max_workers=group_workers)
+    print(group_results[['group', 'plps', 'rows', 'rmse', 'r2', 'trained']])
+    group_pred = spa_group_models.predict_by_group(df_groups.loc[X_test.index], group_results, registry_dir)
+    group_rmse = np.sqrt(mean_squared_error(y_test, group_pred))
+    group_r2 = r2_score(y_test, group_pred)
+    print(f"Models per group ({group_by}) on the test rows of Pipeline 2 -> RMSE: {group_rmse:.2f}, R²: {group_r2:.2f} "
+          f"(tuned RandomForest: {rf_rmse:.2f}, {rf_r2:.2f})")
+
+# %% [markdown]
+# Pipeline 5
+# 
+# RandomForest with the features of the feature store (see spa_features, kept up to date by script 1): previous gap and rolling median of the gaps of the PLP, and hour, day of the week and weekend flag of the previous request (a request just before the weekend is followed by a long gap).
+# The features only use the earlier requests of each PLP, so the ones of the next request are also read from the store to predict it. The first request of each PLP has no previous gap and is not used for training.
+
+# %%
+# Train the model with the store features
+feature_store_model = False
+profiler.stage("feature_store_model")
+
+if feature_store_model:
+    store_features = features + spa_features.FEATURE_COLUMNS
+    df_features = spa_compact.compact_frame(spa_features.load_features(db_name, columns=['PLP'] + model_columns),
+                                           label="feature store").dropna(subset=store_features)
+
+    X_train_fs, X_test_fs, y_train_fs, y_test_fs = train_test_split(df_features[store_features], df_features[target],
+                                                                    test_size=0.2, random_state=42)
+    fs_pipeline = Pipeline([
+        ('scaler', StandardScaler()),
+        ('model', RandomForestRegressor(n_estimators=100, random_state=42))
+    ])
+    fs_pipeline.fit(X_train_fs, y_train_fs)
+
+    fs_pred = fs_pipeline.predict(X_test_fs)
+    fs_rmse = np.sqrt(mean_squared_error(y_test_fs, fs_pred))
+    fs_r2 = r2_score(y_test_fs, fs_pred)
+
+    print(f"RandomForest with the store features -> RMSE: {fs_rmse:.2f}, R²: {fs_r2:.2f}")
+
+    if registry_dir:
+        spa_models.save_model(fs_pipeline, "rf_features", store_features, target, X_train_fs, y_train_fs,
+                              {"rmse": fs_rmse, "r2": fs_r2}, registry_dir)
+
+    # Next request of one PLP (the one of the first request of the test set): features from the store and the request
+    # data of that test request
+    example_row = df_features.loc[X_test_fs.index[0]]
+    next_request = spa_features.next_features(db_name, plps=[example_row['PLP']])
+    if next_request.empty:
+        print(f"No stored requests of {example_row['PLP']} to predict its next request")
+    else:
+        next_request = next_request.assign(**{c: float(example_row[c]) for c in features})
+        next_hours = fs_pipeline.predict(next_request[store_features])[0]
+        print(f"Predicted time to the next request of {next_request['PLP'].iloc[0]}: {next_hours:.2f} hours "
+              f"(last request {next_request['last_request'].iloc[0]})")
+
+# Time and memory of each stage, saved in the table SPA_Run_Reports
+profiler.finish(db_name)
+
 # %% [markdown]
 # CONCLUSIONS:
 # 
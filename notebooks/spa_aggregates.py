@@ -0,0 +1,371 @@
+"""
+Daily aggregate tables of the history, kept up to date by script 1.
+
+The statistics workbooks of script 2 only need a few numbers of each PLP and Material. Two small
+tables of the database keep them per day:
+- SPA_Daily_Aggregates: count, sum, sum of squares, min and max of each target column per
+  (PLP, Material, day). Count, mean, std, min and max of any range of days are exact.
+- SPA_Daily_Histogram: count of values per bin of BIN_WIDTH hours per (PLP, Material, day).
+  The median is estimated from the bins (error smaller than one bin).
+
+The tables are calculated by SQLite from the history table, only for the days affected by each
+load (new rows, late-arriving data and replaced files), so the time to build the reports does
+not grow with the length of the history.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import spa_stats
+import spa_storage
+
+
+DAILY_TABLE = "SPA_Daily_Aggregates"
+HISTOGRAM_TABLE = "SPA_Daily_Histogram"
+
+# Target columns aggregated
+AGGREGATE_TARGETS = ["Supply_time_hours", "time_between_MatReqs"]
+
+# Width of the histogram bins (hours). value / BIN_WIDTH is rounded to BIN_DECIMALS decimals before
+# the floor, so a value on a bin boundary (e.g. 0.3 / 0.1 = 2.9999999999999996) falls in its own bin
+BIN_WIDTH = 0.1
+BIN_DECIMALS = 9
+
+SECONDS_PER_DAY = 86400
+
+
+# -----------------------------
+# 1. Tables
+# -----------------------------
+def ensure_aggregate_tables(conn: sqlite3.Connection):
+    """
+    Create the aggregate tables if they do not exist. The days are stored as days since 1970-01-01.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+            plp_id INTEGER NOT NULL,
+            material_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            sum REAL,
+            sumsq REAL,
+            min REAL,
+            max REAL,
+            PRIMARY KEY (day, plp_id, material_id, target)
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {HISTOGRAM_TABLE} (
+            plp_id INTEGER NOT NULL,
+            material_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            target TEXT NOT NULL,
+            bin INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (day, plp_id, material_id, target, bin)
+        )
+    """)
+
+
+def _floor_bin(column: str) -> str:
+    """
+    SQL expression of the bin of a value (floor of value / BIN_WIDTH, also for negative values), like value_bins.
+    """
+    ratio = f'ROUND(h."{column}" / {BIN_WIDTH}, {BIN_DECIMALS})'
+    return f"(CAST({ratio} AS INTEGER) - ({ratio} < CAST({ratio} AS INTEGER)))"
+
+
+def value_bins(values) -> np.ndarray:
+    """
+    Histogram bin of each value, the same as the bins calculated by SQLite.
+
+    Args:
+        values: Values (hours).
+
+    Returns:
+        np.ndarray: Bins (floor of value / BIN_WIDTH).
+    """
+    ratio = np.round(np.asarray(values, dtype="float64") / BIN_WIDTH, BIN_DECIMALS)
+    return np.floor(ratio).astype("int64")
+
+
+def _insert_aggregates(conn: sqlite3.Connection, where: str, params: list):
+    """
+    Calculate the aggregates of the history rows selected by a WHERE condition.
+    """
+    day = f"h.datetime_creac / {SECONDS_PER_DAY}"
+    for target in AGGREGATE_TARGETS:
+        x = f'h."{target}"'
+        conn.execute(f"""
+            INSERT INTO {DAILY_TABLE} (plp_id, material_id, day, target, n, sum, sumsq, min, max)
+            SELECT h.plp_id, h.material_id, {day}, ?, COUNT({x}), SUM({x}), SUM({x} * {x}), MIN({x}), MAX({x})
+            FROM {spa_storage.HISTORY_TABLE} h
+            WHERE {x} IS NOT NULL AND {where}
+            GROUP BY h.plp_id, h.material_id, {day}
+        """, [target] + params)
+        conn.execute(f"""
+            INSERT INTO {HISTOGRAM_TABLE} (plp_id, material_id, day, target, bin, n)
+            SELECT h.plp_id, h.material_id, {day}, ?, {_floor_bin(target)}, COUNT(*)
+            FROM {spa_storage.HISTORY_TABLE} h
+            WHERE {x} IS NOT NULL AND {where}
+            GROUP BY h.plp_id, h.material_id, {day}, {_floor_bin(target)}
+        """, [target] + params)
+
+
+# -----------------------------
+# 2. Update on Ingest
+# -----------------------------
+def refresh_aggregates(conn: sqlite3.Connection, days: list = None):
+    """
+    Calculate the aggregates again for some days (or all), from the history table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        days (list): Days since 1970-01-01 (see affected_days). None calculates all the days.
+    """
+    ensure_aggregate_tables(conn)
+    with conn:
+        if days is None:
+            conn.execute(f"DELETE FROM {DAILY_TABLE}")
+            conn.execute(f"DELETE FROM {HISTOGRAM_TABLE}")
+            _insert_aggregates(conn, "1 = 1", [])
+            return
+        for day in sorted(set(int(d) for d in days)):
+            conn.execute(f"DELETE FROM {DAILY_TABLE} WHERE day = ?", (day,))
+            conn.execute(f"DELETE FROM {HISTOGRAM_TABLE} WHERE day = ?", (day,))
+            # Range of datetime_creac of the day (uses the index on datetime_creac)
+            _insert_aggregates(conn, "h.datetime_creac >= ? AND h.datetime_creac < ?",
+                               [day * SECONDS_PER_DAY, (day + 1) * SECONDS_PER_DAY])
+
+
+def affected_days(conn: sqlite3.Connection, df: pd.DataFrame, late_plps: list = None) -> list:
+    """
+    Days whose aggregates change with a new load.
+
+    The days of the new rows, and for the PLPs with late-arriving data all the stored days from
+    their first late request (the stored rows after it get a new time_between_MatReqs).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        df (pd.DataFrame): New rows (datetime_creac and PLP).
+        late_plps (list): PLPs with late-arriving data (optional).
+
+    Returns:
+        list: Days since 1970-01-01.
+    """
+    epochs = spa_storage.to_epoch(df["datetime_creac"]).dropna()
+    days = set((epochs // SECONDS_PER_DAY).astype("int64").tolist())
+    late = df[df["PLP"].isin(late_plps or [])]
+    if not late.empty:
+        first = int(spa_storage.to_epoch(late["datetime_creac"]).min())
+        rows = conn.execute(
+            f"SELECT DISTINCT datetime_creac / {SECONDS_PER_DAY} FROM {spa_storage.HISTORY_TABLE} "
+            f"WHERE datetime_creac >= ?", (first,)
+        )
+        days.update(day for (day,) in rows)
+    return sorted(days)
+
+
+def days_of_files(conn: sqlite3.Connection, file_names: list) -> list:
+    """
+    Days affected by replacing the stored rows of some source files (call it before the rows are deleted).
+
+    The days of the rows of the files, and all the stored days after the first one: the rows after
+    a deleted request of the same PLP get a new time_between_MatReqs.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        file_names (list): Names of the source files.
+
+    Returns:
+        list: Days since 1970-01-01.
+    """
+    if not file_names:
+        return []
+    times = spa_storage.read_file_request_times(conn, file_names)
+    epochs = spa_storage.to_epoch(times["datetime_creac"]).dropna()
+    if epochs.empty:
+        return []
+    first = int(epochs.min()) // SECONDS_PER_DAY
+    rows = conn.execute(
+        f"SELECT DISTINCT datetime_creac / {SECONDS_PER_DAY} FROM {spa_storage.HISTORY_TABLE} "
+        f"WHERE datetime_creac >= ?", (first * SECONDS_PER_DAY,)
+    )
+    return sorted({first} | {day for (day,) in rows})
+
+
+# -----------------------------
+# 3. Read the Aggregates
+# -----------------------------
+def _filters(plps: list, date_from, date_to) -> tuple:
+    """
+    WHERE condition and parameters of the PLP and date filters of the aggregate tables.
+    """
+    where, params = ["1 = 1"], []
+    if plps is not None:
+        plps = list(plps)
+        where.append(f"p.PLP IN ({', '.join('?' for _ in plps)})")
+        params.extend(plps)
+    for bound, operator in ((date_from, ">="), (date_to, "<")):
+        if bound is not None:
+            where.append(f"a.day {operator} ?")
+            params.append(int((pd.Timestamp(bound) - pd.Timestamp("1970-01-01")) // pd.Timedelta(days=1)))
+    return " AND ".join(where), params
+
+
+def _read(conn: sqlite3.Connection, table: str, select: str, group_by: str, plps, date_from, date_to) -> pd.DataFrame:
+    """
+    Aggregate one of the tables over the days selected, with PLP and Material as text.
+    """
+    where, params = _filters(plps, date_from, date_to)
+    sql = (f"SELECT p.PLP, m.Material, a.target, {select} FROM {table} a "
+           f"JOIN {spa_storage.PLP_TABLE} p ON p.plp_id = a.plp_id "
+           f"JOIN {spa_storage.MATERIAL_TABLE} m ON m.material_id = a.material_id "
+           f"WHERE {where} GROUP BY p.PLP, m.Material, a.target{group_by}")
+    return pd.read_sql(sql, conn, params=params)
+
+
+def _median_from_bins(bins: pd.DataFrame, stats: pd.DataFrame) -> pd.Series:
+    """
+    Median of each group estimated from its histogram.
+
+    The values of a bin are assumed evenly spread inside the bin (the first value of the group is
+    the exact min and the last one the exact max), and the median is interpolated by rank like
+    pandas does between two values.
+    """
+    medians = {}
+    for key, group in bins.groupby(["PLP", "Material", "target"], sort=False):
+        group = group.sort_values("bin")
+        weights = group["n"].to_numpy(dtype="float64")
+        starts = group["bin"].to_numpy() * BIN_WIDTH
+        n = weights.sum()
+
+        # Rank and value of the first and the last value of each bin
+        first_rank = np.cumsum(weights) - weights
+        last_rank = first_rank + weights - 1
+        first_value = starts + BIN_WIDTH / (2 * weights)
+        last_value = starts + BIN_WIDTH - BIN_WIDTH / (2 * weights)
+        first_value[0] = stats.loc[key, "min"]
+        last_value[-1] = stats.loc[key, "max"]
+        # A bin with one value: its first value is also its last one
+        single = weights == 1
+        last_value[0] = first_value[0] if single[0] else last_value[0]
+        first_value[-1] = last_value[-1] if single[-1] else first_value[-1]
+
+        ranks = np.column_stack([first_rank, last_rank]).ravel()
+        values = np.column_stack([first_value, last_value]).ravel()
+        medians[key] = np.interp((n - 1) / 2, ranks, values)
+    median = pd.Series(medians, dtype="float64").reindex(stats.index)
+    return median.clip(lower=stats["min"], upper=stats["max"])
+
+
+def aggregate_stats(conn: sqlite3.Connection, target_cols: list = None, metrics: list = None, plps: list = None,
+                    date_from=None, date_to=None) -> pd.DataFrame:
+    """
+    Statistics of each (PLP, Material) from the aggregate tables, with the same layout as spa_stats.grouped_stats.
+
+    count, mean, std, min and max are exact; the median is estimated from the histogram bins.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        target_cols (list): Target columns. Default AGGREGATE_TARGETS.
+        metrics (list): 'median', 'std', 'min', 'max', 'mean' or 'count' (default median, std, min, max).
+        plps (list): Use only these PLPs (optional).
+        date_from: Use the days from this date, included (optional).
+        date_to: Use the days before this date, not included (optional).
+
+    Returns:
+        pd.DataFrame: Statistics indexed by PLP and Material, with columns (target column, metric).
+    """
+    target_cols = list(target_cols or AGGREGATE_TARGETS)
+    metrics = list(metrics or spa_stats.DEFAULT_METRICS)
+    ensure_aggregate_tables(conn)
+
+    stats = _read(conn, DAILY_TABLE, "SUM(a.n) AS count, SUM(a.sum) AS sum, SUM(a.sumsq) AS sumsq, "
+                  "MIN(a.min) AS min, MAX(a.max) AS max", "", plps, date_from, date_to)
+    stats = stats[stats["target"].isin(target_cols)].set_index(["PLP", "Material", "target"])
+    stats["mean"] = stats["sum"] / stats["count"]
+    variance = (stats["sumsq"] - stats["sum"] ** 2 / stats["count"]) / (stats["count"] - 1)
+    stats["std"] = np.sqrt(variance.clip(lower=0)).where(stats["count"] > 1)
+    if "median" in metrics:
+        bins = _read(conn, HISTOGRAM_TABLE, "a.bin, SUM(a.n) AS n", ", a.bin", plps, date_from, date_to)
+        stats["median"] = _median_from_bins(bins, stats)
+
+    result = stats[metrics].unstack("target")
+    result.columns = result.columns.swaplevel(0, 1)
+    result = result.reindex(columns=pd.MultiIndex.from_tuples([(c, m) for c in target_cols for m in metrics]))
+    return result.sort_index()
+
+
+def load_aggregate_stats(db_name: str, target_cols: list = None, metrics: list = None, plps: list = None,
+                         date_from=None, date_to=None) -> pd.DataFrame:
+    """
+    Open the database and compute aggregate_stats.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        target_cols (list): Target columns. Default AGGREGATE_TARGETS.
+        metrics (list): Metrics (default median, std, min, max).
+        plps (list): Use only these PLPs (optional).
+        date_from: Use the days from this date, included (optional).
+        date_to: Use the days before this date, not included (optional).
+
+    Returns:
+        pd.DataFrame: Statistics (see aggregate_stats).
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        return aggregate_stats(conn, target_cols, metrics, plps, date_from, date_to)
+    finally:
+        conn.close()
+
+
+def read_histogram(conn: sqlite3.Connection, target_col: str, plps: list = None, date_from=None,
+                   date_to=None) -> pd.DataFrame:
+    """
+    Histogram of a target column (all the PLPs or some of them) from the histogram table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        target_col (str): Target column.
+        plps (list): Use only these PLPs (optional).
+        date_from: Use the days from this date, included (optional).
+        date_to: Use the days before this date, not included (optional).
+
+    Returns:
+        pd.DataFrame: Columns bin_start (hours) and count, sorted by bin.
+    """
+    ensure_aggregate_tables(conn)
+    where, params = _filters(plps, date_from, date_to)
+    sql = (f"SELECT a.bin, SUM(a.n) AS count FROM {HISTOGRAM_TABLE} a "
+           f"JOIN {spa_storage.PLP_TABLE} p ON p.plp_id = a.plp_id "
+           f"WHERE a.target = ? AND {where} GROUP BY a.bin ORDER BY a.bin")
+    bins = pd.read_sql(sql, conn, params=[target_col] + params)
+    return pd.DataFrame({"bin_start": bins["bin"] * BIN_WIDTH, "count": bins["count"]})
+
+
+def load_histogram(db_name: str, target_col: str, plps: list = None, date_from=None, date_to=None) -> pd.DataFrame:
+    """
+    Open the database and read the histogram of a target column (see read_histogram).
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        target_col (str): Target column.
+        plps (list): Use only these PLPs (optional).
+        date_from: Use the days from this date, included (optional).
+        date_to: Use the days before this date, not included (optional).
+
+    Returns:
+        pd.DataFrame: Columns bin_start (hours) and count, sorted by bin.
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        return read_histogram(conn, target_col, plps, date_from, date_to)
+    finally:
+        conn.close()
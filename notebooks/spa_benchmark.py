@@ -0,0 +1,407 @@
+"""
+Benchmark suite of the slow steps of the scripts, on synthetic request histories of several sizes.
+
+One sample day is not enough to judge a change of performance, so the data of the benchmarks
+is generated (generate_data) with the same columns and formats as the real files: transactional
+requests (SFab, GLin, UbiLínea, Material, Tipo Sum, F.Creac/H.Creac, F.Conf OT/H.Conf OT, ...)
+and master data (UbicDest, ÁrSumProd., Cap. Sumin, validity dates). The generator is seeded, so
+the same scale and seed always give the same data. Scale 1 has about the size of the sample
+files (two days of ~8000 requests of ~1700 consumption points); scale 10 and 100 have 10 and 100
+times more consumption points.
+
+Benchmarks (BENCHMARKS): Excel load, master data merge, timestamp parsing, time between requests
+per PLP, SQLite write and read, statistics, and fit and predict of the RandomForest and
+GradientBoosting pipelines of script 3. The median time of each one is saved with the scale and
+the git commit in the table SPA_Benchmark_Results of SPA_Benchmarks.db, so the runs can be
+compared over time (`python spa_benchmark.py --scales 1 10 100`, then `--compare`).
+"""
+
+import argparse
+import datetime
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+import spa_ingest
+import spa_master_data
+import spa_prepare
+import spa_stats
+import spa_storage
+
+
+BENCHMARK_DB = "SPA_Benchmarks.db"
+RESULTS_TABLE = "SPA_Benchmark_Results"
+DATA_DIR = "cache/benchmark"
+SCALES = [1, 10, 100]
+
+# Writing and parsing the Excel files of scale 100 takes more than 10 minutes: the Excel load is
+# only run up to this scale, unless it is asked for with `only`
+EXCEL_MAX_SCALE = 10
+
+BENCHMARKS = ["excel_load", "master_merge", "timestamp_parsing", "time_between_requests", "sqlite_write",
+              "sqlite_read", "compute_stats", "rf_fit", "rf_predict", "gb_fit", "gb_predict"]
+
+# Size of scale 1 (like the sample files)
+BASE_LOCATIONS = 1700
+REQUESTS_PER_DAY = 4.7
+DAYS = 2
+
+FEATURES = ["Consumo", "Cap. Sumin", "Supply_time_hours"]
+TARGET = "time_between_MatReqs"
+
+# Plants and supply types with about the same frequencies as the sample files
+SFAB_VALUES = [441, 406, 431, 401, 402, 900, 483, 407]
+SFAB_WEIGHTS = [0.32, 0.21, 0.12, 0.12, 0.09, 0.08, 0.04, 0.02]
+TIPO_SUM_VALUES = ["NX", "NO", "AS", "JA", "WN"]
+TIPO_SUM_WEIGHTS = [0.45, 0.27, 0.10, 0.11, 0.07]
+PVB_PREFIXES = ["10", "09", "08", "T0", "T1", "TM", "IS"]
+PVB_WEIGHTS = [0.25, 0.15, 0.10, 0.25, 0.10, 0.08, 0.07]
+
+
+# -----------------------------
+# 1. Synthetic Data
+# -----------------------------
+def generate_data(scale: int = 1, seed: int = 42, days: int = DAYS, start: str = "2025-10-25") -> tuple:
+    """
+    Generate transactional requests and master data with the schema of the real files.
+
+    Each consumption point (SFab, GLin, UbiLínea, Material) has one row of master data and a
+    number of requests per day that depends on its consumption. The confirmation time is the
+    request time plus a supply time of about 2.5 hours, and some requests are not confirmed
+    (missing F.Conf OT), like in the real files.
+
+    Args:
+        scale (int): Multiplier of the number of consumption points (1 = size of the sample files).
+        seed (int): Seed of the random generator.
+        days (int): Number of days of requests.
+        start (str): First day.
+
+    Returns:
+        tuple: (transactional, master) data frames, with the dates and times as text.
+    """
+    rng = np.random.default_rng(seed)
+    n = BASE_LOCATIONS * scale
+
+    # Consumption points and their master data
+    sfab = rng.choice(SFAB_VALUES, n, p=SFAB_WEIGHTS)
+    glin = np.char.zfill(rng.integers(1, 99, n).astype(str), 2)
+    tipo_sum = rng.choice(TIPO_SUM_VALUES, n, p=TIPO_SUM_WEIGHTS)
+    ubi_linea = np.array([f"{i % 1000:03d}P{i // 1000 + 1}_{t}" for i, t in enumerate(tipo_sum)])
+    material = np.array([f"W0{code:09X}" for code in rng.choice(16 ** 9, n, replace=False)])
+    pvb = np.array([f"{prefix}{chr(65 + a)}{chr(65 + b)}_{line:03d}_"
+                    for prefix, a, b, line in zip(rng.choice(PVB_PREFIXES, n, p=PVB_WEIGHTS), rng.integers(0, 26, n),
+                                                  rng.integers(0, 26, n), rng.integers(1, 500, n))])
+    plp = np.array([f"{p[:-1]}P{k}" for p, k in zip(pvb, rng.integers(1, 6, n))])
+    consumo = np.round(rng.lognormal(5.0, 1.0, n), 3)
+    cap_sumin = rng.choice([12, 20, 26, 48, 60, 112, 160, 3000], n)
+
+    master = pd.DataFrame({
+        "Material": material,
+        "Denominación": rng.choice(["DEP D/CARBON ACTIV", "ALFOMBRA", "LAPIZ RETOQUES", "TORNILLO", "SOPORTE"], n),
+        "SFab": sfab,
+        "GLin": glin,
+        "UbiLínea": ubi_linea,
+        "TSum": tipo_sum,
+        "UbicDest": plp,
+        "ÁrSumProd.": pvb,
+        "Válido de": pd.Timestamp("2000-01-01"),
+        "Válido a": pd.Timestamp("9999-12-31"),
+        "Cap. Sumin": cap_sumin,
+    })
+    # Some consumption points without destination in the master data
+    master.loc[rng.random(n) < 0.05, "UbicDest"] = np.nan
+
+    # Requests: more requests per day for the points with more consumption
+    rate = REQUESTS_PER_DAY * consumo / consumo.mean()
+    counts = rng.poisson(np.clip(rate, 0.2, 60)[:, None], (n, days))
+    location = np.repeat(np.tile(np.arange(n), days), counts.T.ravel())
+    day = np.repeat(np.repeat(np.arange(days), n), counts.T.ravel())
+    creac = day * 86400 + rng.integers(0, 86400, len(location))
+    conf = creac + np.round(rng.gamma(4.0, 0.6, len(location)) * 3600).astype(np.int64)
+    confirmed = rng.random(len(location)) > 0.06
+
+    # Dates and times as text from tables of the distinct values (much faster than strftime)
+    dates = pd.date_range(start, periods=days + 2, freq="D").strftime("%d.%m.%y").to_numpy()
+    seconds = np.arange(86400)
+    hms = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds])
+    hm = np.array([f"{s // 3600:02d}:{s // 60 % 60:02d}" for s in seconds])
+
+    transactional = pd.DataFrame({
+        "SFab": sfab[location],
+        "GLin": glin[location],
+        "UbiLínea": ubi_linea[location],
+        "Material": material[location],
+        "Status": 1,
+        "Denominación": master["Denominación"].to_numpy()[location],
+        "Tipo Sum": tipo_sum[location],
+        "Consumo": consumo[location],
+        "F.Creac": dates[creac // 86400],
+        "H.Creac": hms[creac % 86400],
+        "F.Conf OT": np.where(confirmed, dates[conf // 86400], None),
+        "H.Conf OT": np.where(confirmed, hm[conf % 86400], None),
+        "Ubic.proc.": rng.choice(["PASILLO2", "PASILLO6", "BL-030", "SE-111", "KANBAN14"], len(location)),
+        "Tp.alm.proc.": rng.choice(["AGL", "C1C", "CHR", "K14"], len(location)),
+    })
+    # Chronological order, like the real files
+    return transactional.iloc[np.argsort(creac, kind="stable")].reset_index(drop=True), master
+
+
+def write_excel_files(transactional: pd.DataFrame, master: pd.DataFrame, folder: str) -> tuple:
+    """
+    Write the generated data as Excel files like the real ones (one transactional file per day).
+
+    The files are only written if they do not exist (the folder should depend on the scale and seed).
+
+    Args:
+        transactional (pd.DataFrame): Generated requests.
+        master (pd.DataFrame): Generated master data.
+        folder (str): Output folder.
+
+    Returns:
+        tuple: (list of transactional files, master data file).
+    """
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    for day, frame in transactional.groupby("F.Creac", sort=False):
+        path = os.path.join(folder, f"Peticiones demora_{pd.to_datetime(day, format='%d.%m.%y'):%Y%m%d}.xlsx")
+        if not os.path.exists(path):
+            frame.to_excel(path + ".tmp.xlsx", index=False)
+            os.replace(path + ".tmp.xlsx", path)
+        files.append(path)
+    master_path = os.path.join(folder, "Parasum_iTLS.xlsx")
+    if not os.path.exists(master_path):
+        master.to_excel(master_path + ".tmp.xlsx", index=False)
+        os.replace(master_path + ".tmp.xlsx", master_path)
+    return sorted(files), master_path
+
+
+# -----------------------------
+# 2. Benchmarks
+# -----------------------------
+def _times(function, repeats: int, setup=None) -> list:
+    """
+    Seconds of several runs of a function (setup, if given, runs before each one and is not timed).
+    """
+    times = []
+    for _ in range(repeats):
+        argument = setup() if setup is not None else None
+        begin = time.perf_counter()
+        function(argument) if setup is not None else function()
+        times.append(time.perf_counter() - begin)
+    return times
+
+
+def _pipeline(model) -> Pipeline:
+    """
+    Pipeline of script 3 with a model.
+    """
+    return Pipeline([("scaler", StandardScaler()), ("model", model)])
+
+
+def run_benchmarks(scale: int = 1, seed: int = 42, repeats: int = 3, only: list = None,
+                   data_dir: str = DATA_DIR) -> pd.DataFrame:
+    """
+    Run the benchmarks on the generated data of one scale.
+
+    The input of each benchmark is prepared before it with the steps of script 1 (the Excel files
+    are written once per scale and seed in data_dir). The fits are repeated once at most at scale
+    100, and the Excel load is not run over EXCEL_MAX_SCALE unless it is in `only`.
+
+    Args:
+        scale (int): Scale of the data (see generate_data).
+        seed (int): Seed of the generator.
+        repeats (int): Runs of each benchmark.
+        only (list): Run only these benchmarks (default BENCHMARKS).
+        data_dir (str): Folder of the generated Excel files.
+
+    Returns:
+        pd.DataFrame: One row per benchmark: benchmark, scale, rows, repeats, seconds (median) and
+            min_seconds.
+    """
+    selected = list(only or BENCHMARKS)
+    if only is None and scale > EXCEL_MAX_SCALE:
+        selected.remove("excel_load")
+    unknown = [b for b in selected if b not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {unknown} (expected some of {BENCHMARKS})")
+
+    transactional, master = generate_data(scale, seed)
+    master_index = spa_master_data.MasterDataIndex(master)
+    merged = master_index.enrich(transactional, how="left")
+    scoped = spa_prepare.filter_scope(merged.dropna()).rename(columns=spa_prepare.RENAME_COLUMNS)
+    history = spa_prepare.add_supply_time(scoped.copy()).sort_values(["PLP", "datetime_creac"])
+    history[TARGET] = spa_ingest.time_between_requests(history)
+    history = history.dropna(subset=[TARGET]).assign(source_file="synthetic")
+    X, y = history[FEATURES], history[TARGET]
+
+    tmp = tempfile.mkdtemp(prefix="spa_benchmark_")
+    db_path = os.path.join(tmp, "benchmark.db")
+    fit_repeats = 1 if scale >= 100 else repeats
+    fitted = {}
+
+    def new_db():
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        return spa_storage.connect(db_path)
+
+    def write(conn):
+        spa_storage.write_history(conn, history, replace=True)
+        conn.close()
+
+    def fit(name, model):
+        fitted[name] = _pipeline(model).fit(X, y)
+
+    cases = {
+        "excel_load": (lambda: [spa_ingest.read_excel_cached(f) for f in files], None, len(transactional)),
+        "master_merge": (lambda: spa_master_data.MasterDataIndex(master).enrich(transactional, how="left"), None,
+                         len(transactional)),
+        "timestamp_parsing": (spa_prepare.add_supply_time, lambda: scoped.copy(), len(scoped)),
+        "time_between_requests": (lambda: spa_ingest.time_between_requests(history), None, len(history)),
+        "sqlite_write": (write, new_db, len(history)),
+        "sqlite_read": (lambda: spa_storage.load_history(db_path, columns=FEATURES + [TARGET]), None, len(history)),
+        "compute_stats": (lambda: spa_stats.grouped_stats(history, ["PLP", "Material"],
+                                                          ["Supply_time_hours", TARGET]), None, len(history)),
+        "rf_fit": (lambda: fit("rf", RandomForestRegressor(n_estimators=100, random_state=42)), None, len(history)),
+        "rf_predict": (lambda: fitted["rf"].predict(X), None, len(history)),
+        "gb_fit": (lambda: fit("gb", GradientBoostingRegressor(random_state=42)), None, len(history)),
+        "gb_predict": (lambda: fitted["gb"].predict(X), None, len(history)),
+    }
+
+    if "excel_load" in selected:
+        files, _ = write_excel_files(transactional, master, os.path.join(data_dir, f"scale_{scale}_seed_{seed}"))
+    if "sqlite_read" in selected and "sqlite_write" not in selected:
+        write(new_db())
+    # The predictions need the fitted models
+    for name, needed in [("rf_predict", "rf_fit"), ("gb_predict", "gb_fit")]:
+        if name in selected and needed not in selected:
+            cases[needed][0]()
+
+    results = []
+    for name in BENCHMARKS:
+        if name not in selected:
+            continue
+        function, setup, rows = cases[name]
+        times = _times(function, fit_repeats if name.endswith("_fit") else repeats, setup)
+        results.append({"benchmark": name, "scale": scale, "rows": rows, "repeats": len(times),
+                        "seconds": float(np.median(times)), "min_seconds": float(np.min(times))})
+        print(f"{name} (scale {scale}, {rows} rows): {np.median(times):.3f} s")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.rmdir(tmp)
+    return pd.DataFrame(results)
+
+
+# -----------------------------
+# 3. Stored Results
+# -----------------------------
+def _git_commit() -> str:
+    """
+    Current git commit of the code (None outside a git repository).
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results: pd.DataFrame, db_name: str = BENCHMARK_DB, seed: int = 42) -> str:
+    """
+    Save the results of a run of the benchmarks.
+
+    Args:
+        results (pd.DataFrame): Result of run_benchmarks (one or several scales).
+        db_name (str): SQLite file of the results.
+        seed (int): Seed of the generated data.
+
+    Returns:
+        str: Id of the run.
+    """
+    run_id = uuid.uuid4().hex
+    run = {"run_id": run_id, "started": datetime.datetime.now().isoformat(timespec="seconds"),
+           "git_commit": _git_commit(), "seed": seed, "python": platform.python_version(),
+           "platform": platform.platform(), "cpus": os.cpu_count()}
+    rows = results.assign(**run)
+    conn = sqlite3.connect(db_name)
+    try:
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {RESULTS_TABLE} (
+                run_id TEXT NOT NULL,
+                started TEXT NOT NULL,
+                git_commit TEXT,
+                benchmark TEXT NOT NULL,
+                scale INTEGER NOT NULL,
+                rows INTEGER,
+                repeats INTEGER,
+                seconds REAL,
+                min_seconds REAL,
+                seed INTEGER,
+                python TEXT,
+                platform TEXT,
+                cpus INTEGER,
+                PRIMARY KEY (run_id, benchmark, scale)
+            )
+        """)
+        columns = ["run_id", "started", "git_commit", "benchmark", "scale", "rows", "repeats", "seconds",
+                   "min_seconds", "seed", "python", "platform", "cpus"]
+        with conn:
+            conn.executemany(f"INSERT INTO {RESULTS_TABLE} ({', '.join(columns)}) "
+                             f"VALUES ({', '.join('?' for _ in columns)})",
+                             rows[columns].astype(object).where(rows[columns].notna(), None).values.tolist())
+    finally:
+        conn.close()
+    return run_id
+
+
+def compare_runs(db_name: str = BENCHMARK_DB) -> pd.DataFrame:
+    """
+    Compare the last result of each benchmark and scale with the median of the previous runs.
+
+    Args:
+        db_name (str): SQLite file of the results.
+
+    Returns:
+        pd.DataFrame: benchmark, scale, last_seconds, previous_median, ratio (> 1 is slower) and
+            the commit of the last run.
+    """
+    conn = sqlite3.connect(db_name)
+    try:
+        df = pd.read_sql(f"SELECT * FROM {RESULTS_TABLE} ORDER BY started", conn)
+    finally:
+        conn.close()
+    last = df.groupby(["benchmark", "scale"]).tail(1).set_index(["benchmark", "scale"])
+    previous = df.drop(index=df.groupby(["benchmark", "scale"]).tail(1).index)
+    comparison = pd.DataFrame({
+        "last_seconds": last["seconds"],
+        "previous_median": previous.groupby(["benchmark", "scale"])["seconds"].median(),
+        "git_commit": last["git_commit"],
+    })
+    comparison["ratio"] = comparison["last_seconds"] / comparison["previous_median"]
+    return comparison.reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the slow steps on synthetic data")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="scales of the data (1 = sample files)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the generated data")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="run only these benchmarks")
+    parser.add_argument("--db", default=BENCHMARK_DB, help="SQLite file of the results")
+    parser.add_argument("--compare", action="store_true", help="only compare the last run with the previous ones")
+    args = parser.parse_args()
+
+    if not args.compare:
+        results = pd.concat([run_benchmarks(scale, args.seed, args.repeats, args.only) for scale in args.scales],
+                            ignore_index=True)
+        print(f"Run {save_results(results, args.db, args.seed)} saved in {args.db}")
+    print(compare_runs(args.db).round(3).to_string(index=False))
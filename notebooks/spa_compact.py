@@ -0,0 +1,126 @@
+"""
+Compact in-memory representation of the history frames of the three scripts.
+
+The cleaned history has the text columns (PLP, Material, Denominacion, PVB, Status, Tipo Sum,
+source_file, ...) as one Python string per row, and columns that are redundant once the derived
+ones are calculated: F.Creac/H.Creac (datetime_creac), F.Conf OT/H.Conf OT (datetime_conf) and
+Supply_time (Supply_time_hours). compact_frame converts a frame with the schema COMPACT_SCHEMA,
+taken from the schema of the history table (spa_storage.HISTORY_SCHEMA):
+- 'category': columns of repeated strings store each distinct value once and a small integer
+  code per row (only when at most MAX_CATEGORY_SHARE of the rows are distinct values).
+- 'int': integers downcast to the smallest integer type (e.g. SFab as int16).
+- 'float': floats downcast to float32 when no value changes (e.g. Consumo, Cap. Sumin).
+- The REDUNDANT_COLUMNS are dropped when the column derived from them is in the frame, except the
+  ones to keep: script 1 keeps F.Creac, H.Creac, ... because the history table stores them as
+  they were read from the files.
+
+groupby, merge, isin and the building of the model inputs are faster on the smaller frame. The
+memory before and after is printed (see memory_mb).
+"""
+
+import numpy as np
+import pandas as pd
+
+import spa_storage
+
+
+# Kind of each column of the history: 'category', 'int' or 'float' (the datetimes are kept)
+COMPACT_KINDS = {"code": "category", "text": "category", "int": "int", "real": "float"}
+COMPACT_SCHEMA = {column: COMPACT_KINDS[kind] for column, _, kind in spa_storage.HISTORY_SCHEMA
+                  if kind in COMPACT_KINDS}
+
+# Raw column -> column derived from it
+REDUNDANT_COLUMNS = {
+    "F.Creac": "datetime_creac",
+    "H.Creac": "datetime_creac",
+    "F.Conf OT": "datetime_conf",
+    "H.Conf OT": "datetime_conf",
+    "Supply_time": "Supply_time_hours",
+}
+
+# A text column is converted to category only if it has at most this share of distinct values
+MAX_CATEGORY_SHARE = 0.5
+
+
+# -----------------------------
+# 1. Memory
+# -----------------------------
+def memory_mb(df: pd.DataFrame) -> float:
+    """
+    Memory of a data frame in MB, including the Python strings of the object columns.
+    """
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+# -----------------------------
+# 2. Conversion of the Columns
+# -----------------------------
+def _to_category(values: pd.Series) -> pd.Series:
+    """
+    Column as category, if its values repeat enough.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    if values.nunique(dropna=False) > MAX_CATEGORY_SHARE * len(values):
+        return values
+    return values.astype("category")
+
+
+def _to_int(values: pd.Series) -> pd.Series:
+    """
+    Integer column (or float column of whole numbers) downcast to the smallest integer type.
+    """
+    if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values) or values.isna().any():
+        return values
+    return pd.to_numeric(values, downcast="integer")
+
+
+def _to_float(values: pd.Series) -> pd.Series:
+    """
+    Float column as float32, only if no value changes.
+    """
+    if values.dtype != np.float64:
+        return values
+    compact = values.astype(np.float32)
+    same = (compact.astype(np.float64) == values) | values.isna()
+    return compact if same.all() else values
+
+
+CONVERSIONS = {"category": _to_category, "int": _to_int, "float": _to_float}
+
+
+# -----------------------------
+# 3. Compaction of a Frame
+# -----------------------------
+def compact_frame(df: pd.DataFrame, schema: dict = None, drop_redundant: bool = True, keep: list = None,
+                  label: str = "history") -> pd.DataFrame:
+    """
+    Compact copy of a frame: categories, smaller numeric types and without the redundant columns.
+
+    The values don't change: only their representation in memory (the columns not in the schema
+    are kept as they are).
+
+    Args:
+        df (pd.DataFrame): Frame to compact.
+        schema (dict): Column -> 'category', 'int' or 'float' (default COMPACT_SCHEMA).
+        drop_redundant (bool): Drop the REDUNDANT_COLUMNS whose derived column is in the frame.
+        keep (list): Redundant columns that are not dropped (optional).
+        label (str): Name of the frame in the printed memory report.
+
+    Returns:
+        pd.DataFrame: Compact frame, with the same index.
+    """
+    schema = COMPACT_SCHEMA if schema is None else schema
+    before = memory_mb(df)
+
+    drop = []
+    if drop_redundant:
+        drop = [c for c, derived in REDUNDANT_COLUMNS.items()
+                if c in df.columns and derived in df.columns and c not in (keep or [])]
+    compact = df.drop(columns=drop)
+    compact = compact.assign(**{column: CONVERSIONS[kind](compact[column])
+                                for column, kind in schema.items() if column in compact.columns})
+
+    print(f"Memory of the {label} frame ({len(df)} rows): {before:.2f} MB -> {memory_mb(compact):.2f} MB"
+          + (f" (dropped {', '.join(drop)})" if drop else ""))
+    return compact
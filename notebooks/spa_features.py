@@ -0,0 +1,240 @@
+"""
+Feature store of the history: features of each request calculated from the earlier requests of its PLP.
+
+Script 3 only had the features of the request itself (Consumo, Cap. Sumin and Supply_time_hours).
+The table SPA_Features of the database adds, for each stored request (rowid of the history):
+- prev_gap_hours: time between the two previous requests of the PLP.
+- rolling_median_gap_hours: median of the last ROLLING_WINDOW previous gaps of the PLP.
+- prev_hour, prev_weekday and prev_is_weekend: hour, day of the week (0 = Monday) and weekend
+  flag of the previous request, when the gap to predict starts (a request on Friday evening is
+  followed by a long gap over the weekend).
+
+All the features only use the requests before the one predicted, so they are also known when
+the next request is predicted (next_features). They are calculated with vectorized groupby and
+rolling operations over the history sorted by (PLP, datetime_creac), and script 1 updates them
+only from the first day affected by each load (see refresh_features).
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import spa_storage
+
+
+FEATURE_TABLE = "SPA_Features"
+FEATURE_COLUMNS = ["prev_gap_hours", "rolling_median_gap_hours", "prev_hour", "prev_weekday", "prev_is_weekend"]
+TARGET = "time_between_MatReqs"
+
+# Number of previous gaps of the rolling median
+ROLLING_WINDOW = 5
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+
+
+# -----------------------------
+# 1. Table
+# -----------------------------
+def ensure_feature_table(conn: sqlite3.Connection):
+    """
+    Create the feature table if it does not exist (row_id is the rowid of the history table).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FEATURE_TABLE} (
+            row_id INTEGER PRIMARY KEY,
+            plp_id INTEGER NOT NULL,
+            datetime_creac INTEGER NOT NULL,
+            prev_gap_hours REAL,
+            rolling_median_gap_hours REAL,
+            prev_hour INTEGER,
+            prev_weekday INTEGER,
+            prev_is_weekend INTEGER
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_features_creac ON {FEATURE_TABLE} (datetime_creac)")
+
+
+# -----------------------------
+# 2. Calculation
+# -----------------------------
+def compute_features(requests: pd.DataFrame, window: int = ROLLING_WINDOW) -> pd.DataFrame:
+    """
+    Features of each request from the previous requests of its PLP.
+
+    Args:
+        requests (pd.DataFrame): Columns row_id, plp_id, datetime_creac (seconds since 1970-01-01)
+            and time_between_MatReqs. A row without datetime_creac is the next request of its PLP
+            (not stored yet) and goes after the others.
+        window (int): Number of previous gaps of the rolling median.
+
+    Returns:
+        pd.DataFrame: Columns row_id, plp_id, datetime_creac and FEATURE_COLUMNS, sorted by PLP
+            and datetime_creac.
+    """
+    df = requests.sort_values(["plp_id", "datetime_creac", "row_id"], kind="stable", ignore_index=True)
+    by_plp = df.groupby("plp_id", sort=False)
+
+    prev_gap = by_plp[TARGET].shift(1)
+    rolling = prev_gap.groupby(df["plp_id"], sort=False).rolling(window, min_periods=1).median()
+    # The previous request is datetime_creac - gap (also for the first stored request of a PLP,
+    # whose previous request was dropped by script 1), or the last one for the next request
+    prev_creac = (df["datetime_creac"] - (df[TARGET] * SECONDS_PER_HOUR).round())
+    prev_creac = prev_creac.fillna(by_plp["datetime_creac"].shift(1))
+    prev_time = spa_storage.from_epoch(prev_creac)
+
+    features = df[["row_id", "plp_id", "datetime_creac"]].copy()
+    features["prev_gap_hours"] = prev_gap
+    features["rolling_median_gap_hours"] = rolling.droplevel(0)
+    features["prev_hour"] = prev_time.dt.hour
+    features["prev_weekday"] = prev_time.dt.weekday
+    features["prev_is_weekend"] = (prev_time.dt.weekday >= 5).astype("Int64").where(prev_time.notna())
+    return features
+
+
+def _read_requests(conn: sqlite3.Connection, where: str, params: list) -> pd.DataFrame:
+    """
+    rowid, PLP, datetime_creac and target of the history rows selected by a WHERE condition.
+    """
+    return pd.read_sql(
+        f"SELECT h.rowid AS row_id, h.plp_id AS plp_id, p.PLP AS PLP, h.datetime_creac AS datetime_creac, "
+        f"h.{TARGET} AS {TARGET} "
+        f"FROM {spa_storage.HISTORY_TABLE} h JOIN {spa_storage.PLP_TABLE} p ON p.plp_id = h.plp_id "
+        f"WHERE {where}",
+        conn, params=params
+    )
+
+
+def _last_requests(conn: sqlite3.Connection, window: int, plp_filter: str, params: list,
+                   before: int = None) -> pd.DataFrame:
+    """
+    Last requests of some PLPs (before a time, if given), read with the index (PLP, datetime_creac).
+    """
+    bound = "AND c.datetime_creac < ?" if before is not None else ""
+    return _read_requests(
+        conn,
+        f"h.rowid IN (SELECT c.rowid FROM {spa_storage.HISTORY_TABLE} c WHERE c.plp_id = p.plp_id {bound} "
+        f"ORDER BY c.datetime_creac DESC, c.rowid DESC LIMIT ?) AND {plp_filter}",
+        ([before] if before is not None else []) + [window] + params
+    )
+
+
+# -----------------------------
+# 3. Update on Ingest
+# -----------------------------
+def refresh_features(conn: sqlite3.Connection, days: list = None, window: int = ROLLING_WINDOW) -> int:
+    """
+    Calculate the features again from the first of some days (or all), from the history table.
+
+    The features of a request depend on the earlier requests of its PLP, so all the requests from
+    the first day given are calculated again, with the last `window` earlier requests of each PLP
+    as context. For the normal daily load the first day is the new one; late-arriving data and
+    replaced files go back to their first day (the same days as spa_aggregates.affected_days).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        days (list): Days since 1970-01-01. None calculates all the requests.
+        window (int): Number of previous gaps of the rolling median.
+
+    Returns:
+        int: Number of requests calculated.
+    """
+    ensure_feature_table(conn)
+    if days is None:
+        since = None
+        requests = _read_requests(conn, "1 = 1", [])
+    else:
+        if not days:
+            return 0
+        since = min(int(d) for d in days) * SECONDS_PER_DAY
+        new = _read_requests(conn, "h.datetime_creac >= ?", [since])
+        context = _last_requests(conn, window, f"h.plp_id IN ({', '.join('?' for _ in new['plp_id'].unique())})",
+                                 new["plp_id"].unique().tolist(), before=since)
+        requests = pd.concat([context, new], ignore_index=True)
+
+    features = compute_features(requests, window)
+    if since is not None:
+        features = features[features["datetime_creac"] >= since]
+    values = [features[c].astype(object).where(features[c].notna(), None).tolist() for c in features.columns]
+
+    columns = ", ".join(features.columns)
+    placeholders = ", ".join("?" for _ in features.columns)
+    with conn:
+        if since is None:
+            conn.execute(f"DELETE FROM {FEATURE_TABLE}")
+        else:
+            conn.execute(f"DELETE FROM {FEATURE_TABLE} WHERE datetime_creac >= ?", (since,))
+        conn.executemany(f"INSERT OR REPLACE INTO {FEATURE_TABLE} ({columns}) VALUES ({placeholders})",
+                         list(zip(*values)))
+    return len(features)
+
+
+# -----------------------------
+# 4. Read for Training and Prediction
+# -----------------------------
+def load_features(db_name: str, columns: list = None, plps: list = None) -> pd.DataFrame:
+    """
+    History with the features of the store (training data of script 3).
+
+    The store is calculated again if it does not have one row per request of the history (e.g.
+    when script 1 ran with keep_features = False).
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        columns (list): Columns of the history to read (default all).
+        plps (list): Keep only these PLPs (optional).
+
+    Returns:
+        pd.DataFrame: Columns of the history and FEATURE_COLUMNS (missing when there are not
+            enough previous requests, e.g. for the first request of each PLP).
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        ensure_feature_table(conn)
+        if conn.execute(f"SELECT COUNT(*) FROM {FEATURE_TABLE}").fetchone()[0] != spa_storage.history_row_count(conn):
+            refresh_features(conn)
+        history = spa_storage.read_history(conn, columns, plps, row_id=True)
+        features = pd.read_sql(f"SELECT row_id, {', '.join(FEATURE_COLUMNS)} FROM {FEATURE_TABLE}", conn)
+    finally:
+        conn.close()
+    return history.merge(features, on="row_id", how="left").drop(columns="row_id")
+
+
+def next_features(db_name: str, plps: list = None, window: int = ROLLING_WINDOW) -> pd.DataFrame:
+    """
+    Features of the next request of some PLPs, from their last stored requests (prediction data).
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        plps (list): PLP ids (default all).
+        window (int): Number of previous gaps of the rolling median (as in the store).
+
+    Returns:
+        pd.DataFrame: One row per PLP: PLP, last_request (datetime of its last request) and
+            FEATURE_COLUMNS.
+    """
+    if plps is None:
+        plp_filter, params = "1 = 1", []
+    else:
+        plp_filter, params = f"p.PLP IN ({', '.join('?' for _ in plps)})", list(plps)
+    conn = spa_storage.connect(db_name)
+    try:
+        # window + 1 requests: the gap of the oldest one is not used by the rolling median of the next
+        last = _last_requests(conn, window + 1, plp_filter, params)
+    finally:
+        conn.close()
+
+    plp_names = last.groupby("plp_id")["PLP"].first()
+    upcoming = pd.DataFrame({"row_id": np.nan, "plp_id": plp_names.index, "datetime_creac": np.nan, TARGET: np.nan})
+    features = compute_features(pd.concat([last, upcoming], ignore_index=True), window)
+    features = features[features["datetime_creac"].isna()]
+
+    result = features[["plp_id"] + FEATURE_COLUMNS].copy()
+    result.insert(0, "PLP", result["plp_id"].map(plp_names))
+    result.insert(1, "last_request", result["plp_id"].map(last.groupby("plp_id")["datetime_creac"].max()))
+    result["last_request"] = spa_storage.from_epoch(result["last_request"])
+    return result.drop(columns="plp_id").reset_index(drop=True)
@@ -0,0 +1,232 @@
+"""
+Models of script 3 trained per group of PLPs (one RandomForest for each group).
+
+The PLPs behave very differently, so one model for all of them explains only a part of the
+variance. The PLPs are grouped by plant (SFab), by the prefix of the PVB (e.g. '09L3') or by
+their behaviour (clusters of the statistics of each PLP), and one model is trained for each
+group:
+- The features and the target of all the rows, sorted by group, are written once to a NumPy file.
+  The worker processes open it memory-mapped and only receive the rows of their group, so the
+  data is not pickled to each worker.
+- Each group model is saved in the registry (spa_models) with the fingerprint of its data. A
+  group whose data did not change since the last run is not trained again.
+"""
+
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.cluster import KMeans
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+import spa_models
+
+
+GROUP_METHODS = ["sfab", "pvb", "behaviour"]
+OTHER_GROUP = "other"
+MATRIX_DIR = "cache/group_models"
+MIN_FIT_ROWS = 10
+
+
+# -----------------------------
+# 1. Groups of PLPs
+# -----------------------------
+def plp_groups(df: pd.DataFrame, by: str = "sfab", n_groups: int = 4, min_rows: int = 50,
+               target: str = "time_between_MatReqs", random_state: int = 42) -> pd.Series:
+    """
+    Group of each PLP.
+
+    Args:
+        df (pd.DataFrame): History with the columns PLP, SFab, PVB, Consumo, Supply_time_hours and the target.
+        by (str): 'sfab' (plant), 'pvb' (prefix of the PVB, e.g. '09L3') or 'behaviour' (clusters
+            of the median and std of the target, median supply time, consumption and number of
+            requests of each PLP).
+        n_groups (int): Number of clusters ('behaviour' only).
+        min_rows (int): The groups with fewer rows are put together in the group 'other'.
+        target (str): Target column.
+        random_state (int): Seed of the clustering.
+
+    Returns:
+        pd.Series: Group label of each PLP (index PLP).
+    """
+    if by == "sfab":
+        labels = df.groupby("PLP", observed=True)["SFab"].first().astype(str)
+    elif by == "pvb":
+        labels = df.groupby("PLP", observed=True)["PVB"].first().str.split("_").str[0]
+    elif by == "behaviour":
+        stats = df.groupby("PLP", observed=True).agg(median=(target, "median"), std=(target, "std"),
+                                      supply=("Supply_time_hours", "median"), consumo=("Consumo", "median"),
+                                      requests=(target, "size")).fillna(0)
+        values = StandardScaler().fit_transform(np.log1p(stats.clip(lower=0)))
+        clusters = KMeans(n_clusters=min(n_groups, len(stats)), n_init=10, random_state=random_state).fit_predict(values)
+        labels = pd.Series([f"c{c}" for c in clusters], index=stats.index)
+    else:
+        raise ValueError(f"Unknown grouping: {by} (expected one of {GROUP_METHODS})")
+
+    rows = df["PLP"].map(labels).value_counts()
+    small = rows.index[rows < min_rows]
+    labels = labels.where(~labels.isin(small), OTHER_GROUP)
+    labels.name = "group"
+    return labels
+
+
+# -----------------------------
+# 2. Training per Group
+# -----------------------------
+def model_name(partition: str, group: str) -> str:
+    """
+    Name of a group model in the registry (e.g. 'group_sfab_401').
+    """
+    return re.sub(r"[^\w\-]", "_", f"group_{partition}_{group}")
+
+
+def write_feature_matrix(df: pd.DataFrame, features: list, target: str, path: str) -> str:
+    """
+    Write the features and the target (last column) of all the rows to a .npy file.
+
+    Args:
+        df (pd.DataFrame): Data.
+        features (list): Feature columns.
+        target (str): Target column.
+        path (str): Output file.
+
+    Returns:
+        str: Path of the file.
+    """
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(len(df), len(features) + 1))
+    matrix[:, :-1] = df[features].to_numpy(dtype=np.float64)
+    matrix[:, -1] = df[target].to_numpy(dtype=np.float64)
+    matrix.flush()
+    del matrix
+    return path
+
+
+def _train_group(task: dict) -> dict:
+    """
+    Train and save the model of one group (runs in a worker process).
+
+    Args:
+        task (dict): Group, name, rows (start, stop) in the feature matrix, path of the matrix,
+            pipeline (not fitted), features, target, fingerprint, PLPs and registry folder.
+
+    Returns:
+        dict: Result of the group (see train_group_models).
+    """
+    start = time.perf_counter()
+    block = np.load(task["matrix"], mmap_mode="r")[task["start"]:task["stop"]]
+    X = pd.DataFrame(np.array(block[:, :-1]), columns=task["features"])
+    y = pd.Series(np.array(block[:, -1]), name=task["target"])
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    pipeline = clone(task["pipeline"]).fit(X_train, y_train)
+    y_true = y_test.to_numpy()
+    errors = y_true - pipeline.predict(X_test)
+
+    sse, sst = np.sum(errors ** 2), np.sum((y_true - y_true.mean()) ** 2)
+    metrics = {"rmse": np.sqrt(sse / len(errors)), "test_rows": len(errors),
+               "r2": 1 - sse / sst if sst > 0 else np.nan}  # no R² if the target is constant
+    metadata = spa_models.save_model(pipeline, task["name"], task["features"], task["target"], X_train, y_train,
+                                     metrics, task["registry_dir"], fingerprint=task["fingerprint"],
+                                     extra={"group": task["group"], "plps": task["plps"]})
+    return _result(metadata, trained=True, seconds=time.perf_counter() - start)
+
+
+def _result(metadata: dict, trained: bool, seconds: float = 0.0) -> dict:
+    """
+    Result of a group from the metadata of its model.
+    """
+    return {"group": metadata["group"], "name": metadata["name"], "version": metadata["version"],
+            "plps": len(metadata["plps"]), "rows": metadata["train_rows"], **metadata["metrics"],
+            "trained": trained, "seconds": seconds}
+
+
+def train_group_models(df: pd.DataFrame, groups: pd.Series, pipeline, features: list, target: str,
+                       partition: str = "sfab", registry_dir: str = spa_models.REGISTRY_DIR, max_workers: int = None,
+                       matrix_dir: str = MATRIX_DIR) -> pd.DataFrame:
+    """
+    Train one model per group of PLPs in a process pool, skipping the groups whose data did not change.
+
+    The workers are started with fork (Linux), so the script calling it does not need to keep its
+    workflow under `if __name__ == "__main__":`. Without fork the groups are trained one by one.
+
+    Args:
+        df (pd.DataFrame): History with the column PLP, the features and the target.
+        groups (pd.Series): Group of each PLP (see plp_groups).
+        pipeline (Pipeline): Pipeline to train for each group (cloned, so it can be a fitted one).
+        features (list): Feature columns.
+        target (str): Target column.
+        partition (str): Name of the grouping, used in the names of the models (e.g. 'sfab').
+        registry_dir (str): Folder of the registry.
+        max_workers (int): Worker processes. None uses all the CPU cores, 1 trains sequentially.
+        matrix_dir (str): Folder of the shared feature matrix.
+
+    Returns:
+        pd.DataFrame: One row per group: group, name, version, plps, rows (training rows), rmse, r2,
+            test_rows, trained (False if skipped) and seconds.
+    """
+    data = df.assign(group=df["PLP"].map(groups)).dropna(subset=["group"])
+    data = data.sort_values(["group", "PLP"], kind="stable").reset_index(drop=True)
+    os.makedirs(matrix_dir, exist_ok=True)
+    matrix = write_feature_matrix(data, features, target, os.path.join(matrix_dir, f"features_{partition}.npy"))
+    model = pipeline.steps[-1][1] if hasattr(pipeline, "steps") else pipeline
+
+    results, tasks = [], []
+    for group, index in data.groupby("group", observed=True).indices.items():
+        part = data.iloc[index[0]:index[-1] + 1]
+        name = model_name(partition, group)
+        if len(part) < MIN_FIT_ROWS:
+            print(f"Group {group}: only {len(part)} rows, not trained (the global model is used)")
+            continue
+        fingerprint = spa_models.data_fingerprint(part[["PLP"] + features], part[target])
+        existing = spa_models.find_version(name, fingerprint, model.get_params(), registry_dir)
+        if existing is not None:
+            results.append(_result(existing, trained=False))
+            continue
+        tasks.append({"group": group, "name": name, "start": int(index[0]), "stop": int(index[-1]) + 1,
+                      "matrix": matrix, "pipeline": clone(pipeline), "features": list(features), "target": target,
+                      "fingerprint": fingerprint, "plps": sorted(part["PLP"].unique()), "registry_dir": registry_dir})
+
+    workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        results += [_train_group(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            results += list(executor.map(_train_group, tasks))
+    return pd.DataFrame(results).sort_values("group", ignore_index=True)
+
+
+# -----------------------------
+# 3. Prediction per Group
+# -----------------------------
+def predict_by_group(df: pd.DataFrame, results: pd.DataFrame, registry_dir: str = spa_models.REGISTRY_DIR,
+                     fallback: str = "rf_grid") -> pd.Series:
+    """
+    Predict each row with the model of the group of its PLP (the PLPs of no group use the fallback model).
+
+    Args:
+        df (pd.DataFrame): Rows with the column PLP and the features.
+        results (pd.DataFrame): Group models to use (result of train_group_models).
+        registry_dir (str): Folder of the registry.
+        fallback (str): Model of the registry for the PLPs of no group.
+
+    Returns:
+        pd.Series: Predictions, with the index of df.
+    """
+    plp_model, versions = {}, {fallback: None}
+    for name, version in zip(results["name"], results["version"]):
+        metadata = spa_models.load_metadata(name, version, registry_dir)
+        plp_model.update({plp: name for plp in metadata["plps"]})
+        versions[name] = version
+
+    predictions = pd.Series(np.nan, index=df.index)
+    names = df["PLP"].map(plp_model).fillna(fallback)
+    for name, index in names.groupby(names).groups.items():
+        predictor = spa_models.load_model(name, versions[name], registry_dir)
+        predictions.loc[index] = predictor.predict(df.loc[index])[predictor.metadata["target"]].to_numpy()
+    return predictions
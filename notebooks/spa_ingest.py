@@ -0,0 +1,597 @@
+"""
+Helpers for the ingestion of the daily transactional Excel files.
+
+Every day a new file "Peticiones demora_YYYYMMDD.xlsx" is placed in the data folder.
+In incremental mode a manifest table in the SQLite database keeps the name, size and
+hash of each file already loaded, so the next run only parses the new or changed files.
+
+Parsing a workbook with openpyxl is slow, so the files can also be read through a columnar
+cache (Parquet, or pickle when pyarrow is not installed) that keeps only the needed columns,
+and several files can be read in parallel with a process pool.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import spa_storage
+
+
+MANIFEST_TABLE = "SPA_Ingest_Manifest"
+WATERMARK_TABLE = "SPA_PLP_Watermarks"
+
+
+# -----------------------------
+# 1. File Fingerprint
+# -----------------------------
+def file_fingerprint(path: str) -> dict:
+    """
+    Compute the name, size and SHA-256 hash of a file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        dict: Keys 'file_name', 'file_size' and 'file_hash'.
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return {
+        "file_name": os.path.basename(path),
+        "file_size": os.path.getsize(path),
+        "file_hash": sha.hexdigest(),
+    }
+
+
+# -----------------------------
+# 2. Manifest Table
+# -----------------------------
+def ensure_manifest_table(conn: sqlite3.Connection):
+    """
+    Create the manifest table if it does not exist yet.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            file_name   TEXT PRIMARY KEY,
+            file_size   INTEGER NOT NULL,
+            file_hash   TEXT NOT NULL,
+            rows_loaded INTEGER NOT NULL,
+            ingested_at TEXT NOT NULL
+        )
+    """)
+
+
+def load_manifest(conn: sqlite3.Connection) -> dict:
+    """
+    Load the manifest of already ingested files.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+
+    Returns:
+        dict: File name -> (file_size, file_hash).
+    """
+    ensure_manifest_table(conn)
+    rows = conn.execute(f"SELECT file_name, file_size, file_hash FROM {MANIFEST_TABLE}").fetchall()
+    return {name: (size, file_hash) for name, size, file_hash in rows}
+
+
+def select_new_or_changed_files(conn: sqlite3.Connection, files: list) -> tuple:
+    """
+    Compare the files in the data folder with the manifest.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        files (list): Paths of the Excel files found in the data folder.
+
+    Returns:
+        tuple: (new_files, changed_files, fingerprints). The first two are lists of paths,
+        the last one a dict path -> fingerprint for all the files to load.
+    """
+    manifest = load_manifest(conn)
+    new_files, changed_files, fingerprints = [], [], {}
+    for path in files:
+        fp = file_fingerprint(path)
+        known = manifest.get(fp["file_name"])
+        if known is None:
+            new_files.append(path)
+        elif known != (fp["file_size"], fp["file_hash"]):
+            changed_files.append(path)
+        else:
+            continue
+        fingerprints[path] = fp
+    return new_files, changed_files, fingerprints
+
+
+def record_ingested_files(conn: sqlite3.Connection, fingerprints: dict, rows_per_file: dict):
+    """
+    Insert or update the manifest entries of the files just loaded.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        fingerprints (dict): Path -> fingerprint as returned by file_fingerprint.
+        rows_per_file (dict): File name -> number of cleaned rows stored.
+    """
+    ensure_manifest_table(conn)
+    now = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (file_name, file_size, file_hash, rows_loaded, ingested_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(file_name) DO UPDATE SET
+            file_size = excluded.file_size,
+            file_hash = excluded.file_hash,
+            rows_loaded = excluded.rows_loaded,
+            ingested_at = excluded.ingested_at
+        """,
+        [
+            (fp["file_name"], fp["file_size"], fp["file_hash"],
+             int(rows_per_file.get(fp["file_name"], 0)), now)
+            for fp in fingerprints.values()
+        ],
+    )
+
+
+def clear_manifest(conn: sqlite3.Connection):
+    """
+    Remove all the entries of the manifest (used when the table is rebuilt in full mode).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    ensure_manifest_table(conn)
+    conn.execute(f"DELETE FROM {MANIFEST_TABLE}")
+
+
+# -----------------------------
+# 3. Watermarks of the PLPs
+# -----------------------------
+def ensure_watermark_table(conn: sqlite3.Connection):
+    """
+    Create the table with the first and last Material Request per PLP if it does not exist yet.
+
+    The first request of each PLP is not in the history (it has no previous request, it is kept in
+    spa_storage.FIRST_REQUEST_TABLE), so the request times at both ends of each PLP are kept apart:
+    the last one to compare the next day with it, the first one to find the PLPs of late data.
+    The times are stored as integer epochs, like in the history table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            PLP                  TEXT PRIMARY KEY,
+            first_datetime_creac INTEGER NOT NULL,
+            last_datetime_creac  INTEGER NOT NULL
+        )
+    """)
+
+
+def load_watermarks(conn: sqlite3.Connection) -> pd.DataFrame:
+    """
+    Get the first and last Material Request already loaded for each PLP.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+
+    Returns:
+        pd.DataFrame: Columns first_datetime_creac and last_datetime_creac indexed by PLP
+        (empty if there is no history yet).
+    """
+    ensure_watermark_table(conn)
+    df = pd.read_sql(f"SELECT PLP, first_datetime_creac, last_datetime_creac FROM {WATERMARK_TABLE}",
+                     conn, index_col="PLP")
+    for column in ("first_datetime_creac", "last_datetime_creac"):
+        df[column] = spa_storage.from_epoch(df[column])
+    return df
+
+
+def update_watermarks(conn: sqlite3.Connection, df: pd.DataFrame, replace: bool = False):
+    """
+    Store the first and last Material Request per PLP of a batch, keeping the earliest and latest.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        df (pd.DataFrame): Batch with the columns PLP and datetime_creac (before dropping NaN diffs).
+        replace (bool): Create the table again first (full mode).
+    """
+    if replace:
+        conn.execute(f"DROP TABLE IF EXISTS {WATERMARK_TABLE}")
+    ensure_watermark_table(conn)
+    ends = df.dropna(subset=["datetime_creac"]).groupby("PLP", observed=True)["datetime_creac"].agg(["min", "max"])
+    ends = ends.apply(spa_storage.to_epoch)
+    conn.executemany(
+        f"""
+        INSERT INTO {WATERMARK_TABLE} (PLP, first_datetime_creac, last_datetime_creac) VALUES (?, ?, ?)
+        ON CONFLICT(PLP) DO UPDATE SET
+            first_datetime_creac = MIN(first_datetime_creac, excluded.first_datetime_creac),
+            last_datetime_creac = MAX(last_datetime_creac, excluded.last_datetime_creac)
+        """,
+        [(plp, int(first), int(last)) for plp, first, last in ends.itertuples()],
+    )
+
+
+def rebuild_watermarks(conn: sqlite3.Connection, plps: list):
+    """
+    Calculate the watermarks of some PLPs again from their stored rows (e.g. after rows were deleted).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        plps (list): PLP ids.
+    """
+    ensure_watermark_table(conn)
+    stored = pd.concat([spa_storage.read_request_times(conn, plps, table)
+                        for table in (spa_storage.HISTORY_TABLE, spa_storage.FIRST_REQUEST_TABLE)])
+    conn.executemany(f"DELETE FROM {WATERMARK_TABLE} WHERE PLP = ?", [(plp,) for plp in plps])
+    update_watermarks(conn, stored)
+
+
+# -----------------------------
+# 4. Time between Requests
+# -----------------------------
+def time_between_requests(df: pd.DataFrame, previous_times: pd.Series = None) -> pd.Series:
+    """
+    Time in hours between consecutive Material Requests of the same PLP.
+
+    When the timestamps of the last stored request per PLP are given, the first request of
+    each PLP in the new batch is compared with them instead of getting NaN.
+
+    Args:
+        df (pd.DataFrame): Data frame with the columns PLP and datetime_creac.
+        previous_times (pd.Series): Last datetime_creac per PLP already stored (optional).
+
+    Returns:
+        pd.Series: Hours between requests, aligned with df.
+    """
+    creac = df["datetime_creac"]
+    if df.empty:
+        return pd.Series(index=df.index, dtype="float64")
+    if previous_times is not None and len(previous_times) > 0:
+        seeds = pd.DataFrame({"PLP": previous_times.index, "datetime_creac": previous_times.values})
+        seeds = seeds[seeds["PLP"].isin(df["PLP"].unique())]
+        combined = pd.concat([seeds, df[["PLP", "datetime_creac"]]], keys=["seed", "batch"])
+    else:
+        combined = pd.concat([df[["PLP", "datetime_creac"]]], keys=["batch"])
+
+    combined = combined.sort_values(by=["PLP", "datetime_creac"], kind="stable")
+    diff = combined.groupby("PLP", observed=True)["datetime_creac"].diff().dt.total_seconds() / 3600
+    return diff.loc["batch"].reindex(creac.index)
+
+
+def find_late_plps(df: pd.DataFrame, watermarks: pd.DataFrame) -> list:
+    """
+    PLPs of a batch with requests older than the last request already loaded (late-arriving data).
+
+    Args:
+        df (pd.DataFrame): Batch with the columns PLP and datetime_creac.
+        watermarks (pd.DataFrame): Result of load_watermarks.
+
+    Returns:
+        list: PLP ids.
+    """
+    batch_first = df.dropna(subset=["datetime_creac"]).groupby("PLP", observed=True)["datetime_creac"].min()
+    last = watermarks["last_datetime_creac"].reindex(batch_first.index)
+    return batch_first.index[batch_first < last].tolist()
+
+
+def recalculate_plps(conn: sqlite3.Connection, since: pd.Series, df: pd.DataFrame = None) -> pd.Series:
+    """
+    Time between requests of the stored rows of some PLPs calculated again from a time onwards.
+
+    The stored requests of each PLP (history and first request) are joined with the new rows, if
+    any, and the differences are calculated again. The stored rows from `since` onwards get their
+    new time_between_MatReqs. The earliest request of each PLP is kept in the first request table:
+    a first request with an older request before it moves to the history, and a history row that
+    is now the earliest one of its PLP (its first request was deleted) moves to that table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        since (pd.Series): datetime_creac per PLP from which the stored rows change.
+        df (pd.DataFrame): New rows of the PLPs (PLP and datetime_creac), optional.
+
+    Returns:
+        pd.Series: Hours between requests of the rows of df, aligned with df (None without df).
+    """
+    plps = since.index.tolist()
+    parts = {
+        "first": spa_storage.read_request_times(conn, plps, spa_storage.FIRST_REQUEST_TABLE),
+        "stored": spa_storage.read_request_times(conn, plps),
+    }
+    if df is not None:
+        parts["batch"] = df[["PLP", "datetime_creac"]].astype({"PLP": object})
+    combined = pd.concat(parts)
+    combined = combined.sort_values(by=["PLP", "datetime_creac"], kind="stable")
+    by_plp = combined.groupby("PLP", observed=True)
+    combined["time_between_MatReqs"] = by_plp["datetime_creac"].diff().dt.total_seconds() / 3600
+    combined = combined[combined["datetime_creac"] >= combined["PLP"].map(since)]
+    part = combined.index.get_level_values(0)
+
+    # Stored rows from `since` onwards, and the first requests that are not the earliest anymore
+    history = combined[part == "stored"]
+    to_first = history["time_between_MatReqs"].isna()
+    spa_storage.update_time_between_requests(conn, history.loc[~to_first, "row_id"].tolist(),
+                                             history.loc[~to_first, "time_between_MatReqs"].tolist())
+    spa_storage.move_requests(conn, history.loc[to_first, "row_id"].tolist(), [None] * int(to_first.sum()),
+                              spa_storage.HISTORY_TABLE, spa_storage.FIRST_REQUEST_TABLE)
+    firsts = combined[(part == "first") & combined["time_between_MatReqs"].notna()]
+    spa_storage.move_requests(conn, firsts["row_id"].tolist(), firsts["time_between_MatReqs"].tolist(),
+                              spa_storage.FIRST_REQUEST_TABLE, spa_storage.HISTORY_TABLE)
+    print(f"Recalculated {len(plps)} PLPs: {len(history)} stored rows updated, "
+          f"{len(firsts) + int(to_first.sum())} first requests moved")
+
+    if df is None:
+        return None
+    return combined[part == "batch"]["time_between_MatReqs"].droplevel(0).reindex(df.index)
+
+
+def store_first_requests(conn: sqlite3.Connection, df: pd.DataFrame, replace: bool = False):
+    """
+    Store the first request of the PLPs of a batch, before the rows without time_between_MatReqs are dropped.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        df (pd.DataFrame): Cleaned batch with the column time_between_MatReqs.
+        replace (bool): Delete the stored first requests of all the PLPs first (full mode).
+    """
+    first = df[df["time_between_MatReqs"].isna() & df["datetime_creac"].notna()]
+    first = first.sort_values(by="datetime_creac", kind="stable").drop_duplicates(subset="PLP")
+    spa_storage.write_first_requests(conn, first, replace=replace)
+
+
+def remove_files(conn: sqlite3.Connection, file_names: list) -> list:
+    """
+    Delete the stored rows of some files (changed files to load again) and recalculate their PLPs.
+
+    The rows after a deleted request get a new time_between_MatReqs, and the watermarks of the
+    PLPs are calculated again from the rows that are left.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        file_names (list): Names of the source files.
+
+    Returns:
+        list: PLPs recalculated.
+    """
+    if not file_names:
+        return []
+    deleted = spa_storage.read_file_request_times(conn, file_names).dropna(subset=["datetime_creac"])
+    spa_storage.delete_rows_of_files(conn, file_names)
+    since = deleted.groupby("PLP")["datetime_creac"].min()
+    if not since.empty:
+        recalculate_plps(conn, since)
+        rebuild_watermarks(conn, since.index.tolist())
+    return since.index.tolist()
+
+
+def incremental_time_between_requests(conn: sqlite3.Connection, df: pd.DataFrame) -> pd.Series:
+    """
+    Time between requests of a new batch, using the watermarks of the PLPs already loaded.
+
+    Only the rows of the batch are sorted: the first request of each PLP is compared with its
+    last stored request. The PLPs with late-arriving requests (older than their last stored
+    request) are recalculated with recalculate_plps from their first new request.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        df (pd.DataFrame): Batch with the columns PLP and datetime_creac.
+
+    Returns:
+        pd.Series: Hours between requests, aligned with df.
+    """
+    watermarks = load_watermarks(conn)
+    late = find_late_plps(df, watermarks)
+    is_late = df["PLP"].isin(late)
+
+    hours = time_between_requests(df[~is_late], watermarks["last_datetime_creac"])
+    if late:
+        batch_first = df[is_late].groupby("PLP", observed=True)["datetime_creac"].min()
+        hours = pd.concat([hours, recalculate_plps(conn, batch_first, df[is_late])])
+    return hours.reindex(df.index)
+
+
+# -----------------------------
+# 5. Columnar Cache of Excel Files
+# -----------------------------
+def _columnar_format() -> str:
+    """
+    Format used for the cache: Parquet if pyarrow is installed, pickle otherwise.
+
+    Returns:
+        str: 'parquet' or 'pickle'.
+    """
+    try:
+        import pyarrow  # noqa: F401
+        return "parquet"
+    except ImportError:
+        return "pickle"
+
+
+def _cache_paths(path: str, cache_dir: str) -> tuple:
+    """
+    Paths of the data file and the metadata file of the cache entry of a source file.
+
+    Args:
+        path (str): Path to the source Excel file.
+        cache_dir (str): Folder of the cache.
+
+    Returns:
+        tuple: (data_path, metadata_path) without the data extension.
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(path))[0]}_{key}")
+    return base, base + ".json"
+
+
+def _source_signature(path: str) -> dict:
+    """
+    Source path, modification time and size of a file, used as key of the cache entry.
+
+    Args:
+        path (str): Path to the source file.
+
+    Returns:
+        dict: Keys 'source', 'mtime_ns' and 'size'.
+    """
+    stat = os.stat(path)
+    return {"source": os.path.abspath(path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def read_excel_cached(path: str, columns: list = None, cache_dir: str = None) -> pd.DataFrame:
+    """
+    Read an Excel file through a columnar cache.
+
+    The first read parses the workbook with openpyxl and stores a columnar copy (Parquet, or
+    pickle without pyarrow). Next reads load the copy while the source path, modification time,
+    size and list of columns are the same; otherwise the entry is rebuilt.
+
+    Args:
+        path (str): Path to the Excel file.
+        columns (list): Columns to read. The ones not present in the file are ignored (optional).
+        cache_dir (str): Folder of the cache. If None the file is read without cache.
+
+    Returns:
+        pd.DataFrame: Content of the first sheet.
+    """
+    usecols = None
+    if columns is not None:
+        wanted = set(columns)
+        usecols = lambda c: c in wanted  # noqa: E731
+    if cache_dir is None:
+        return pd.read_excel(path, usecols=usecols)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    base, meta_path = _cache_paths(path, cache_dir)
+    signature = _source_signature(path)
+    signature["columns"] = sorted(columns) if columns is not None else None
+
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        data_path = base + "." + meta["format"]
+        if {k: meta.get(k) for k in signature} == signature and os.path.exists(data_path):
+            if meta["format"] == "parquet":
+                return pd.read_parquet(data_path)
+            return pd.read_pickle(data_path)
+        # Stale entry: source changed or different columns
+        _remove_cache_entry(base, meta_path)
+
+    df = pd.read_excel(path, usecols=usecols)
+
+    fmt = _columnar_format()
+    if fmt == "parquet":
+        try:
+            df.to_parquet(base + ".parquet.tmp", index=False)
+        except (TypeError, ValueError, ImportError):
+            # Columns with mixed types can't be written as Parquet
+            fmt = "pickle"
+    if fmt == "pickle":
+        df.to_pickle(base + ".pickle.tmp")
+    os.replace(base + f".{fmt}.tmp", base + f".{fmt}")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({**signature, "format": fmt}, f)
+    return df
+
+
+def _remove_cache_entry(base: str, meta_path: str):
+    """
+    Delete the files of one cache entry.
+
+    Args:
+        base (str): Path of the data file without extension.
+        meta_path (str): Path of the metadata file.
+    """
+    for candidate in (base + ".parquet", base + ".pickle", meta_path):
+        if os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def evict_stale_cache_entries(cache_dir: str) -> int:
+    """
+    Delete the cache entries whose source file was removed or changed.
+
+    Args:
+        cache_dir (str): Folder of the cache.
+
+    Returns:
+        int: Number of entries deleted.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+    evicted = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".json"):
+            continue
+        meta_path = os.path.join(cache_dir, name)
+        base = meta_path[:-len(".json")]
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        source = meta.get("source")
+        if (source is None or not os.path.exists(source)
+                or {k: meta.get(k) for k in ("source", "mtime_ns", "size")} != _source_signature(source)):
+            _remove_cache_entry(base, meta_path)
+            evicted += 1
+    return evicted
+
+
+# -----------------------------
+# 6. Parallel Reading of Excel Files
+# -----------------------------
+def _read_excel_timed(path: str, columns: list = None, cache_dir: str = None) -> tuple:
+    """
+    Read one Excel file (through the cache) and measure the time spent.
+
+    Args:
+        path (str): Path to the Excel file.
+        columns (list): Columns to read (optional).
+        cache_dir (str): Folder of the cache (optional).
+
+    Returns:
+        tuple: (DataFrame, seconds).
+    """
+    start = time.perf_counter()
+    df = read_excel_cached(path, columns=columns, cache_dir=cache_dir)
+    return df, time.perf_counter() - start
+
+
+def read_excel_files(files: list, columns: list = None, cache_dir: str = None,
+                     max_workers: int = None) -> tuple:
+    """
+    Read several Excel files, in parallel with a process pool when there is more than one.
+
+    Parsing with openpyxl is CPU-bound, so processes (not threads) are used. The frames are
+    returned in the same order as the files. Scripts using it with max_workers > 1 must keep
+    their workflow under `if __name__ == "__main__":` (the workers import the main module on Windows).
+
+    Args:
+        files (list): Paths of the Excel files.
+        columns (list): Columns to read (optional).
+        cache_dir (str): Folder of the columnar cache (optional).
+        max_workers (int): Number of worker processes. None uses all the CPU cores, 1 reads sequentially.
+
+    Returns:
+        tuple: (frames, parse_times). List of DataFrames in the order of files, and dict path -> seconds.
+    """
+    workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    workers = min(workers, len(files))
+
+    if workers <= 1:
+        results = [_read_excel_timed(f, columns, cache_dir) for f in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_read_excel_timed, files,
+                                        [columns] * len(files), [cache_dir] * len(files)))
+
+    frames = [df for df, _ in results]
+    parse_times = {f: seconds for f, (_, seconds) in zip(files, results)}
+    return frames, parse_times
@@ -0,0 +1,151 @@
+"""
+Indexed lookup of the master data (Parasum_iTLS.xlsx).
+
+The master data sheet has more than 30 columns, but the analysis only needs a few attributes
+of each consumption point (PLP, ÁrSumProd., Cap. Sumin, validity dates). The index loads the
+sheet once, keeps only these attributes with the merge keys as index, and enriches batches of
+transactional data by key lookup instead of a merge with the whole sheet. It is also used to
+get the attributes of a PLP / Material for the prediction step.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.extensions import take
+
+import spa_ingest
+import spa_prepare
+
+
+MERGE_KEYS = ["SFab", "GLin", "UbiLínea", "Material"]
+
+# Attributes of the master data used in the analysis
+MASTER_ATTRIBUTES = ["UbicDest", "ÁrSumProd.", "Válido de", "Válido a", "Cap. Sumin"]
+
+
+class MasterDataIndex:
+    """
+    Compact master data indexed by the merge keys.
+
+    Attributes:
+        keys (list): Key columns (SFab, GLin, UbiLínea, Material).
+        attributes (list): Attribute columns kept.
+        table (pd.DataFrame): Attributes indexed by the keys.
+    """
+
+    def __init__(self, df_master: pd.DataFrame, keys: list = None, attributes: list = None):
+        """
+        Build the index from a master data frame.
+
+        Args:
+            df_master (pd.DataFrame): Master data (all columns or already projected).
+            keys (list): Key columns. Default MERGE_KEYS.
+            attributes (list): Attribute columns to keep. Default MASTER_ATTRIBUTES (the ones present).
+        """
+        self.keys = list(keys or MERGE_KEYS)
+        wanted = attributes or MASTER_ATTRIBUTES
+        self.attributes = [c for c in df_master.columns if c in wanted and c not in self.keys]
+        self.table = df_master.set_index(self.keys)[self.attributes]
+
+    @classmethod
+    def from_excel(cls, path: str, keys: list = None, attributes: list = None, valid_on=None,
+                   in_scope_only: bool = False, cache_dir: str = None) -> "MasterDataIndex":
+        """
+        Load the master data Excel file (through the columnar cache) and build the index.
+
+        Args:
+            path (str): Path to the master data Excel file.
+            keys (list): Key columns. Default MERGE_KEYS.
+            attributes (list): Attribute columns to keep. Default MASTER_ATTRIBUTES.
+            valid_on: Keep only the rows valid on this date (Válido de <= date <= Válido a). None keeps all.
+            in_scope_only (bool): Keep only the rows with all attributes and ÁrSumProd. in scope.
+            cache_dir (str): Folder of the columnar cache (optional).
+
+        Returns:
+            MasterDataIndex: The index.
+        """
+        keys = list(keys or MERGE_KEYS)
+        attributes = list(attributes or MASTER_ATTRIBUTES)
+        df = spa_ingest.read_excel_cached(path, columns=keys + attributes, cache_dir=cache_dir)
+        return cls(filter_master_data(df, valid_on, in_scope_only), keys, attributes)
+
+    def _positions(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Position in the index of each row of a data frame (-1 if the key is not found).
+
+        Args:
+            df (pd.DataFrame): Data frame with the key columns.
+
+        Returns:
+            np.ndarray: Positions.
+        """
+        return self.table.index.get_indexer(pd.MultiIndex.from_frame(df[self.keys]))
+
+    def enrich(self, df: pd.DataFrame, how: str = "left") -> pd.DataFrame:
+        """
+        Add the master attributes to a batch of transactional data.
+
+        Gives the same result as pd.merge(df, master, on=keys, how=how) with the compact master:
+        the rows keep their order, and with how='left' the rows without master data get NaN.
+
+        Args:
+            df (pd.DataFrame): Transactional data with the key columns.
+            how (str): 'left' keeps all rows, 'inner' only the rows found in the master data.
+
+        Returns:
+            pd.DataFrame: Data frame with the attributes added (new RangeIndex, like a merge).
+        """
+        if not self.table.index.is_unique:
+            # Duplicated keys (e.g. several validity periods): a merge is needed to repeat the rows
+            return pd.merge(df, self.table.reset_index(), on=self.keys, how=how)
+
+        positions = self._positions(df)
+        if how == "inner":
+            found = positions >= 0
+            df, positions = df[found], positions[found]
+        elif how != "left":
+            raise ValueError(f"how must be 'left' or 'inner', not {how!r}")
+
+        enriched = df.reset_index(drop=True)
+        for column in self.attributes:
+            values = take(self.table[column].array, positions, allow_fill=True)
+            enriched[column] = values
+        return enriched
+
+    def lookup(self, plp: str = None, material: str = None) -> pd.DataFrame:
+        """
+        Attributes of the consumption points with the given PLP (UbicDest) and/or Material.
+
+        Args:
+            plp (str): PLP id (optional).
+            material (str): Material id (optional).
+
+        Returns:
+            pd.DataFrame: Matching rows with keys and attributes.
+        """
+        mask = np.ones(len(self.table), dtype=bool)
+        if plp is not None:
+            mask &= (self.table["UbicDest"] == plp).to_numpy()
+        if material is not None:
+            mask &= (self.table.index.get_level_values("Material") == material)
+        return self.table[mask].reset_index()
+
+
+def filter_master_data(df: pd.DataFrame, valid_on=None, in_scope_only: bool = False) -> pd.DataFrame:
+    """
+    Apply the validity date and the scope filter to the master data, before building the index.
+
+    Args:
+        df (pd.DataFrame): Master data.
+        valid_on: Keep only the rows valid on this date. None keeps all.
+        in_scope_only (bool): Keep only the rows with all attributes and ÁrSumProd. in scope.
+
+    Returns:
+        pd.DataFrame: Filtered master data.
+    """
+    if valid_on is not None:
+        valid_on = pd.Timestamp(valid_on)
+        df = df[(df["Válido de"] <= valid_on) & (df["Válido a"] >= valid_on)]
+    if in_scope_only:
+        df = df.dropna()
+        df = df[spa_prepare.master_scope_mask(df)]
+    return df
@@ -0,0 +1,332 @@
+"""
+Registry of the fitted models of script 3 and fast prediction without training again.
+
+Each model saved is a new version in a folder of the registry (models/<name>/v0001, v0002, ...)
+with two files:
+- model.joblib: the fitted Pipeline (scaler and model), saved without compression so the NumPy
+  arrays of the trees can be memory-mapped when it is loaded (load_model(mmap=True)).
+- metadata.json: features, target, fingerprint of the training data, metrics, parameters of
+  the model, number of rows and versions of the libraries.
+
+A loaded model is kept in memory for the next predictions of the same process, so predict()
+only runs the pipeline on the rows given.
+"""
+
+import datetime
+import glob
+import hashlib
+import json
+import os
+import time
+
+import joblib
+import pandas as pd
+import sklearn
+
+import spa_tree_inference
+
+
+REGISTRY_DIR = "models"
+MODEL_FILE = "model.joblib"
+METADATA_FILE = "metadata.json"
+ID_COLUMNS = ["PLP", "Material"]
+
+_LOADED = {}
+
+
+# -----------------------------
+# 1. Fingerprint
+# -----------------------------
+def data_fingerprint(X: pd.DataFrame, y: pd.Series = None) -> str:
+    """
+    Fingerprint of the training data: values and names of the features and of the target.
+
+    The same data gives the same fingerprint, so a model does not need to be trained again if a
+    version with this fingerprint (and the same parameters) is already in the registry.
+
+    Args:
+        X (pd.DataFrame): Features.
+        y (pd.Series): Target, optional.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    sha.update(json.dumps(list(map(str, X.columns))).encode())
+    if y is not None:
+        sha.update(pd.util.hash_pandas_object(y, index=False).to_numpy().tobytes())
+        sha.update(str(y.name).encode())
+    return sha.hexdigest()
+
+
+# -----------------------------
+# 2. Save and Find Versions
+# -----------------------------
+def _version_dir(name: str, version: int, registry_dir: str) -> str:
+    """
+    Folder of a version of a model.
+    """
+    return os.path.join(registry_dir, name, f"v{version:04d}")
+
+
+def list_versions(name: str, registry_dir: str = REGISTRY_DIR) -> list:
+    """
+    Versions of a model in the registry, sorted.
+
+    Args:
+        name (str): Name of the model (e.g. 'rf_grid').
+        registry_dir (str): Folder of the registry.
+
+    Returns:
+        list: Version numbers (empty if the model was never saved).
+    """
+    folders = glob.glob(os.path.join(registry_dir, name, "v*", METADATA_FILE))
+    return sorted(int(os.path.basename(os.path.dirname(f))[1:]) for f in folders)
+
+
+def load_metadata(name: str, version: int = None, registry_dir: str = REGISTRY_DIR) -> dict:
+    """
+    Metadata of a version of a model.
+
+    Args:
+        name (str): Name of the model.
+        version (int): Version, None for the last one.
+        registry_dir (str): Folder of the registry.
+
+    Returns:
+        dict: Content of metadata.json.
+    """
+    if version is None:
+        versions = list_versions(name, registry_dir)
+        if not versions:
+            raise FileNotFoundError(f"No model '{name}' in the registry {registry_dir}")
+        version = versions[-1]
+    with open(os.path.join(_version_dir(name, version, registry_dir), METADATA_FILE), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_version(name: str, fingerprint: str, params: dict = None, registry_dir: str = REGISTRY_DIR) -> dict:
+    """
+    Last version of a model trained on the same data (and with the same parameters, if given).
+
+    Args:
+        name (str): Name of the model.
+        fingerprint (str): Fingerprint of the training data (data_fingerprint).
+        params (dict): Parameters of the model, optional.
+        registry_dir (str): Folder of the registry.
+
+    Returns:
+        dict: Metadata of the version, None if there is none.
+    """
+    for version in reversed(list_versions(name, registry_dir)):
+        metadata = load_metadata(name, version, registry_dir)
+        if metadata["fingerprint"] == fingerprint and (params is None or metadata["params"] == _jsonable(params)):
+            return metadata
+    return None
+
+
+def _jsonable(params: dict) -> dict:
+    """
+    Parameters of a model with the values that are not numbers, strings or None as text.
+    """
+    return {k: v if isinstance(v, (int, float, str, bool, type(None))) else repr(v) for k, v in sorted(params.items())}
+
+
+def save_model(pipeline, name: str, features: list, target: str, X_train: pd.DataFrame, y_train: pd.Series,
+               metrics: dict = None, registry_dir: str = REGISTRY_DIR, fingerprint: str = None,
+               extra: dict = None, reuse: bool = True) -> dict:
+    """
+    Save a fitted pipeline as a new version of a model.
+
+    If a version was trained on the same data with the same parameters (find_version), it is kept
+    and no new version is saved, so running script 3 again on the same history adds no versions.
+
+    Args:
+        pipeline (Pipeline): Fitted pipeline (the last step is the model).
+        name (str): Name of the model (e.g. 'rf_grid').
+        features (list): Feature columns, in the order used for training.
+        target (str): Target column.
+        X_train (pd.DataFrame): Training features (used for the fingerprint).
+        y_train (pd.Series): Training target (used for the fingerprint).
+        metrics (dict): Metrics of the model (e.g. {'rmse': 11.9, 'r2': 0.38}), optional.
+        registry_dir (str): Folder of the registry.
+        fingerprint (str): Fingerprint of the data to record, default the one of X_train and y_train.
+        extra (dict): Other values to keep in the metadata (e.g. the PLPs of a group model), optional.
+        reuse (bool): Keep a matching version instead of saving a new one.
+
+    Returns:
+        dict: Metadata of the new (or matching) version.
+    """
+    model = pipeline.steps[-1][1] if hasattr(pipeline, "steps") else pipeline
+    fingerprint = fingerprint or data_fingerprint(X_train[features], y_train)
+    if reuse:
+        metadata = find_version(name, fingerprint, model.get_params(), registry_dir)
+        if metadata is not None and metadata["features"] == list(features):
+            print(f"Model {name}: version {metadata['version']} was trained on the same data, not saved again")
+            return metadata
+
+    versions = list_versions(name, registry_dir)
+    version = versions[-1] + 1 if versions else 1
+    folder = _version_dir(name, version, registry_dir)
+    os.makedirs(folder, exist_ok=True)
+
+    metadata = {
+        "name": name,
+        "version": version,
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "model": type(model).__name__,
+        "features": list(features),
+        "target": target,
+        "fingerprint": fingerprint,
+        "train_rows": len(X_train),
+        "metrics": {k: float(v) for k, v in (metrics or {}).items()},
+        "params": _jsonable(model.get_params()),
+        "sklearn_version": sklearn.__version__,
+        **(extra or {}),
+    }
+    # No compression: the arrays can be memory-mapped by load_model
+    joblib.dump(pipeline, os.path.join(folder, MODEL_FILE), compress=0)
+    with open(os.path.join(folder, METADATA_FILE), "w", encoding="utf-8") as f:
+        json.dump(metadata, f, indent=1)
+    print(f"Model {name} saved as version {version} in {folder}")
+    return metadata
+
+
+# -----------------------------
+# 3. Load and Predict
+# -----------------------------
+class Predictor:
+    """
+    Fitted pipeline of the registry with its metadata.
+
+    Attributes:
+        pipeline (Pipeline): Fitted pipeline.
+        metadata (dict): Metadata of the version.
+        features (list): Feature columns expected by the pipeline.
+    """
+
+    def __init__(self, pipeline, metadata: dict):
+        """
+        Predictor of a loaded version.
+
+        Args:
+            pipeline (Pipeline): Fitted pipeline.
+            metadata (dict): Metadata of the version.
+        """
+        self.pipeline = pipeline
+        self.metadata = metadata
+        self.features = metadata["features"]
+
+    def predict(self, data) -> pd.DataFrame:
+        """
+        Predict the target for some rows.
+
+        Args:
+            data (pd.DataFrame, dict or list of dicts): Rows with the feature columns; the columns
+                PLP and Material are optional and kept in the result.
+
+        Returns:
+            pd.DataFrame: The columns PLP and Material (if given) and the prediction of the target.
+        """
+        df = pd.DataFrame([data]) if isinstance(data, dict) else pd.DataFrame(data)
+        missing = [c for c in self.features if c not in df.columns]
+        if missing:
+            raise ValueError(f"Missing features for the model {self.metadata['name']}: {missing}")
+        result = df[[c for c in ID_COLUMNS if c in df.columns]].copy()
+        result[self.metadata["target"]] = self.pipeline.predict(df[self.features])
+        return result
+
+    def predict_one(self, plp: str, material: str, consumo: float, cap_sumin: float,
+                    supply_time_hours: float) -> float:
+        """
+        Predict the target for one PLP and Material.
+
+        Args:
+            plp (str): PLP id.
+            material (str): Material.
+            consumo (float): Median of consumption parts per day.
+            cap_sumin (float): Number of parts for each container.
+            supply_time_hours (float): Supply time in hours.
+
+        Returns:
+            float: Prediction of the target (e.g. time between requests in hours).
+        """
+        row = {"PLP": plp, "Material": material, "Consumo": consumo, "Cap. Sumin": cap_sumin,
+               "Supply_time_hours": supply_time_hours}
+        return float(self.predict(row)[self.metadata["target"]].iloc[0])
+
+
+def load_model(name: str, version: int = None, registry_dir: str = REGISTRY_DIR, mmap: bool = False,
+               compact: bool = False) -> Predictor:
+    """
+    Load a version of a model (kept in memory for the next calls of the same process).
+
+    Args:
+        name (str): Name of the model.
+        version (int): Version, None for the last one.
+        registry_dir (str): Folder of the registry.
+        mmap (bool): Memory-map the arrays of the model instead of reading them into memory. The
+            pages are shared by the processes that load the same file, but the load is slower for a
+            forest (one small array per tree).
+        compact (bool): Predict with the compact trees of spa_tree_inference (same predictions,
+            faster for a few rows). The scikit-learn model is not kept in memory.
+
+    Returns:
+        Predictor: Pipeline and metadata of the version.
+    """
+    metadata = load_metadata(name, version, registry_dir)
+    key = (os.path.abspath(registry_dir), name, metadata["version"], compact)
+    if key not in _LOADED:
+        path = os.path.join(_version_dir(name, metadata["version"], registry_dir), MODEL_FILE)
+        pipeline = joblib.load(path, mmap_mode="r" if mmap else None)
+        if compact:
+            pipeline = spa_tree_inference.CompactPipeline(pipeline)
+        _LOADED[key] = Predictor(pipeline, metadata)
+    return _LOADED[key]
+
+
+def predict(data, name: str = "rf_grid", version: int = None, registry_dir: str = REGISTRY_DIR) -> pd.DataFrame:
+    """
+    Predict the target with a model of the registry (see Predictor.predict).
+
+    Args:
+        data (pd.DataFrame, dict or list of dicts): Rows with the feature columns.
+        name (str): Name of the model.
+        version (int): Version, None for the last one.
+        registry_dir (str): Folder of the registry.
+
+    Returns:
+        pd.DataFrame: The columns PLP and Material (if given) and the prediction.
+    """
+    return load_model(name, version, registry_dir).predict(data)
+
+
+def timed_prediction(name: str = "rf_grid", registry_dir: str = REGISTRY_DIR, row: dict = None) -> pd.DataFrame:
+    """
+    Time the load of the last version of a model and of one prediction (the first one and the next ones).
+
+    Args:
+        name (str): Name of the model.
+        registry_dir (str): Folder of the registry.
+        row (dict): Row to predict, with the features of the model (default typical values of the
+            features of Pipeline 1, without PLP and Material).
+
+    Returns:
+        pd.DataFrame: Step and milliseconds.
+    """
+    row = row or {"Consumo": 100.0, "Cap. Sumin": 20.0, "Supply_time_hours": 1.5}
+    timings = []
+    start = time.perf_counter()
+    predictor = load_model(name, registry_dir=registry_dir)
+    timings.append(("load", time.perf_counter() - start))
+    for step in ["first prediction", "next prediction"]:
+        start = time.perf_counter()
+        predictor.predict(row)
+        timings.append((step, time.perf_counter() - start))
+    return pd.DataFrame([(step, seconds * 1000) for step, seconds in timings], columns=["step", "ms"])
+
+
+if __name__ == "__main__":
+    print(load_metadata("rf_grid"))
+    print(timed_prediction())
@@ -0,0 +1,189 @@
+"""
+Headless rendering of the histograms of the analysis (script 2) to image files.
+
+The figures are drawn with the Agg canvas of matplotlib (no window, no pyplot), so the charts
+can be made on a server without a display. The bins are calculated with NumPy before drawing,
+and one figure is reused for all the charts of a process. The chart pack with one histogram per
+PLP is split between several processes.
+"""
+
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+# -----------------------------
+# 1. Bins and Rendering
+# -----------------------------
+def histogram_bins(data, bins=10, weights=None) -> tuple:
+    """
+    Counts and bin edges of a histogram (missing values are ignored).
+
+    Args:
+        data (array-like): Values.
+        bins (int or array-like): Number of bins, or their edges.
+        weights (array-like): Count of each value (optional, e.g. values that are already binned).
+
+    Returns:
+        tuple: (counts, edges) as NumPy arrays.
+    """
+    values = np.asarray(data, dtype="float64")
+    present = ~np.isnan(values)
+    if weights is not None:
+        weights = np.asarray(weights, dtype="float64")[present]
+    return np.histogram(values[present], bins=bins, weights=weights)
+
+
+class HistogramRenderer:
+    """
+    One figure reused to draw and save several histograms.
+
+    The bars are created once and only moved and resized for the next histogram with the same
+    number of bins, which is faster than clearing the axes and drawing them again.
+
+    Attributes:
+        figure (Figure): Matplotlib figure (Agg canvas).
+        ax (Axes): Axes of the figure.
+        bars (BarContainer): Bars of the last histogram drawn.
+    """
+
+    def __init__(self, figsize: tuple = (8, 6), dpi: int = 100):
+        """
+        Create the figure.
+
+        Args:
+            figsize (tuple): Size of the figure in inches.
+            dpi (int): Resolution of the PNG files.
+        """
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+        self.bars = None
+
+    def render(self, counts: np.ndarray, edges: np.ndarray, title: str, xlabel: str, ylabel: str, path: str):
+        """
+        Draw a histogram from its bins (same style as plot_histogram of script 2) and save it.
+
+        Args:
+            counts (np.ndarray): Counts of each bin.
+            edges (np.ndarray): Edges of the bins.
+            title (str): Title of the plot.
+            xlabel (str): Label for the x-axis.
+            ylabel (str): Label for the y-axis.
+            path (str): Output file; the format is given by the extension (.png, .svg, ...).
+        """
+        widths = np.diff(edges)
+        if self.bars is None or len(self.bars) != len(counts):
+            self.ax.clear()
+            self.bars = self.ax.bar(edges[:-1], counts, width=widths, align="edge", color="skyblue",
+                                    edgecolor="black")
+            self.ax.grid(axis="y", alpha=0.75)
+        else:
+            for bar, x, width, height in zip(self.bars, edges[:-1], widths, counts):
+                bar.set_x(x)
+                bar.set_width(width)
+                bar.set_height(height)
+            self.ax.relim()
+            self.ax.autoscale_view()
+        self.ax.set_title(title)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        # Low PNG compression: bigger files but faster to write
+        options = {"pil_kwargs": {"compress_level": 1}} if path.lower().endswith(".png") else {}
+        self.figure.savefig(path, **options)
+
+
+def render_histogram(data, title: str, xlabel: str, ylabel: str, path: str, bins=10, weights=None) -> str:
+    """
+    Save the histogram of some values to a file.
+
+    Args:
+        data (array-like): Data to plot.
+        title (str): Title of the plot.
+        xlabel (str): Label for the x-axis.
+        ylabel (str): Label for the y-axis.
+        path (str): Output file (.png or .svg).
+        bins (int or array-like): Number of bins in the histogram, or their edges.
+        weights (array-like): Count of each value (optional).
+
+    Returns:
+        str: Path of the file.
+    """
+    counts, edges = histogram_bins(data, bins, weights)
+    HistogramRenderer().render(counts, edges, title, xlabel, ylabel, path)
+    return path
+
+
+# -----------------------------
+# 2. Chart Pack per PLP
+# -----------------------------
+def file_name(text: str) -> str:
+    """
+    Text usable as a file name (characters other than letters, digits, '-' and '_' replaced by '_').
+    """
+    return re.sub(r"[^\w\-]", "_", str(text))
+
+
+def _render_batch(tasks: list) -> list:
+    """
+    Render a list of histograms with one figure (runs in a worker process).
+
+    Args:
+        tasks (list): Tuples (counts, edges, title, xlabel, ylabel, path).
+
+    Returns:
+        list: Paths of the files.
+    """
+    renderer = HistogramRenderer()
+    for counts, edges, title, xlabel, ylabel, path in tasks:
+        renderer.render(counts, edges, title, xlabel, ylabel, path)
+    return [task[-1] for task in tasks]
+
+
+def render_plp_histograms(df: pd.DataFrame, value_col: str, out_dir: str, title: str, xlabel: str,
+                          ylabel: str = "Frequency", fmt: str = "png", bins: int = 10,
+                          max_workers: int = None) -> dict:
+    """
+    Save one histogram per PLP, split between several processes.
+
+    The bins are calculated here and only the counts and edges are sent to the workers. Scripts
+    using it with max_workers > 1 must keep their workflow under `if __name__ == "__main__":`.
+
+    Args:
+        df (pd.DataFrame): Data with the column PLP and the value column.
+        value_col (str): Column to plot.
+        out_dir (str): Output folder (created if needed).
+        title (str): Title of the plots, the PLP is added at the end.
+        xlabel (str): Label for the x-axis.
+        ylabel (str): Label for the y-axis.
+        fmt (str): 'png' or 'svg'.
+        bins (int): Number of bins.
+        max_workers (int): Number of worker processes. None uses all the CPU cores, 1 renders sequentially.
+
+    Returns:
+        dict: Keys 'files' (list of paths) and 'seconds' (time spent).
+    """
+    start = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = []
+    for plp, values in df.groupby("PLP", observed=True)[value_col]:
+        counts, edges = histogram_bins(values.to_numpy(), bins)
+        path = os.path.join(out_dir, f"{file_name(value_col)}_{file_name(plp)}.{fmt}")
+        tasks.append((counts, edges, f"{title} - {plp}", xlabel, ylabel, path))
+
+    workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+    workers = max(1, min(workers, len(tasks)))
+    if workers == 1:
+        files = _render_batch(tasks)
+    else:
+        # One batch per worker, so each process creates only one figure
+        batches = [tasks[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            files = [path for paths in executor.map(_render_batch, batches) for path in paths]
+    return {"files": files, "seconds": time.perf_counter() - start}
@@ -0,0 +1,424 @@
+"""
+Local prediction service of the time between requests, with a model of the registry (spa_models).
+
+The model is loaded once when the service starts. The requests received at the same time are
+grouped in micro-batches: a batch is predicted with one call of the pipeline as soon as it has
+max_batch rows or the first request of the batch has waited max_wait_ms. The service answers
+over HTTP on a local port or on a Unix socket and uses only the standard library, so it runs
+offline on one Linux machine.
+
+Endpoints:
+- POST /predict: JSON row or list of rows with the features (PLP and Material optional).
+  Answer: {"predictions": [...], "model": name, "version": n}.
+- GET /metrics: latency percentiles (p50, p99), throughput and batch sizes.
+- GET /health: model and version loaded.
+
+Start it with `python spa_prediction_service.py --model rf_grid --port 8765` (or `--socket
+/tmp/spa.sock`), and measure it with `python spa_prediction_service.py --load-test`.
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import spa_models
+
+
+# -----------------------------
+# 1. Metrics
+# -----------------------------
+class ServiceMetrics:
+    """
+    Latency and throughput of the service (thread safe).
+
+    Attributes:
+        latencies (deque): Latency of the last requests in seconds.
+        requests (int): Number of requests answered.
+        rows (int): Number of rows predicted.
+        batches (int): Number of calls of the model.
+        started (float): Start time (time.perf_counter).
+    """
+
+    def __init__(self, window: int = 10000):
+        """
+        Empty metrics.
+
+        Args:
+            window (int): Number of last requests used for the latency percentiles.
+        """
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.rows = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_request(self, seconds: float):
+        """
+        Record the latency of one request.
+        """
+        with self._lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+
+    def add_batch(self, rows: int):
+        """
+        Record one call of the model.
+        """
+        with self._lock:
+            self.batches += 1
+            self.rows += rows
+
+    def snapshot(self) -> dict:
+        """
+        Current metrics.
+
+        Returns:
+            dict: requests, rows, batches, mean_batch_rows, p50_ms, p99_ms, requests_per_second
+                and rows_per_second (since the start).
+        """
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+            elapsed = time.perf_counter() - self.started
+            return {
+                "requests": self.requests,
+                "rows": self.rows,
+                "batches": self.batches,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+                "requests_per_second": self.requests / elapsed,
+                "rows_per_second": self.rows / elapsed,
+            }
+
+
+# -----------------------------
+# 2. Micro-Batching
+# -----------------------------
+class _Pending:
+    """
+    Rows of one request waiting for their predictions.
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Group the rows of the requests received at the same time and predict them with one call.
+
+    Attributes:
+        predictor (spa_models.Predictor): Model loaded from the registry.
+        max_batch (int): Maximum number of rows of a batch.
+        max_wait (float): Maximum time in seconds the first request of a batch waits for others.
+        metrics (ServiceMetrics): Metrics of the service.
+    """
+
+    def __init__(self, predictor, max_batch: int = 64, max_wait_ms: float = 2.0, metrics: ServiceMetrics = None):
+        """
+        Start the thread that predicts the batches.
+
+        Args:
+            predictor (spa_models.Predictor): Model loaded from the registry.
+            max_batch (int): Maximum number of rows of a batch.
+            max_wait_ms (float): Maximum wait of the first request of a batch, in milliseconds.
+            metrics (ServiceMetrics): Metrics to update, optional.
+        """
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics or ServiceMetrics()
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def predict(self, rows: list) -> list:
+        """
+        Predict some rows (blocks until the batch with these rows is predicted).
+
+        Args:
+            rows (list): Dicts with the feature columns.
+
+        Returns:
+            list: One prediction per row.
+        """
+        missing = {c for row in rows for c in self.predictor.features if c not in row}
+        if missing:
+            raise ValueError(f"Missing features: {sorted(missing)}")
+        pending = _Pending(rows)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self) -> list:
+        """
+        Wait for a request, then take the next ones until the batch is full or the wait is over.
+        """
+        batch = [self._queue.get()]
+        n_rows = len(batch[0].rows)
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            n_rows += len(pending.rows)
+        return batch
+
+    def _run(self):
+        """
+        Predict the batches one after the other (runs in its own thread).
+        """
+        target = self.predictor.metadata["target"]
+        while True:
+            batch = self._next_batch()
+            rows = [row for pending in batch for row in pending.rows]
+            try:
+                values = self.predictor.predict(rows)[target].tolist()
+                start = 0
+                for pending in batch:
+                    pending.result = values[start:start + len(pending.rows)]
+                    start += len(pending.rows)
+            except Exception as error:
+                for pending in batch:
+                    pending.error = error
+            self.metrics.add_batch(len(rows))
+            for pending in batch:
+                pending.done.set()
+
+
+# -----------------------------
+# 3. HTTP Service
+# -----------------------------
+class PredictionHandler(BaseHTTPRequestHandler):
+    """
+    Requests of the service (the server has the attributes batcher and predictor).
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive connections
+
+    def _send(self, status: int, body: dict):
+        """
+        Send a JSON answer.
+        """
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        metadata = self.server.predictor.metadata
+        if self.path == "/metrics":
+            self._send(200, self.server.batcher.metrics.snapshot())
+        elif self.path == "/health":
+            self._send(200, {"model": metadata["name"], "version": metadata["version"]})
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        if self.path != "/predict":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"null")
+            rows = [body] if isinstance(body, dict) else body
+            if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+                raise ValueError("The body must be a JSON object or a list of objects")
+            predictions = self.server.batcher.predict(rows)
+        except ValueError as error:
+            self._send(400, {"error": str(error)})
+            return
+        metadata = self.server.predictor.metadata
+        self._send(200, {"predictions": predictions, "model": metadata["name"], "version": metadata["version"]})
+        self.server.batcher.metrics.add_request(time.perf_counter() - start)
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        pass  # no line printed per request
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket.
+    """
+
+    daemon_threads = True
+
+
+def create_server(model: str = "rf_grid", version: int = None, registry_dir: str = spa_models.REGISTRY_DIR,
+                  host: str = "127.0.0.1", port: int = 8765, unix_socket: str = None, max_batch: int = 64,
+                  max_wait_ms: float = 2.0, compact: bool = False):
+    """
+    Load the model and create the server (not started, see serve_forever of the result).
+
+    Args:
+        model (str): Name of the model in the registry.
+        version (int): Version, None for the last one.
+        registry_dir (str): Folder of the registry.
+        host (str): Address of the HTTP server (local only by default).
+        port (int): Port of the HTTP server (0 chooses a free port).
+        unix_socket (str): Path of a Unix socket to use instead of host and port, optional.
+        max_batch (int): Maximum number of rows of a batch.
+        max_wait_ms (float): Maximum wait of the first request of a batch, in milliseconds.
+        compact (bool): Predict with the compact trees of spa_tree_inference.
+
+    Returns:
+        socketserver.BaseServer: Server with the attributes predictor and batcher.
+    """
+    predictor = spa_models.load_model(model, version, registry_dir, compact=compact)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, PredictionHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), PredictionHandler)
+        server.daemon_threads = True
+    server.predictor = predictor
+    server.batcher = MicroBatcher(predictor, max_batch, max_wait_ms)
+    return server
+
+
+# -----------------------------
+# 4. Client and Load Test
+# -----------------------------
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    """
+
+    def __init__(self, path: str):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def connect(address) -> http.client.HTTPConnection:
+    """
+    Connection to the service.
+
+    Args:
+        address (tuple or str): (host, port) of the HTTP server or path of the Unix socket.
+
+    Returns:
+        http.client.HTTPConnection: Connection (kept alive between requests).
+    """
+    if isinstance(address, str):
+        return _UnixHTTPConnection(address)
+    return http.client.HTTPConnection(*address)
+
+
+def request_prediction(connection: http.client.HTTPConnection, rows) -> dict:
+    """
+    Ask the service for the predictions of one row or a list of rows.
+
+    Args:
+        connection (http.client.HTTPConnection): Connection to the service (see connect).
+        rows (dict or list): Row(s) with the features.
+
+    Returns:
+        dict: Answer of the service.
+    """
+    connection.request("POST", "/predict", body=json.dumps(rows), headers={"Content-Type": "application/json"})
+    answer = json.loads(connection.getresponse().read())
+    if "error" in answer:
+        raise ValueError(answer["error"])
+    return answer
+
+
+def load_test(address, rows: list, n_requests: int = 1000, concurrency: int = 16) -> dict:
+    """
+    Send requests of one row from several clients at the same time and return the metrics of the service.
+
+    Args:
+        address (tuple or str): (host, port) of the HTTP server or path of the Unix socket.
+        rows (list): Rows sent one by one, in turn.
+        n_requests (int): Number of requests.
+        concurrency (int): Number of clients.
+
+    Returns:
+        dict: Metrics of the service (GET /metrics) and the seconds of the test.
+    """
+    def client(index: int):
+        connection = connect(address)
+        for i in range(index, n_requests, concurrency):
+            request_prediction(connection, rows[i % len(rows)])
+        connection.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    seconds = time.perf_counter() - start
+
+    connection = connect(address)
+    connection.request("GET", "/metrics")
+    metrics = json.loads(connection.getresponse().read())
+    connection.close()
+    metrics["test_seconds"] = seconds
+    return metrics
+
+
+def _sample_rows(features: list, n: int = 100, db_name: str = "SPA_Data_Analytics.db") -> list:
+    """
+    Rows of the history to use in the load test.
+    """
+    import spa_storage
+
+    df = spa_storage.load_history(db_name, columns=spa_models.ID_COLUMNS + list(features))
+    return df.head(n).to_dict("records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local prediction service of the time between requests")
+    parser.add_argument("--model", default="rf_grid", help="name of the model in the registry")
+    parser.add_argument("--version", type=int, help="version of the model (default the last one)")
+    parser.add_argument("--registry", default=spa_models.REGISTRY_DIR, help="folder of the registry")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="path of a Unix socket to use instead of host and port")
+    parser.add_argument("--max-batch", type=int, default=64, help="maximum rows of a micro-batch")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="maximum wait of a micro-batch")
+    parser.add_argument("--compact", action="store_true", help="predict with the compact trees")
+    parser.add_argument("--load-test", action="store_true", help="start the service and measure it")
+    parser.add_argument("--requests", type=int, default=1000, help="requests of the load test")
+    parser.add_argument("--concurrency", type=int, default=16, help="clients of the load test")
+    args = parser.parse_args()
+
+    server = create_server(args.model, args.version, args.registry, args.host, 0 if args.load_test else args.port,
+                           args.socket, args.max_batch, args.max_wait_ms, args.compact)
+    address = args.socket or server.server_address[:2]
+    if args.load_test:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        rows = _sample_rows(server.predictor.features)
+        print(load_test(address, rows, args.requests, args.concurrency))
+        server.shutdown()
+    else:
+        print(f"Model {args.model} version {server.predictor.metadata['version']} served on {address}")
+        server.serve_forever()
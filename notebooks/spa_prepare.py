@@ -0,0 +1,211 @@
+"""
+Cleaning and calculation steps of the data preparation (script 1).
+
+The same functions are used by the normal workflow, where all the files are loaded in one data
+frame, and by the streaming pipeline, where the files are cleaned and stored one day (or one
+chunk of rows) at a time so the memory needed does not grow with the history.
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+
+import spa_aggregates
+import spa_features
+import spa_ingest
+import spa_sketches
+import spa_storage
+import spa_timestamps
+
+
+# Scope of the analysis
+SCOPE_TIPO_SUM = ["NO", "WN"]
+SCOPE_SFAB = [401, 402, 441, 431]
+SCOPE_PVB_PREFIXES = ("10", "09", "08")
+
+# Columns renamed to better understand the analysis
+RENAME_COLUMNS = {
+    'Denominación': 'Denominacion',
+    'UbicDest': 'PLP',
+    'ÁrSumProd.': 'PVB'
+}
+
+
+# -----------------------------
+# 1. Scope Filters
+# -----------------------------
+def transactional_scope_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Rows in scope according to the columns of the transactional data (Tipo Sum and SFab).
+
+    Args:
+        df (pd.DataFrame): Transactional data (or merged data).
+
+    Returns:
+        pd.Series: Boolean mask.
+    """
+    return df["Tipo Sum"].isin(SCOPE_TIPO_SUM) & df["SFab"].isin(SCOPE_SFAB)
+
+
+def master_scope_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Rows in scope according to the columns of the master data (ÁrSumProd. prefix).
+
+    Args:
+        df (pd.DataFrame): Master data (or merged data).
+
+    Returns:
+        pd.Series: Boolean mask.
+    """
+    return df["ÁrSumProd."].astype(str).str.startswith(SCOPE_PVB_PREFIXES)
+
+
+def filter_scope(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keep only the rows in scope: Tipo Sum NO/WN, SFab 401/402/441/431 and ÁrSumProd. 10/09/08.
+
+    Args:
+        df (pd.DataFrame): Merged data frame.
+
+    Returns:
+        pd.DataFrame: Filtered data frame.
+    """
+    return df[transactional_scope_mask(df) & master_scope_mask(df)]
+
+
+# -----------------------------
+# 2. Calculated Data
+# -----------------------------
+def add_supply_time(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the request and confirmation datetimes and the Supply Time (timedelta and hours).
+
+    Args:
+        df (pd.DataFrame): Data frame with the columns F.Creac, H.Creac, F.Conf OT and H.Conf OT.
+
+    Returns:
+        pd.DataFrame: The same data frame with the new columns.
+    """
+    # Specify the format (example: DD.MM.YY for date, HH:MM:SS for time)
+    # Each distinct date and time is parsed only once (same result as parsing 'F.Creac H.Creac' as text)
+    df['datetime_creac'] = spa_timestamps.parse_date_time(df['F.Creac'], df['H.Creac'], '%d.%m.%y', '%H:%M:%S')
+    df['datetime_conf'] = spa_timestamps.parse_date_time(df['F.Conf OT'], df['H.Conf OT'], '%d.%m.%y', '%H:%M')
+
+    # Supply Time
+    df['Supply_time'] = df['datetime_conf'] - df['datetime_creac']
+    df['Supply_time_hours'] = df['Supply_time'].dt.total_seconds() / 3600
+    return df
+
+
+# -----------------------------
+# 3. Streaming Pipeline
+# -----------------------------
+def clean_chunk(df_chunk: pd.DataFrame, master_index, columns_to_keep: list) -> pd.DataFrame:
+    """
+    Clean one chunk of transactional data: projection, NaN and scope filter before the merge,
+    lookup of the master attributes, rename and calculation of the Supply Time.
+
+    Args:
+        df_chunk (pd.DataFrame): Chunk of transactional data.
+        master_index (MasterDataIndex): Master data index built with in_scope_only=True, so an
+            inner lookup gives the same rows as the left merge followed by dropna and the scope filter.
+        columns_to_keep (list): Columns kept for the analysis.
+
+    Returns:
+        pd.DataFrame: Cleaned chunk with the same columns as the normal workflow (without time_between_MatReqs).
+    """
+    df_chunk = df_chunk[[c for c in df_chunk.columns if c in columns_to_keep]].dropna()
+    df_chunk = df_chunk[transactional_scope_mask(df_chunk)]
+
+    df_chunk = master_index.enrich(df_chunk, how="inner")
+    df_chunk = df_chunk.rename(columns=RENAME_COLUMNS)
+    return add_supply_time(df_chunk)
+
+
+def _row_chunks(df: pd.DataFrame, chunk_rows: int):
+    """
+    Split a data frame in chunks of rows.
+
+    Args:
+        df (pd.DataFrame): Data frame to split.
+        chunk_rows (int): Rows per chunk. None returns the whole data frame.
+
+    Yields:
+        pd.DataFrame: Chunks of rows.
+    """
+    if not chunk_rows:
+        yield df
+        return
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def stream_files_to_sqlite(files: list, master_index, conn: sqlite3.Connection, columns_to_keep: list,
+                           read_columns: list = None, cache_dir: str = None, replace: bool = True,
+                           chunk_rows: int = None, keep_sketches: bool = False, keep_features: bool = False) -> dict:
+    """
+    Clean and store the transactional files one at a time.
+
+    Each file (one day) is read, projected and filtered before the merge, and the cleaned rows are
+    written to SQLite before reading the next one. The first request of each PLP in a chunk is
+    compared with the last one stored (watermarks table), and PLPs with late-arriving requests are
+    recalculated, so the files should be given in chronological order (sorted by name) but an
+    older file only costs the recalculation of its PLPs.
+    The peak memory depends on the size of a file or chunk, not on the length of the history.
+
+    Args:
+        files (list): Paths of the transactional Excel files, in chronological order.
+        master_index (MasterDataIndex): Master data index built with in_scope_only=True.
+        conn (sqlite3.Connection): Connection from spa_storage.connect.
+        columns_to_keep (list): Columns kept for the analysis.
+        read_columns (list): Columns read from the Excel files (optional).
+        cache_dir (str): Folder of the columnar cache (optional).
+        replace (bool): Replace the table with the first chunk (full mode) instead of appending.
+        chunk_rows (int): Split each file in chunks of this number of rows (optional).
+        keep_sketches (bool): Merge the stored rows into the statistics sketches (see spa_sketches).
+        keep_features (bool): Calculate the features of the stored rows (see spa_features).
+
+    Returns:
+        dict: File name -> number of rows stored.
+    """
+    rows_per_file = {}
+    first_write = True
+    for path in files:
+        file_name = os.path.basename(path)
+        df_file = spa_ingest.read_excel_cached(path, columns=read_columns, cache_dir=cache_dir)
+        df_file = df_file.assign(source_file=file_name)
+        rows_per_file[file_name] = 0
+
+        df_file = clean_chunk(df_file, master_index, columns_to_keep)
+        # Chronological order inside the file, so every chunk continues the previous one
+        df_file = df_file.sort_values(by='datetime_creac', kind='stable')
+
+        for df in _row_chunks(df_file, chunk_rows):
+            df = df.sort_values(by=['PLP', 'datetime_creac'])
+            if replace and first_write:
+                late_plps = []
+                df['time_between_MatReqs'] = spa_ingest.time_between_requests(df)
+            else:
+                late_plps = spa_ingest.find_late_plps(df, spa_ingest.load_watermarks(conn))
+                df['time_between_MatReqs'] = spa_ingest.incremental_time_between_requests(conn, df)
+
+            # Keep the first and last request per PLP for the next chunk and the next run
+            spa_ingest.update_watermarks(conn, df, replace=replace and first_write)
+
+            spa_ingest.store_first_requests(conn, df, replace=replace and first_write)
+
+            # Days affected (all of them after the first write of a full load), before the first requests
+            # are dropped: a late PLP can have only first requests in the chunk
+            days = None if replace and first_write else spa_aggregates.affected_days(conn, df, late_plps)
+            df = df.dropna(subset=['time_between_MatReqs'])
+            rows_per_file[file_name] += spa_storage.write_history(conn, df, replace=replace and first_write)
+            if keep_sketches:
+                spa_sketches.update_sketches(conn, df, replace=replace and first_write, rebuild_plps=late_plps)
+            # Daily aggregates of the days affected
+            spa_aggregates.refresh_aggregates(conn, days)
+            if keep_features:
+                spa_features.refresh_features(conn, days)
+            first_write = False
+
+    return rows_per_file
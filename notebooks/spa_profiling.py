@@ -0,0 +1,338 @@
+"""
+Instrumentation of the scripts: time and memory of each stage of a run, saved in the database.
+
+Each script creates a RunProfiler and marks the start of each stage (profiler.stage("merge")),
+or wraps a block with `with profiler.stage("merge"):`. For each stage it measures:
+- seconds (wall clock) and cpu_seconds (CPU time of the process).
+- rss_mb: memory of the process at the end of the stage, and peak_rss_mb / peak_children_rss_mb:
+  peak memory of the process and of its worker processes so far (Linux and macOS).
+- peak_traced_mb: peak of the memory allocated by Python during the stage, with tracemalloc
+  (only with trace_memory=True, because it makes the run slower).
+
+At the end of the script profiler.finish(db_name) prints the stages and saves the run report as a
+JSON row of the table SPA_Run_Reports, so the daily runs can be compared (load_run_reports).
+With profile="cprofile" (or "pyinstrument", if installed) the whole run is also profiled and the
+profile is saved in cache/profiles.
+"""
+
+import cProfile
+import datetime
+import io
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+import spa_storage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+except ImportError:
+    PyinstrumentProfiler = None
+
+
+RUN_REPORT_TABLE = "SPA_Run_Reports"
+PROFILE_DIR = "cache/profiles"
+PROFILE_MODES = [None, "cprofile", "pyinstrument"]
+
+
+# -----------------------------
+# 1. Memory of the Process
+# -----------------------------
+def rss_mb() -> float:
+    """
+    Current memory (resident set size) of the process in MB, None if it is not available (Linux only).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb(children: bool = False) -> float:
+    """
+    Peak memory of the process (or of its finished worker processes) in MB, None if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return peak / 1e6 if sys.platform == "darwin" else peak * 1024 / 1e6
+
+
+# -----------------------------
+# 2. Profiler of a Run
+# -----------------------------
+class _Stage:
+    """
+    Stage started by RunProfiler.stage (ends at the next stage, or at the end of a with block).
+    """
+
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler.current is not None and self.profiler.current["stage"] == self.name:
+            self.profiler.end_stage()
+        return False
+
+
+class RunProfiler:
+    """
+    Timers and memory of the stages of one run of a script.
+
+    Attributes:
+        script (str): Name of the script (e.g. 'script_1').
+        run_id (str): Id of the run.
+        started (str): Start time of the run (ISO format).
+        trace_memory (bool): Measure the peak memory of each stage with tracemalloc.
+        profile (str): None, 'cprofile' or 'pyinstrument' (profile of the whole run).
+        profile_dir (str): Folder of the profiles.
+        stages (list): Measures of the stages finished.
+        current (dict): Stage running, None between stages.
+    """
+
+    def __init__(self, script: str, trace_memory: bool = False, profile: str = None, profile_dir: str = PROFILE_DIR):
+        """
+        Start the run.
+
+        Args:
+            script (str): Name of the script.
+            trace_memory (bool): Measure the peak memory of each stage with tracemalloc (slower).
+            profile (str): None, 'cprofile' or 'pyinstrument'. pyinstrument falls back to cProfile
+                if it is not installed.
+            profile_dir (str): Folder of the profiles.
+        """
+        if profile not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {profile} (expected one of {PROFILE_MODES})")
+        if profile == "pyinstrument" and PyinstrumentProfiler is None:
+            print("pyinstrument is not installed, cProfile is used")
+            profile = "cprofile"
+        self.script = script
+        self.run_id = uuid.uuid4().hex
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.current = None
+        self._start = time.perf_counter()
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._profiler = None
+        if profile == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif profile == "pyinstrument":
+            self._profiler = PyinstrumentProfiler()
+            self._profiler.start()
+
+    def stage(self, name: str) -> _Stage:
+        """
+        End the stage running (if any) and start a new one.
+
+        Args:
+            name (str): Name of the stage (e.g. 'read_excel').
+
+        Returns:
+            _Stage: The stage, which can also be used in a with block.
+        """
+        self.end_stage()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.current = {"stage": name, "start": time.perf_counter(), "cpu_start": time.process_time()}
+        return _Stage(self, name)
+
+    def end_stage(self):
+        """
+        End the stage running (nothing if there is none).
+        """
+        if self.current is None:
+            return
+        measure = {
+            "stage": self.current["stage"],
+            "seconds": time.perf_counter() - self.current["start"],
+            "cpu_seconds": time.process_time() - self.current["cpu_start"],
+            "rss_mb": rss_mb(),
+            "peak_rss_mb": peak_rss_mb(),
+            "peak_children_rss_mb": peak_rss_mb(children=True),
+            "peak_traced_mb": tracemalloc.get_traced_memory()[1] / 1e6 if self.trace_memory else None,
+        }
+        self.stages.append(measure)
+        self.current = None
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Measures of the stages finished, with the share of the time of the run.
+
+        Returns:
+            pd.DataFrame: One row per stage.
+        """
+        df = pd.DataFrame(self.stages)
+        if not df.empty:
+            df["share"] = df["seconds"] / max(df["seconds"].sum(), 1e-9)
+        return df
+
+    def report(self) -> dict:
+        """
+        Report of the run (JSON serializable).
+
+        Returns:
+            dict: run_id, script, started, seconds, python, platform and stages.
+        """
+        return {
+            "run_id": self.run_id,
+            "script": self.script,
+            "started": self.started,
+            "seconds": time.perf_counter() - self._start,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stages": self.stages,
+        }
+
+    def _save_profile(self) -> str:
+        """
+        Stop the profiler of the whole run, save its result and print the slowest functions.
+        """
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, f"{self.script}_{self.run_id[:8]}")
+        if self.profile == "pyinstrument":
+            self._profiler.stop()
+            path = base + ".html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = base + ".prof"
+            self._profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(self._profiler, stream=text).sort_stats("cumulative").print_stats(15)
+            print(text.getvalue())
+        self._profiler = None
+        print(f"Profile saved in {path}")
+        return path
+
+    def finish(self, db_name: str = None) -> dict:
+        """
+        End the run: print the stages, save the profile (if any) and the run report in the database.
+
+        Args:
+            db_name (str): Database where the report is saved (None only prints it).
+
+        Returns:
+            dict: Report of the run.
+        """
+        self.end_stage()
+        if self._profiler is not None:
+            self._save_profile()
+        if self.trace_memory:
+            tracemalloc.stop()
+        report = self.report()
+        summary = self.summary()
+        if not summary.empty:
+            print(summary[["stage", "seconds", "cpu_seconds", "share", "rss_mb", "peak_rss_mb"]].round(3).to_string(index=False))
+        print(f"Run of {self.script}: {report['seconds']:.1f} s")
+        if db_name is not None:
+            save_run_report(db_name, report)
+        return report
+
+
+# -----------------------------
+# 3. Run Reports in the Database
+# -----------------------------
+def ensure_run_report_table(conn):
+    """
+    Create the run report table if it does not exist.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RUN_REPORT_TABLE} (
+            run_id TEXT PRIMARY KEY,
+            script TEXT NOT NULL,
+            started TEXT NOT NULL,
+            seconds REAL,
+            report TEXT NOT NULL
+        )
+    """)
+
+
+def save_run_report(db_name: str, report: dict):
+    """
+    Save the report of a run as a JSON row.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        report (dict): Report of RunProfiler.report.
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        ensure_run_report_table(conn)
+        with conn:
+            conn.execute(f"INSERT OR REPLACE INTO {RUN_REPORT_TABLE} (run_id, script, started, seconds, report) "
+                         f"VALUES (?, ?, ?, ?, ?)",
+                         (report["run_id"], report["script"], report["started"], report["seconds"], json.dumps(report)))
+    finally:
+        conn.close()
+
+
+def load_run_reports(db_name: str, script: str = None, last: int = None) -> pd.DataFrame:
+    """
+    Stages of the saved runs, to compare the time and memory of the daily runs.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        script (str): Only the runs of this script (optional).
+        last (int): Only the last runs (optional).
+
+    Returns:
+        pd.DataFrame: One row per run and stage: run_id, script, started, run_seconds and the
+            measures of the stage.
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        ensure_run_report_table(conn)
+        sql, params = f"SELECT report FROM {RUN_REPORT_TABLE}", []
+        if script is not None:
+            sql, params = sql + " WHERE script = ?", [script]
+        sql += " ORDER BY started DESC"
+        if last is not None:
+            sql, params = sql + " LIMIT ?", params + [int(last)]
+        reports = [json.loads(report) for (report,) in conn.execute(sql, params)]
+    finally:
+        conn.close()
+    rows = [{"run_id": r["run_id"], "script": r["script"], "started": r["started"], "run_seconds": r["seconds"], **stage}
+            for r in reversed(reports) for stage in r["stages"]]
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    runs = load_run_reports("SPA_Data_Analytics.db", last=50)
+    if runs.empty:
+        print("No runs saved yet.")
+    else:
+        # Seconds of each stage in the last run of each script, and median of the previous runs (regressions)
+        last = runs.groupby("script")["started"].transform("max") == runs["started"]
+        comparison = pd.DataFrame({
+            "last_run": runs[last].groupby(["script", "stage"], sort=False)["seconds"].sum(),
+            "median_previous": runs[~last].groupby(["script", "stage"])["seconds"].median(),
+        })
+        print(comparison.round(2).to_string())
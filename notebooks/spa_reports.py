@@ -0,0 +1,191 @@
+"""
+Export of the report files of a run (Excel, CSV and Parquet) in one batch.
+
+The reports are collected during the run and written at the end:
+- Excel files are written row by row with a streaming writer: xlsxwriter in constant_memory
+  mode if it is installed, otherwise openpyxl in write-only mode. Both keep only the current
+  row in memory, unlike DataFrame.to_excel, which builds the whole sheet first.
+- The hash of the content of each report is kept in a small JSON file. A report with the same
+  content as the file already written is not written again.
+- The time spent on each export is printed and returned.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+try:
+    import xlsxwriter
+except ImportError:  # openpyxl (already needed to read the data) is used instead
+    xlsxwriter = None
+
+
+HASH_FILE = ".spa_report_hashes.json"
+
+
+# -----------------------------
+# 1. Content Hash
+# -----------------------------
+def content_hash(df: pd.DataFrame, path: str, sheet_name: str = "Sheet1") -> str:
+    """
+    Hash of the content of a report: values, column names, types, file format and sheet name.
+
+    Args:
+        df (pd.DataFrame): Report data.
+        path (str): Output file (its extension is the format).
+        sheet_name (str): Sheet name (Excel only).
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    sha.update(json.dumps([list(map(str, df.columns)), list(map(str, df.dtypes)),
+                           os.path.splitext(path)[1].lower(), sheet_name]).encode())
+    return sha.hexdigest()
+
+
+def _load_hashes(hash_file: str) -> dict:
+    """
+    Hashes of the reports already written (empty if the file does not exist).
+    """
+    if not os.path.exists(hash_file):
+        return {}
+    with open(hash_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# -----------------------------
+# 2. Writers
+# -----------------------------
+def _rows(df: pd.DataFrame):
+    """
+    Rows of a data frame as lists of Python values (missing values as None).
+
+    Durations are written as fractions of a day, like DataFrame.to_excel.
+    """
+    durations = df.select_dtypes("timedelta").columns
+    if len(durations):
+        df = df.assign(**{c: df[c] / pd.Timedelta(days=1) for c in durations})
+    values = df.astype(object).where(df.notna(), None)
+    for row in values.itertuples(index=False, name=None):
+        yield list(row)
+
+
+def write_excel(df: pd.DataFrame, path: str, sheet_name: str = "Sheet1"):
+    """
+    Write a data frame to an Excel file row by row (header in the first row, without index).
+
+    Args:
+        df (pd.DataFrame): Data to write.
+        path (str): Output .xlsx file.
+        sheet_name (str): Sheet name.
+    """
+    header = [str(c) for c in df.columns]
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+        sheet = workbook.add_worksheet(sheet_name)
+        sheet.write_row(0, 0, header)
+        for i, row in enumerate(_rows(df), start=1):
+            sheet.write_row(i, 0, row)
+        workbook.close()
+        return
+
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(header)
+    for row in _rows(df):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_report(df: pd.DataFrame, path: str, sheet_name: str = "Sheet1"):
+    """
+    Write one report; the format is given by the extension (.xlsx, .csv or .parquet).
+
+    Args:
+        df (pd.DataFrame): Data to write.
+        path (str): Output file.
+        sheet_name (str): Sheet name (Excel only).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xlsx":
+        write_excel(df, path, sheet_name)
+    elif extension == ".csv":
+        df.to_csv(path, index=False)
+    elif extension == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unknown report format: {path}")
+
+
+# -----------------------------
+# 3. Batch of Reports
+# -----------------------------
+class ReportBatch:
+    """
+    Reports of a run, written together with write().
+
+    Attributes:
+        hash_file (str): JSON file with the content hash of each report written.
+        reports (dict): Path -> (DataFrame, sheet name) of the reports added.
+    """
+
+    def __init__(self, hash_file: str = HASH_FILE):
+        """
+        Empty batch.
+
+        Args:
+            hash_file (str): JSON file with the content hashes. None writes all the reports always.
+        """
+        self.hash_file = hash_file
+        self.reports = {}
+
+    def add(self, df: pd.DataFrame, path: str, formats: list = None, sheet_name: str = "Sheet1"):
+        """
+        Add a report to the batch.
+
+        Args:
+            df (pd.DataFrame): Report data.
+            path (str): Output file (e.g. 'SPA_Estadisticas.xlsx').
+            formats (list): Write the report in these formats instead of the extension of path
+                (e.g. ['xlsx', 'parquet']), optional.
+            sheet_name (str): Sheet name (Excel only).
+        """
+        base, extension = os.path.splitext(path)
+        for fmt in formats or [extension.lstrip(".")]:
+            output = f"{base}.{fmt}"
+            if output in self.reports:
+                raise ValueError(f"Report added twice in the same run: {output}")
+            self.reports[output] = (df, sheet_name)
+
+    def write(self) -> pd.DataFrame:
+        """
+        Write the reports whose content changed since the last run, and print the time spent on each one.
+
+        Returns:
+            pd.DataFrame: One row per report: path, rows, seconds and written (False if skipped).
+        """
+        hashes = _load_hashes(self.hash_file) if self.hash_file else {}
+        log = []
+        for path, (df, sheet_name) in self.reports.items():
+            start = time.perf_counter()
+            digest = content_hash(df, path, sheet_name)
+            written = not (os.path.exists(path) and hashes.get(path) == digest)
+            if written:
+                write_report(df, path, sheet_name)
+                hashes[path] = digest
+            seconds = time.perf_counter() - start
+            print(f"Report {path}: {len(df)} rows, {'written' if written else 'unchanged, skipped'} in {seconds:.2f} s")
+            log.append({"path": path, "rows": len(df), "seconds": seconds, "written": written})
+
+        if self.hash_file:
+            with open(self.hash_file, "w", encoding="utf-8") as f:
+                json.dump(hashes, f, indent=1)
+        self.reports = {}
+        return pd.DataFrame(log, columns=["path", "rows", "seconds", "written"])
@@ -0,0 +1,352 @@
+"""
+Runner of the whole workflow: the scripts as a graph of steps, with a cache of the steps done.
+
+The three scripts only pass data through the database and were run by hand in order. The runner
+expresses the workflow as a graph (DAG) of steps:
+
+    prepare (script 1: ingest, clean and derive) -> statistics (script 2: statistics and plots)
+                                                 -> models (script 3: training) -> evaluation
+
+Each step has a key: the SHA-256 of its input files (data, master data, scripts and spa_*.py
+modules), of its parameters and of the keys of the steps it depends on. A step whose key did not
+change since its last successful run (and whose outputs still exist) is not run again, so a
+nightly run without new files finishes in seconds. The steps whose dependencies are done run at
+the same time (statistics and models), each script in its own process.
+
+Run it from the folder of the scripts with `python spa_runner.py` (`--dry-run` shows the steps
+that would run, `--force` runs them all).
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import spa_models
+import spa_reports
+
+
+CACHE_FILE = "cache/runner/steps.json"
+LOG_DIR = "cache/runner/logs"
+
+SCRIPT_1 = "Data_Scientist_Capstone_1_Prepare_and_Clean_Data_Python_version.py"
+SCRIPT_2 = "Data_Scientist_Capstone_2_Analysis_and_Plots_Python_version.py"
+SCRIPT_3 = "Data_Scientist_Capstone_3_Pipeline_Python_version.py"
+MODULES = "spa_*.py"
+
+EVALUATION_REPORT = "SPA_Evaluacion_Modelos.xlsx"
+
+
+# -----------------------------
+# 1. Steps
+# -----------------------------
+class Step:
+    """
+    Step of the workflow.
+
+    Attributes:
+        name (str): Name of the step.
+        action (callable): Function run by the step (no arguments).
+        deps (list): Names of the steps that must be done before.
+        inputs (list): Glob patterns of the input files.
+        params (dict): Parameters of the step (part of the key).
+        outputs (list): Files or folders created by the step. If one is missing, the step runs again.
+    """
+
+    def __init__(self, name: str, action, deps: list = None, inputs: list = None, params: dict = None,
+                 outputs: list = None):
+        """
+        New step.
+
+        Args:
+            name (str): Name of the step.
+            action (callable): Function run by the step (no arguments).
+            deps (list): Names of the steps that must be done before (optional).
+            inputs (list): Glob patterns of the input files (optional).
+            params (dict): Parameters of the step, JSON serializable (optional).
+            outputs (list): Files or folders created by the step (optional).
+        """
+        self.name = name
+        self.action = action
+        self.deps = list(deps or [])
+        self.inputs = list(inputs or [])
+        self.params = dict(params or {})
+        self.outputs = list(outputs or [])
+
+
+def run_script(script: str, log_dir: str = LOG_DIR):
+    """
+    Run a script in a new Python process (plots without a display), with its output in a log file.
+
+    Args:
+        script (str): Path of the script.
+        log_dir (str): Folder of the log files (one per script, replaced at each run).
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, os.path.splitext(os.path.basename(script))[0] + ".log")
+    env = dict(os.environ, MPLBACKEND="Agg")
+    with open(log_path, "w", encoding="utf-8") as log:
+        process = subprocess.run([sys.executable, script], stdout=log, stderr=subprocess.STDOUT, env=env)
+    if process.returncode != 0:
+        with open(log_path, encoding="utf-8") as log:
+            tail = "".join(log.readlines()[-10:])
+        raise RuntimeError(f"{script} failed (exit code {process.returncode}), see {log_path}:\n{tail}")
+
+
+def evaluate_models(registry_dir: str = spa_models.REGISTRY_DIR, path: str = EVALUATION_REPORT) -> pd.DataFrame:
+    """
+    Compare the last version of each model of the registry and write the comparison as a report.
+
+    Args:
+        registry_dir (str): Folder of the registry.
+        path (str): Report file.
+
+    Returns:
+        pd.DataFrame: One row per model: name, version, model, train_rows, rmse and r2.
+    """
+    rows = []
+    for folder in sorted(glob.glob(os.path.join(registry_dir, "*", ""))):
+        name = os.path.basename(os.path.dirname(folder))
+        if not spa_models.list_versions(name, registry_dir):
+            continue
+        metadata = spa_models.load_metadata(name, registry_dir=registry_dir)
+        rows.append({"name": name, "version": metadata["version"], "model": metadata["model"],
+                     "train_rows": metadata["train_rows"], "rmse": metadata["metrics"].get("rmse"),
+                     "r2": metadata["metrics"].get("r2")})
+    evaluation = pd.DataFrame(rows, columns=["name", "version", "model", "train_rows", "rmse", "r2"])
+    spa_reports.write_report(evaluation, path)
+    return evaluation
+
+
+def default_steps(db_name: str = "SPA_Data_Analytics.db", registry_dir: str = spa_models.REGISTRY_DIR) -> list:
+    """
+    Steps of the workflow of the three scripts.
+
+    Ingest, clean and derive are one step: script 1 does them in one pass, and it only loads the
+    new or changed files itself in incremental mode. Any change of a spa_*.py module runs again
+    the scripts that use the modules.
+
+    Args:
+        db_name (str): Database written by script 1 (the configuration of the scripts is not changed).
+        registry_dir (str): Registry of the models written by script 3.
+
+    Returns:
+        list: Steps.
+    """
+    return [
+        Step("prepare", lambda: run_script(SCRIPT_1), inputs=["data/*.xlsx", "master_data/*.xlsx", SCRIPT_1, MODULES],
+             outputs=[db_name]),
+        Step("statistics", lambda: run_script(SCRIPT_2), deps=["prepare"], inputs=[SCRIPT_2, MODULES]),
+        Step("models", lambda: run_script(SCRIPT_3), deps=["prepare"], inputs=[SCRIPT_3, MODULES],
+             outputs=[registry_dir]),
+        Step("evaluation", lambda: print(evaluate_models(registry_dir)), deps=["models"],
+             params={"registry_dir": registry_dir}, outputs=[EVALUATION_REPORT]),
+    ]
+
+
+# -----------------------------
+# 2. Keys and Cache
+# -----------------------------
+def _load_cache(cache_file: str) -> dict:
+    """
+    Cache of the runner (empty if the file does not exist).
+    """
+    if not os.path.exists(cache_file):
+        return {"steps": {}, "files": {}}
+    with open(cache_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_cache(cache: dict, cache_file: str):
+    """
+    Write the cache of the runner (through a temporary file, so it is never half written).
+    """
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    with open(cache_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=1)
+    os.replace(cache_file + ".tmp", cache_file)
+
+
+def _file_hash(path: str, known: dict) -> str:
+    """
+    SHA-256 of a file. The hash is only calculated again if the size or the modification time changed.
+    """
+    stat = os.stat(path)
+    entry = known.get(path)
+    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": sha.hexdigest()}
+        known[path] = entry
+    return entry["hash"]
+
+
+def step_key(step: Step, dep_keys: list, known_files: dict) -> str:
+    """
+    Key of a step: hash of its input files, its parameters and the keys of its dependencies.
+
+    Args:
+        step (Step): Step.
+        dep_keys (list): Keys of the dependencies, in the order of step.deps.
+        known_files (dict): Hashes of the files already calculated (updated with the new ones).
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    files = sorted({path for pattern in step.inputs for path in glob.glob(pattern)})
+    content = {
+        "step": step.name,
+        "params": step.params,
+        "files": [[path, _file_hash(path, known_files)] for path in files],
+        "deps": dep_keys,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def _order(steps: list) -> list:
+    """
+    Steps sorted so that each one comes after its dependencies (error if there is a cycle).
+    """
+    by_name = {step.name: step for step in steps}
+    ordered, state = [], {}
+
+    def visit(step):
+        if state.get(step.name) == "done":
+            return
+        if state.get(step.name) == "visiting":
+            raise ValueError(f"Cycle in the steps at '{step.name}'")
+        state[step.name] = "visiting"
+        for dep in step.deps:
+            if dep not in by_name:
+                raise ValueError(f"Step '{step.name}' depends on the unknown step '{dep}'")
+            visit(by_name[dep])
+        state[step.name] = "done"
+        ordered.append(step)
+
+    for step in steps:
+        visit(step)
+    return ordered
+
+
+# -----------------------------
+# 3. Run
+# -----------------------------
+def run(steps: list = None, targets: list = None, force: bool = False, max_workers: int = 2,
+        cache_file: str = CACHE_FILE, dry_run: bool = False) -> pd.DataFrame:
+    """
+    Run the steps that changed since their last successful run, the independent ones at the same time.
+
+    Args:
+        steps (list): Steps of the workflow (default default_steps()).
+        targets (list): Run only these steps and the steps they depend on (optional).
+        force (bool): Run all the steps, also the ones in the cache.
+        max_workers (int): Steps run at the same time.
+        cache_file (str): JSON file with the key of each step done and the hashes of the files.
+        dry_run (bool): Only show which steps would run.
+
+    Returns:
+        pd.DataFrame: One row per step: step, status ('cached', 'run', 'to run', 'failed' or
+            'not run' after a failed dependency), seconds and error.
+    """
+    steps = _order(steps if steps is not None else default_steps())
+    by_name = {step.name: step for step in steps}
+    if targets:
+        needed, pending = set(), list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(by_name[name].deps)
+        steps = [step for step in steps if step.name in needed]
+
+    cache = _load_cache(cache_file)
+    lock = threading.Lock()
+    keys, results = {}, {}
+
+    def start(step):
+        """
+        Key of a step whose dependencies are done, and the step itself if it has to run.
+        """
+        keys[step.name] = step_key(step, [keys[d] for d in step.deps], cache["files"])
+        done = cache["steps"].get(step.name, {}).get("key") == keys[step.name]
+        missing = [path for path in step.outputs if not os.path.exists(path)]
+        # A dependency that runs again gives a new key, so only the steps without changes are cached
+        if done and not missing and not force:
+            results[step.name] = {"step": step.name, "status": "cached", "seconds": 0.0, "error": None}
+            return None
+        if dry_run:
+            results[step.name] = {"step": step.name, "status": "to run", "seconds": 0.0, "error": None}
+            return None
+        return step
+
+    def execute(step):
+        """
+        Run a step and keep its key in the cache if it succeeds.
+        """
+        print(f"Step {step.name}: running")
+        begin = time.perf_counter()
+        step.action()
+        seconds = time.perf_counter() - begin
+        with lock:
+            cache["steps"][step.name] = {"key": keys[step.name], "seconds": seconds,
+                                         "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+            _save_cache(cache, cache_file)
+        print(f"Step {step.name}: done in {seconds:.1f} s")
+        return seconds
+
+    remaining = list(steps)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while remaining or running:
+            for step in list(remaining):
+                if any(results.get(d, {}).get("status") in ("failed", "not run") for d in step.deps):
+                    results[step.name] = {"step": step.name, "status": "not run", "seconds": 0.0, "error": None}
+                    remaining.remove(step)
+                elif all(d in results for d in step.deps):
+                    remaining.remove(step)
+                    to_run = start(step)
+                    if to_run is not None:
+                        running[executor.submit(execute, to_run)] = to_run
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    results[step.name] = {"step": step.name, "status": "run", "seconds": future.result(),
+                                          "error": None}
+                except Exception as error:
+                    print(f"Step {step.name}: failed")
+                    results[step.name] = {"step": step.name, "status": "failed", "seconds": 0.0, "error": str(error)}
+
+    with lock:
+        _save_cache(cache, cache_file)
+    return pd.DataFrame([results[step.name] for step in steps])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the workflow of the three scripts, only the steps that changed")
+    parser.add_argument("targets", nargs="*", help="steps to run with their dependencies (default all)")
+    parser.add_argument("--force", action="store_true", help="run all the steps, also the cached ones")
+    parser.add_argument("--workers", type=int, default=2, help="steps run at the same time")
+    parser.add_argument("--dry-run", action="store_true", help="only show which steps would run")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    summary = run(targets=args.targets, force=args.force, max_workers=args.workers, dry_run=args.dry_run)
+    print(summary[["step", "status", "seconds"]].to_string(index=False))
+    print(f"Workflow finished in {time.perf_counter() - start_time:.1f} s")
+    failed = summary[summary["status"] == "failed"]
+    for step, error in zip(failed["step"], failed["error"]):
+        print(f"\n{step}: {error}")
+    sys.exit(1 if len(failed) else 0)
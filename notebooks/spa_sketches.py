@@ -0,0 +1,503 @@
+"""
+Approximate statistics of each PLP and Material with mergeable sketches.
+
+The exact median of a group needs all its values in memory, and a new day of data means
+computing it again from the whole history. A sketch keeps a small summary of the values of a
+group that can be merged with the summary of new values:
+- Count, mean and variance (Welford / Chan formulas) and min / max: exact.
+- Median and quantiles: t-digest (sorted centroids, small near the tails). Groups with few
+  values keep all of them, so their quantiles are exact.
+
+The sketches of each (PLP, Material) and target column are stored in the table
+SPA_Stat_Sketches of the database, and script 1 merges the values of each new load. Script 2
+can read the statistics from the sketches instead of the history (stats_backend = "sketch").
+
+Run this file to compare the sketches with the exact statistics on synthetic data:
+    python spa_sketches.py
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import spa_stats
+import spa_storage
+
+
+SKETCH_TABLE = "SPA_Stat_Sketches"
+
+# Target columns summarized by the sketches
+SKETCH_TARGETS = ["Supply_time_hours", "time_between_MatReqs"]
+
+# Compression of the t-digest: more centroids give better quantiles and bigger sketches
+COMPRESSION = 200
+
+
+# -----------------------------
+# 1. Sketch of a Group
+# -----------------------------
+class QuantileSketch:
+    """
+    Mergeable summary of the values of one group.
+
+    Attributes:
+        n (int): Number of values.
+        mean (float): Mean.
+        m2 (float): Sum of squared differences from the mean (variance = m2 / (n - 1)).
+        min (float): Minimum.
+        max (float): Maximum.
+        means (np.ndarray): Means of the centroids of the t-digest, sorted.
+        weights (np.ndarray): Number of values of each centroid.
+        compression (int): Compression of the t-digest.
+    """
+
+    def __init__(self, compression: int = COMPRESSION):
+        """
+        Empty sketch.
+
+        Args:
+            compression (int): Compression of the t-digest.
+        """
+        self.compression = compression
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.nan
+        self.max = np.nan
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+
+    @classmethod
+    def from_values(cls, values, compression: int = COMPRESSION) -> "QuantileSketch":
+        """
+        Sketch of an array of values (missing values are ignored).
+
+        Args:
+            values (array-like): Values.
+            compression (int): Compression of the t-digest.
+
+        Returns:
+            QuantileSketch: The sketch.
+        """
+        sketch = cls(compression)
+        values = np.asarray(values, dtype="float64")
+        values = np.sort(values[~np.isnan(values)])
+        if len(values) == 0:
+            return sketch
+        sketch.n = len(values)
+        sketch.mean = float(values.mean())
+        sketch.m2 = float(np.sum((values - sketch.mean) ** 2))
+        sketch.min = float(values[0])
+        sketch.max = float(values[-1])
+        sketch.means = values
+        sketch.weights = np.ones(len(values))
+        sketch._compress()
+        return sketch
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """
+        Add the values summarized by another sketch to this one.
+
+        Args:
+            other (QuantileSketch): Sketch to merge.
+
+        Returns:
+            QuantileSketch: This sketch.
+        """
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            self.means, self.weights = other.means.copy(), other.weights.copy()
+            return self
+
+        # Mean and variance of the union (Chan et al.)
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta ** 2 * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        means = np.concatenate([self.means, other.means])
+        order = np.argsort(means, kind="stable")
+        self.means = means[order]
+        self.weights = np.concatenate([self.weights, other.weights])[order]
+        self._compress()
+        return self
+
+    def _compress(self):
+        """
+        Merge neighbour centroids when there are more than `compression` centroids.
+
+        Each centroid covers at most one unit of the scale k(q) = compression / (2 pi) * asin(2q - 1),
+        so the centroids are small near the tails (q close to 0 or 1) and bigger near the median.
+        """
+        if len(self.means) <= self.compression:
+            return
+        cumulative = np.cumsum(self.weights)
+        q = (cumulative - self.weights / 2) / cumulative[-1]
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        bucket = np.floor(k - k[0]).astype("int64")
+        weights = np.bincount(bucket, weights=self.weights)
+        sums = np.bincount(bucket, weights=self.weights * self.means)
+        used = weights > 0
+        self.weights = weights[used]
+        self.means = sums[used] / self.weights
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimated quantile, with linear interpolation like pandas.
+
+        The exact quantile is given while the sketch keeps all the values.
+
+        Args:
+            q (float): Quantile between 0 and 1.
+
+        Returns:
+            float: Estimated value (NaN for an empty sketch).
+        """
+        if self.n == 0:
+            return np.nan
+        # Rank (0 .. n-1) of the centre of each centroid
+        centers = np.cumsum(self.weights) - self.weights + (self.weights - 1) / 2
+        ranks = np.concatenate([[0.0], centers, [self.n - 1.0]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return float(np.interp(q * (self.n - 1), ranks, values))
+
+    def std(self) -> float:
+        """
+        Sample standard deviation (ddof=1, like pandas). NaN with less than 2 values.
+        """
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
+
+    def metric(self, name: str) -> float:
+        """
+        Value of a metric: 'median', 'std', 'min', 'max', 'mean' or 'count'.
+        """
+        if name == "median":
+            return self.quantile(0.5)
+        if name == "std":
+            return self.std()
+        if name == "count":
+            return self.n
+        if name in ("min", "max", "mean"):
+            return getattr(self, name) if self.n else np.nan
+        raise ValueError(f"Unknown metric: {name!r}")
+
+
+# -----------------------------
+# 2. Sketches of the History
+# -----------------------------
+def build_sketches(df: pd.DataFrame, target_cols: list = None, compression: int = COMPRESSION) -> dict:
+    """
+    Sketches of each (PLP, Material) and target column of a data frame.
+
+    Args:
+        df (pd.DataFrame): Data with the columns PLP, Material and the target columns.
+        target_cols (list): Target columns. Default SKETCH_TARGETS.
+        compression (int): Compression of the t-digest.
+
+    Returns:
+        dict: (PLP, Material, target column) -> QuantileSketch.
+    """
+    target_cols = list(target_cols or SKETCH_TARGETS)
+    sketches = {}
+    for (plp, material), group in df.groupby(["PLP", "Material"], observed=True):
+        for column in target_cols:
+            sketches[(plp, material, column)] = QuantileSketch.from_values(group[column].to_numpy(), compression)
+    return sketches
+
+
+def merge_sketches(sketches: dict, new: dict) -> dict:
+    """
+    Merge a dictionary of sketches into another one.
+
+    Args:
+        sketches (dict): Sketches updated in place.
+        new (dict): Sketches to add.
+
+    Returns:
+        dict: The updated sketches.
+    """
+    for key, sketch in new.items():
+        if key in sketches:
+            sketches[key].merge(sketch)
+        else:
+            sketches[key] = sketch
+    return sketches
+
+
+def ensure_sketch_table(conn: sqlite3.Connection):
+    """
+    Create the table of sketches if it does not exist.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SKETCH_TABLE} (
+            PLP TEXT NOT NULL,
+            Material TEXT NOT NULL,
+            target TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            mean REAL,
+            m2 REAL,
+            min REAL,
+            max REAL,
+            compression INTEGER NOT NULL,
+            means BLOB NOT NULL,
+            weights BLOB NOT NULL,
+            PRIMARY KEY (PLP, Material, target)
+        )
+    """)
+
+
+def load_sketches(conn: sqlite3.Connection, plps: list = None) -> dict:
+    """
+    Read the stored sketches.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        plps (list): Read only these PLPs (optional).
+
+    Returns:
+        dict: (PLP, Material, target column) -> QuantileSketch.
+    """
+    ensure_sketch_table(conn)
+    sql = f"SELECT PLP, Material, target, n, mean, m2, min, max, compression, means, weights FROM {SKETCH_TABLE}"
+    params = []
+    if plps is not None:
+        plps = list(plps)
+        sql += f" WHERE PLP IN ({', '.join('?' for _ in plps)})"
+        params = plps
+
+    sketches = {}
+    for plp, material, target, n, mean, m2, min_value, max_value, compression, means, weights in conn.execute(sql, params):
+        sketch = QuantileSketch(compression)
+        sketch.n, sketch.mean, sketch.m2 = n, mean, m2
+        sketch.min = np.nan if min_value is None else min_value
+        sketch.max = np.nan if max_value is None else max_value
+        sketch.means = np.frombuffer(means, dtype="float64").copy()
+        sketch.weights = np.frombuffer(weights, dtype="float64").copy()
+        sketches[(plp, material, target)] = sketch
+    return sketches
+
+
+def save_sketches(conn: sqlite3.Connection, sketches: dict):
+    """
+    Insert or replace sketches in the table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        sketches (dict): (PLP, Material, target column) -> QuantileSketch.
+    """
+    ensure_sketch_table(conn)
+    rows = [
+        (plp, material, target, s.n, s.mean, s.m2,
+         None if np.isnan(s.min) else s.min, None if np.isnan(s.max) else s.max,
+         s.compression, s.means.astype("float64").tobytes(), s.weights.astype("float64").tobytes())
+        for (plp, material, target), s in sketches.items()
+    ]
+    conn.executemany(f"INSERT OR REPLACE INTO {SKETCH_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+def _sketches_from_history(conn: sqlite3.Connection, target_cols: list, plps: list = None,
+                           chunk_rows: int = 100000) -> dict:
+    """
+    Build the sketches from the stored history, reading it in chunks.
+    """
+    sql, params, _ = spa_storage.build_history_query(["PLP", "Material"] + target_cols, plps=plps)
+    sketches = {}
+    for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunk_rows):
+        merge_sketches(sketches, build_sketches(chunk, target_cols))
+    return sketches
+
+
+def update_sketches(conn: sqlite3.Connection, df: pd.DataFrame, target_cols: list = None, replace: bool = False,
+                    rebuild_plps: list = None):
+    """
+    Merge the rows of a new load into the stored sketches.
+
+    Call it after the rows are written to the history. The PLPs in rebuild_plps (e.g. late-arriving
+    data, where stored values of time_between_MatReqs changed) are built again from the history.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        df (pd.DataFrame): New rows (PLP, Material and target columns).
+        target_cols (list): Target columns. Default SKETCH_TARGETS.
+        replace (bool): Remove all the stored sketches first (full load).
+        rebuild_plps (list): PLPs built again from the history (optional).
+    """
+    target_cols = list(target_cols or SKETCH_TARGETS)
+    ensure_sketch_table(conn)
+    if replace:
+        conn.execute(f"DELETE FROM {SKETCH_TABLE}")
+
+    rebuild_plps = list(rebuild_plps or [])
+    if rebuild_plps:
+        conn.execute(f"DELETE FROM {SKETCH_TABLE} WHERE PLP IN ({', '.join('?' for _ in rebuild_plps)})",
+                     rebuild_plps)
+        save_sketches(conn, _sketches_from_history(conn, target_cols, plps=rebuild_plps))
+        df = df[~df["PLP"].isin(rebuild_plps)]
+
+    new = build_sketches(df, target_cols)
+    stored = {} if replace else load_sketches(conn, plps=df["PLP"].unique().tolist())
+    save_sketches(conn, merge_sketches(stored, new))
+    conn.commit()
+
+
+def rebuild_sketches(conn: sqlite3.Connection, target_cols: list = None):
+    """
+    Build all the sketches again from the history (e.g. after the rows of a changed file were replaced).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        target_cols (list): Target columns. Default SKETCH_TARGETS.
+    """
+    target_cols = list(target_cols or SKETCH_TARGETS)
+    ensure_sketch_table(conn)
+    conn.execute(f"DELETE FROM {SKETCH_TABLE}")
+    save_sketches(conn, _sketches_from_history(conn, target_cols))
+    conn.commit()
+
+
+# -----------------------------
+# 3. Statistics from the Sketches
+# -----------------------------
+def sketch_stats(sketches: dict, target_cols: list = None, metrics: list = None, quantiles: list = None) -> pd.DataFrame:
+    """
+    Statistics of each (PLP, Material) from the sketches, with the same layout as spa_stats.grouped_stats.
+
+    Args:
+        sketches (dict): (PLP, Material, target column) -> QuantileSketch.
+        target_cols (list): Target columns. Default SKETCH_TARGETS.
+        metrics (list): 'median', 'std', 'min', 'max', 'mean' or 'count' (default median, std, min, max).
+        quantiles (list): Quantiles to add (e.g. [0.25, 0.75]), optional.
+
+    Returns:
+        pd.DataFrame: Statistics indexed by PLP and Material, with columns (target column, metric).
+    """
+    target_cols = list(target_cols or SKETCH_TARGETS)
+    metrics = list(metrics or spa_stats.DEFAULT_METRICS)
+    quantiles = list(quantiles or [])
+    groups = sorted({(plp, material) for plp, material, _ in sketches})
+
+    data = {}
+    for column in target_cols:
+        group_sketches = [sketches.get((plp, material, column), QuantileSketch()) for plp, material in groups]
+        for name in metrics:
+            data[(column, name)] = [s.metric(name) for s in group_sketches]
+        for q in quantiles:
+            data[(column, spa_stats.quantile_name(q))] = [s.quantile(q) for s in group_sketches]
+
+    index = pd.MultiIndex.from_tuples(groups, names=["PLP", "Material"]) if groups else \
+        pd.MultiIndex.from_arrays([[], []], names=["PLP", "Material"])
+    return pd.DataFrame(data, index=index, columns=pd.MultiIndex.from_tuples(list(data)))
+
+
+def load_sketch_stats(db_name: str, target_cols: list = None, metrics: list = None, quantiles: list = None,
+                      plps: list = None) -> pd.DataFrame:
+    """
+    Open the database and compute sketch_stats from the stored sketches.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        target_cols (list): Target columns. Default SKETCH_TARGETS.
+        metrics (list): Metrics (default median, std, min, max).
+        quantiles (list): Quantiles to add, optional.
+        plps (list): Use only these PLPs (optional).
+
+    Returns:
+        pd.DataFrame: Statistics (see sketch_stats).
+    """
+    conn = spa_storage.connect(db_name)
+    try:
+        return sketch_stats(load_sketches(conn, plps), target_cols, metrics, quantiles)
+    finally:
+        conn.close()
+
+
+# -----------------------------
+# 4. Accuracy Harness
+# -----------------------------
+def compare_with_exact(df: pd.DataFrame, target_col: str, sketches: dict,
+                       quantiles: list = (0.5, 0.9, 0.99)) -> pd.DataFrame:
+    """
+    Compare the quantiles of the sketches with the exact quantiles of each group.
+
+    The rank error is the distance between q and the fraction of values of the group below the
+    estimated value: it does not depend on the scale of the data.
+
+    Args:
+        df (pd.DataFrame): Data with PLP, Material and the target column.
+        target_col (str): Target column.
+        sketches (dict): Sketches built from the same data.
+        quantiles (list): Quantiles to compare.
+
+    Returns:
+        pd.DataFrame: For each quantile, the number of groups, max / mean absolute error and max rank error.
+    """
+    results = []
+    groups = {key: np.sort(group[target_col].dropna().to_numpy())
+              for key, group in df.groupby(["PLP", "Material"], observed=True)}
+    for q in quantiles:
+        abs_errors, rank_errors = [], []
+        for (plp, material), values in groups.items():
+            if len(values) == 0:
+                continue
+            estimate = sketches[(plp, material, target_col)].quantile(q)
+            abs_errors.append(abs(estimate - np.quantile(values, q)))
+            below = np.searchsorted(values, estimate, side="right") / len(values)
+            rank_errors.append(abs(below - q) if len(values) > 1 else 0.0)
+        results.append({
+            "quantile": q,
+            "groups": len(abs_errors),
+            "max_abs_error": float(np.max(abs_errors)),
+            "mean_abs_error": float(np.mean(abs_errors)),
+            "max_rank_error": float(np.max(rank_errors)),
+        })
+    return pd.DataFrame(results)
+
+
+def _synthetic_history(n_groups: int, n_days: int, seed: int) -> pd.DataFrame:
+    """
+    Synthetic requests of several PLPs over several days (log-normal times, very different group sizes).
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.integers(1, 400, n_groups)
+    frames = []
+    for day in range(n_days):
+        for g, size in enumerate(sizes):
+            n = rng.poisson(size)
+            frames.append(pd.DataFrame({
+                "PLP": f"PLP{g:04d}", "Material": "M", "day": day,
+                "time_between_MatReqs": rng.lognormal(mean=g % 5, sigma=1.0, size=n),
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def accuracy_harness(n_groups: int = 200, n_days: int = 20, seed: int = 42) -> pd.DataFrame:
+    """
+    Build the sketches day by day (merging each new day) and compare them with the exact quantiles.
+
+    Args:
+        n_groups (int): Number of (PLP, Material) groups.
+        n_days (int): Number of days merged one by one.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pd.DataFrame: Result of compare_with_exact.
+    """
+    df = _synthetic_history(n_groups, n_days, seed)
+    sketches = {}
+    for _, day in df.groupby("day"):
+        merge_sketches(sketches, build_sketches(day, ["time_between_MatReqs"]))
+    return compare_with_exact(df, "time_between_MatReqs", sketches)
+
+
+if __name__ == "__main__":
+    print(accuracy_harness())
@@ -0,0 +1,121 @@
+"""
+Grouped statistics of the history of Material Requests in one pass.
+
+The analysis (script 2) needs the same statistics (median, std, min, max) of several columns
+(Supply_time_hours, time_between_MatReqs) for all PLPs, for the MVP PLPs and for one PLP. The
+data is grouped only once by PLP and Material, all the metrics of all the columns are computed
+from this grouping, and the results of a subset of PLPs are taken from the result of all PLPs
+(the statistics of a group don't depend on the other groups).
+"""
+
+import pandas as pd
+
+
+DEFAULT_METRICS = ["median", "std", "min", "max"]
+
+
+# -----------------------------
+# 1. Grouped Statistics
+# -----------------------------
+def quantile_name(q: float) -> str:
+    """
+    Name of the column of a quantile (e.g. 0.25 -> 'q0.25').
+    """
+    return f"q{q:g}"
+
+
+def grouped_stats(df: pd.DataFrame, group_cols: list, target_cols: list, metrics: list = None,
+                  quantiles: list = None) -> pd.DataFrame:
+    """
+    Compute several metrics of several columns with one grouping of the data.
+
+    Args:
+        df (pd.DataFrame): Input DataFrame.
+        group_cols (list): Columns to group by (e.g. ['PLP', 'Material']).
+        target_cols (list): Columns to compute statistics on.
+        metrics (list): Aggregations of pandas (default median, std, min, max). 'count' gives
+            the number of values of each group.
+        quantiles (list): Quantiles to add (e.g. [0.25, 0.75]), optional.
+
+    Returns:
+        pd.DataFrame: Statistics indexed by the group columns, with columns (target column, metric).
+    """
+    metrics = list(metrics or DEFAULT_METRICS)
+    target_cols = list(target_cols)
+    grouped = df.groupby(group_cols, observed=True)[target_cols]
+    stats = grouped.agg(metrics)
+
+    if quantiles:
+        # The same grouping is used for the quantiles
+        values = grouped.quantile(list(quantiles)).unstack(-1)
+        values.columns = pd.MultiIndex.from_tuples([(c, quantile_name(q)) for c, q in values.columns])
+        stats = pd.concat([stats, values], axis=1)
+        names = metrics + [quantile_name(q) for q in quantiles]
+        stats = stats[[(c, name) for c in target_cols for name in names]]
+    return stats
+
+
+def grouped_stats_by_chunks(chunks, group_cols: list, target_cols: list, metrics: list = None,
+                            quantiles: list = None) -> pd.DataFrame:
+    """
+    Compute grouped_stats from chunks of data, with bounded memory.
+
+    The chunks must be sorted by the first group column (e.g. spa_storage.iter_history_chunks with
+    order_by=['PLP']). The statistics of a group are computed as soon as the group is complete, so
+    only the rows of one group are kept between two chunks and medians and quantiles are exact.
+
+    Args:
+        chunks (iterable): Chunks of data (pd.DataFrame).
+        group_cols (list): Columns to group by.
+        target_cols (list): Columns to compute statistics on.
+        metrics (list): Aggregations (default median, std, min, max).
+        quantiles (list): Quantiles to add, optional.
+
+    Returns:
+        pd.DataFrame: Same result as grouped_stats with all the data.
+    """
+    results = []
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+        # The last group of the chunk may continue in the next chunk
+        complete = chunk[group_cols[0]] != chunk[group_cols[0]].iloc[-1]
+        if complete.any():
+            results.append(grouped_stats(chunk[complete], group_cols, target_cols, metrics, quantiles))
+        pending = chunk[~complete]
+
+    if pending is not None and not pending.empty:
+        results.append(grouped_stats(pending, group_cols, target_cols, metrics, quantiles))
+    if not results:
+        columns = list(group_cols) + list(target_cols)
+        return grouped_stats(pd.DataFrame(columns=columns), group_cols, target_cols, metrics, quantiles)
+    return pd.concat(results).sort_index()
+
+
+# -----------------------------
+# 2. Select Results
+# -----------------------------
+def select_stats(stats: pd.DataFrame, target_col: str, column: str = None, values: list = None) -> pd.DataFrame:
+    """
+    Statistics of one target column, optionally for a subset of groups (e.g. MVP PLPs).
+
+    Gives the same table as computing the statistics again on the filtered data.
+
+    Args:
+        stats (pd.DataFrame): Result of grouped_stats.
+        target_col (str): Target column.
+        column (str): Group column to filter on (e.g. 'PLP'), optional.
+        values (list): Values of the group column to keep.
+
+    Returns:
+        pd.DataFrame: Group columns and one column per metric.
+    """
+    result = stats[target_col]
+    if column is not None:
+        result = result[result.index.get_level_values(column).isin(values)]
+    result = result.reset_index()
+    result.columns.name = None
+    return result
@@ -0,0 +1,619 @@
+"""
+Storage of the history of Material Requests in the SQLite database.
+
+The cleaned rows are stored in a table with an explicit schema:
+- Timestamps as integer epochs (seconds since 1970-01-01).
+- PLP and Material as integer codes of two small dimension tables.
+- Indexes on (PLP, datetime_creac), datetime_creac, Material and source file.
+
+The writes are done with executemany in batches inside one transaction, and the database uses
+WAL mode, so loads and filtered reads stay fast when the history grows.
+
+The former table name SPA_Historic_Manual_Requests is kept as a view with the same columns and
+text datetimes as before, so `SELECT * FROM SPA_Historic_Manual_Requests` still works.
+
+The first request of each PLP has no previous request (no time_between_MatReqs), so it is not in
+the history. It is kept with all its columns in the table SPA_PLP_First_Requests, to move it to
+the history when an older request of the PLP arrives later (see spa_ingest.recalculate_plps).
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+HISTORY_VIEW = "SPA_Historic_Manual_Requests"
+LEGACY_TABLE = "SPA_Historic_Manual_Requests_Legacy"
+HISTORY_TABLE = "SPA_Historic_Manual_Requests_Data"
+PLP_TABLE = "SPA_Dim_PLP"
+MATERIAL_TABLE = "SPA_Dim_Material"
+FIRST_REQUEST_TABLE = "SPA_PLP_First_Requests"
+
+# Columns of the history: (column, SQLite type, kind)
+# kind: 'int', 'real', 'text', 'epoch' (datetime stored as seconds) or 'code' (id in a dimension table)
+HISTORY_SCHEMA = [
+    ("SFab", "INTEGER", "int"),
+    ("GLin", "TEXT", "text"),
+    ("UbiLínea", "TEXT", "text"),
+    ("Material", "INTEGER", "code"),
+    ("Status", "INTEGER", "int"),
+    ("Denominacion", "TEXT", "text"),
+    ("Tipo Sum", "TEXT", "text"),
+    ("Consumo", "REAL", "real"),
+    ("F.Creac", "TEXT", "text"),
+    ("H.Creac", "TEXT", "text"),
+    ("F.Conf OT", "TEXT", "text"),
+    ("H.Conf OT", "TEXT", "text"),
+    ("Ubic.proc.", "TEXT", "text"),
+    ("Tp.alm.proc.", "TEXT", "text"),
+    ("source_file", "TEXT", "text"),
+    ("PLP", "INTEGER", "code"),
+    ("PVB", "TEXT", "text"),
+    ("Válido de", "INTEGER", "epoch"),
+    ("Válido a", "INTEGER", "epoch"),
+    ("Cap. Sumin", "REAL", "real"),
+    ("datetime_creac", "INTEGER", "epoch"),
+    ("datetime_conf", "INTEGER", "epoch"),
+    ("Supply_time_hours", "REAL", "real"),
+    ("time_between_MatReqs", "REAL", "real"),
+]
+
+# Dimension table of each coded column: (table, id column)
+CODE_TABLES = {
+    "PLP": (PLP_TABLE, "plp_id"),
+    "Material": (MATERIAL_TABLE, "material_id"),
+}
+
+BATCH_SIZE = 10000
+
+
+# -----------------------------
+# 1. Connection and Schema
+# -----------------------------
+def connect(db_name: str) -> sqlite3.Connection:
+    """
+    Open the database in WAL mode (readers don't block the writer) and create the schema.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: Open connection.
+    """
+    conn = sqlite3.connect(db_name)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    create_schema(conn)
+    return conn
+
+
+def _quote(column: str) -> str:
+    """
+    Column name quoted for SQL (the names have spaces, dots and accents).
+    """
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _storage_column(column: str) -> str:
+    """
+    Name of a column in the history table (the coded columns store the id).
+    """
+    return CODE_TABLES[column][1] if column in CODE_TABLES else column
+
+
+def table_exists(conn: sqlite3.Connection, name: str, kind: str = "table") -> bool:
+    """
+    Check if a table (or view) exists in the database.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        name (str): Name of the table.
+        kind (str): 'table' or 'view'.
+
+    Returns:
+        bool: True if it exists.
+    """
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)).fetchone()
+    return row is not None
+
+
+def create_schema(conn: sqlite3.Connection):
+    """
+    Create the dimension tables, the history table with its indexes and the compatibility view.
+
+    If a table SPA_Historic_Manual_Requests written by an older version (pandas to_sql) exists, it
+    is not changed and the view is not created: script 1 migrates it with migrate_legacy_history.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+    """
+    for column, (table, id_column) in CODE_TABLES.items():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {id_column} INTEGER PRIMARY KEY,
+                {_quote(column)} TEXT NOT NULL UNIQUE
+            )
+        """)
+    _create_history_table(conn)
+    _create_indexes(conn)
+    if table_exists(conn, HISTORY_VIEW, "table"):
+        print(f"Table {HISTORY_VIEW} of an older version found: run script 1 to migrate it.")
+    else:
+        _create_view(conn)
+    _create_history_table(conn, FIRST_REQUEST_TABLE)
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ix_first_requests_plp ON {FIRST_REQUEST_TABLE} (plp_id)")
+    conn.commit()
+
+
+def migrate_legacy_history(conn: sqlite3.Connection) -> int:
+    """
+    Copy the rows of a table SPA_Historic_Manual_Requests of an older version into the typed history table.
+
+    The rows are only copied if the history table is empty. The old table is then renamed to
+    SPA_Historic_Manual_Requests_Legacy (not dropped) and the view is created with its name.
+
+    Args:
+        conn (sqlite3.Connection): Connection from connect().
+
+    Returns:
+        int: Number of rows copied.
+    """
+    if not table_exists(conn, HISTORY_VIEW, "table"):
+        return 0
+    legacy = pd.read_sql(f"SELECT * FROM {HISTORY_VIEW}", conn)
+    # pandas to_sql stored the datetimes as text
+    legacy = legacy.assign(**{column: pd.to_datetime(legacy[column], errors="coerce")
+                              for column, _, kind in HISTORY_SCHEMA if kind == "epoch" and column in legacy.columns})
+    rows = 0
+    with conn:
+        if history_row_count(conn) == 0:
+            rows = _insert_rows(conn, HISTORY_TABLE, legacy)
+        conn.execute(f"ALTER TABLE {HISTORY_VIEW} RENAME TO {LEGACY_TABLE}")
+        _create_view(conn)
+    print(f"Table {HISTORY_VIEW} of an older version: {rows} rows copied to {HISTORY_TABLE}, "
+          f"old table renamed to {LEGACY_TABLE}")
+    return rows
+
+
+def _create_history_table(conn: sqlite3.Connection, table: str = HISTORY_TABLE):
+    """
+    Create the typed history table (or a table with the same columns) if it does not exist.
+    """
+    columns = ",\n".join(f"{_quote(_storage_column(c))} {sql_type}" for c, sql_type, _ in HISTORY_SCHEMA)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (\n{columns}\n)")
+
+
+def _create_indexes(conn: sqlite3.Connection):
+    """
+    Create the indexes of the history table if they do not exist.
+    """
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_history_plp_creac ON {HISTORY_TABLE} (plp_id, datetime_creac)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_history_creac ON {HISTORY_TABLE} (datetime_creac)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_history_material ON {HISTORY_TABLE} (material_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS ix_history_source_file ON {HISTORY_TABLE} (source_file)")
+
+
+def _view_expression(column: str, kind: str) -> str:
+    """
+    SQL expression of a column of the compatibility view.
+    """
+    if kind == "code":
+        return f"{CODE_TABLES[column][0]}.{_quote(column)}"
+    if kind == "epoch":
+        return f"datetime(h.{_quote(column)}, 'unixepoch')"
+    return f"h.{_quote(column)}"
+
+
+def _create_view(conn: sqlite3.Connection):
+    """
+    Create the view SPA_Historic_Manual_Requests with the former columns (text datetimes, Supply_time in ns).
+    """
+    select = []
+    for column, _, kind in HISTORY_SCHEMA:
+        select.append(f"{_view_expression(column, kind)} AS {_quote(column)}")
+        if column == "datetime_conf":
+            select.append("(h.datetime_conf - h.datetime_creac) * 1000000000 AS Supply_time")
+    joins = " ".join(
+        f"JOIN {table} ON {table}.{id_column} = h.{id_column}" for table, id_column in CODE_TABLES.values()
+    )
+    conn.execute(f"CREATE VIEW IF NOT EXISTS {HISTORY_VIEW} AS SELECT {', '.join(select)} "
+                 f"FROM {HISTORY_TABLE} h {joins}")
+
+
+# -----------------------------
+# 2. Type Conversions
+# -----------------------------
+def to_epoch(values: pd.Series) -> pd.Series:
+    """
+    Datetimes to integer seconds since 1970-01-01 (missing values as <NA>).
+
+    Args:
+        values (pd.Series): Datetimes.
+
+    Returns:
+        pd.Series: Integer epochs (Int64).
+    """
+    values = pd.Series(pd.to_datetime(values), index=values.index)
+    return ((values - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1)).astype("Int64")
+
+
+def from_epoch(values: pd.Series) -> pd.Series:
+    """
+    Integer seconds since 1970-01-01 to datetimes (valid up to year 9999, e.g. 'Válido a').
+
+    Args:
+        values (pd.Series): Epochs (missing values as NaN or None).
+
+    Returns:
+        pd.Series: Datetimes (second resolution).
+    """
+    seconds = pd.to_numeric(values).to_numpy(dtype="float64")
+    missing = np.isnan(seconds)
+    result = np.where(missing, 0, seconds).astype("int64").astype("datetime64[s]")
+    result[missing] = np.datetime64("NaT")
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+def _codes(conn: sqlite3.Connection, column: str, values: pd.Series) -> pd.Series:
+    """
+    Integer codes of the values of a coded column, adding the new values to its dimension table.
+    """
+    table, id_column = CODE_TABLES[column]
+    uniques = pd.unique(values.dropna())
+    conn.executemany(f"INSERT OR IGNORE INTO {table} ({_quote(column)}) VALUES (?)",
+                     [(str(v),) for v in uniques])
+    mapping = dict(conn.execute(f"SELECT {_quote(column)}, {id_column} FROM {table}").fetchall())
+    return values.map(mapping).astype("Int64")
+
+
+def _to_storage(conn: sqlite3.Connection, df: pd.DataFrame) -> list:
+    """
+    Convert a data frame to the list of columns of the history table (Python values, None for missing).
+    """
+    columns = []
+    for column, _, kind in HISTORY_SCHEMA:
+        if column not in df.columns:
+            values = pd.Series([None] * len(df), index=df.index, dtype=object)
+        elif kind == "code":
+            values = _codes(conn, column, df[column])
+        elif kind == "epoch":
+            values = to_epoch(df[column])
+        elif kind == "int":
+            values = pd.to_numeric(df[column]).astype("Int64")
+        elif kind == "real":
+            values = pd.to_numeric(df[column]).astype("float64")
+        else:
+            values = df[column]
+        values = values.astype(object).where(values.notna(), None)
+        columns.append(values.tolist())
+    return columns
+
+
+# -----------------------------
+# 3. Write
+# -----------------------------
+def write_history(conn: sqlite3.Connection, df: pd.DataFrame, replace: bool = False,
+                  batch_size: int = BATCH_SIZE) -> int:
+    """
+    Store cleaned rows in the history table, in batches inside one transaction.
+
+    With replace=True the table is emptied first, and the indexes are built again after the load
+    (faster than updating them row by row).
+
+    Args:
+        conn (sqlite3.Connection): Connection from connect().
+        df (pd.DataFrame): Cleaned rows (columns of HISTORY_SCHEMA, extra columns are ignored).
+        replace (bool): Replace the whole history (full mode) instead of appending.
+        batch_size (int): Rows per executemany call.
+
+    Returns:
+        int: Number of rows stored.
+    """
+    with conn:
+        if replace:
+            conn.execute(f"DROP VIEW IF EXISTS {HISTORY_VIEW}")
+            conn.execute(f"DROP TABLE IF EXISTS {HISTORY_TABLE}")
+            _create_history_table(conn)
+        rows = _insert_rows(conn, HISTORY_TABLE, df, batch_size)
+        if replace:
+            _create_indexes(conn)
+            _create_view(conn)
+    return rows
+
+
+def _insert_rows(conn: sqlite3.Connection, table: str, df: pd.DataFrame, batch_size: int = BATCH_SIZE,
+                 verb: str = "INSERT") -> int:
+    """
+    Insert the rows of a data frame in the history table (or a table with the same columns).
+    """
+    storage_columns = ", ".join(_quote(_storage_column(c)) for c, _, _ in HISTORY_SCHEMA)
+    placeholders = ", ".join("?" for _ in HISTORY_SCHEMA)
+    insert = f"{verb} INTO {table} ({storage_columns}) VALUES ({placeholders})"
+    rows = list(zip(*_to_storage(conn, df))) if len(df) else []
+    for start in range(0, len(rows), batch_size):
+        conn.executemany(insert, rows[start:start + batch_size])
+    return len(rows)
+
+
+def write_first_requests(conn: sqlite3.Connection, df: pd.DataFrame, replace: bool = False) -> int:
+    """
+    Store the first request of some PLPs (rows without time_between_MatReqs), replacing the stored one.
+
+    Args:
+        conn (sqlite3.Connection): Connection from connect().
+        df (pd.DataFrame): One cleaned row per PLP (columns of HISTORY_SCHEMA).
+        replace (bool): Delete the first requests of all the PLPs first (full mode).
+
+    Returns:
+        int: Number of rows stored.
+    """
+    with conn:
+        if replace:
+            conn.execute(f"DELETE FROM {FIRST_REQUEST_TABLE}")
+        # The unique index on plp_id replaces the row stored for the PLP
+        return _insert_rows(conn, FIRST_REQUEST_TABLE, df, verb="INSERT OR REPLACE")
+
+
+def move_requests(conn: sqlite3.Connection, row_ids: list, hours: list, source: str, target: str):
+    """
+    Move stored rows between the history and the first request table, with a new time_between_MatReqs.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        row_ids (list): rowid of the rows in the source table.
+        hours (list): New values of time_between_MatReqs (None for missing).
+        source (str): Table of the rows (HISTORY_TABLE or FIRST_REQUEST_TABLE).
+        target (str): Table where the rows are moved.
+    """
+    columns = [_quote(_storage_column(c)) for c, _, _ in HISTORY_SCHEMA if c != "time_between_MatReqs"]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {target} ({', '.join(columns)}, time_between_MatReqs) "
+        f"SELECT {', '.join(columns)}, ? FROM {source} WHERE rowid = ?",
+        [(None if pd.isna(h) else float(h), int(r)) for h, r in zip(hours, row_ids)],
+    )
+    conn.executemany(f"DELETE FROM {source} WHERE rowid = ?", [(int(r),) for r in row_ids])
+
+
+def delete_rows_of_files(conn: sqlite3.Connection, file_names: list):
+    """
+    Delete the rows previously loaded from the given files (also first requests), so they can be loaded again.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        file_names (list): Names of the source files.
+    """
+    if not file_names:
+        return
+    placeholders = ", ".join("?" for _ in file_names)
+    for table in (HISTORY_TABLE, FIRST_REQUEST_TABLE):
+        conn.execute(f"DELETE FROM {table} WHERE source_file IN ({placeholders})", list(file_names))
+
+
+def update_time_between_requests(conn: sqlite3.Connection, row_ids: list, hours: list):
+    """
+    Update time_between_MatReqs of stored rows (recalculation of late-arriving data).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        row_ids (list): rowid of the rows.
+        hours (list): New values (None for missing).
+    """
+    conn.executemany(
+        f"UPDATE {HISTORY_TABLE} SET time_between_MatReqs = ? WHERE rowid = ?",
+        [(None if pd.isna(h) else float(h), int(r)) for h, r in zip(hours, row_ids)],
+    )
+
+
+def history_row_count(conn: sqlite3.Connection, table: str = HISTORY_TABLE) -> int:
+    """
+    Number of rows in the history table.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        table (str): HISTORY_TABLE or FIRST_REQUEST_TABLE.
+
+    Returns:
+        int: Number of rows.
+    """
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+# -----------------------------
+# 4. Read
+# -----------------------------
+def read_request_times(conn: sqlite3.Connection, plps: list, table: str = HISTORY_TABLE) -> pd.DataFrame:
+    """
+    rowid, PLP and datetime_creac of the stored requests of some PLPs (uses the PLP index).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        plps (list): PLP ids.
+        table (str): HISTORY_TABLE or FIRST_REQUEST_TABLE.
+
+    Returns:
+        pd.DataFrame: Columns row_id, PLP and datetime_creac.
+    """
+    placeholders = ", ".join("?" for _ in plps)
+    df = pd.read_sql(
+        f"SELECT h.rowid AS row_id, p.PLP AS PLP, h.datetime_creac AS datetime_creac "
+        f"FROM {table} h JOIN {PLP_TABLE} p ON p.plp_id = h.plp_id "
+        f"WHERE p.PLP IN ({placeholders})",
+        conn, params=list(plps)
+    )
+    df["datetime_creac"] = from_epoch(df["datetime_creac"])
+    return df
+
+
+def read_file_request_times(conn: sqlite3.Connection, file_names: list) -> pd.DataFrame:
+    """
+    PLP and datetime_creac of the stored requests (history and first requests) loaded from some files.
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        file_names (list): Names of the source files.
+
+    Returns:
+        pd.DataFrame: Columns PLP and datetime_creac.
+    """
+    placeholders = ", ".join("?" for _ in file_names)
+    df = pd.concat([
+        pd.read_sql(
+            f"SELECT p.PLP AS PLP, h.datetime_creac AS datetime_creac "
+            f"FROM {table} h JOIN {PLP_TABLE} p ON p.plp_id = h.plp_id "
+            f"WHERE h.source_file IN ({placeholders})",
+            conn, params=list(file_names)
+        ) for table in (HISTORY_TABLE, FIRST_REQUEST_TABLE)
+    ], ignore_index=True)
+    df["datetime_creac"] = from_epoch(df["datetime_creac"])
+    return df
+
+
+def build_history_query(columns: list = None, plps: list = None, materials: list = None,
+                        date_from=None, date_to=None, order_by: list = None, row_id: bool = False) -> tuple:
+    """
+    Build a parameterized SELECT of the history with only the columns and rows needed.
+
+    The filters are done by SQLite with the indexes: PLP and date range with the index
+    (PLP, datetime_creac), Material with its own index.
+
+    Args:
+        columns (list): Columns to read (default all the columns of HISTORY_SCHEMA).
+        plps (list): Keep only these PLPs (optional).
+        materials (list): Keep only these Materials (optional).
+        date_from: Keep requests with datetime_creac >= date_from (optional).
+        date_to: Keep requests with datetime_creac < date_to (optional).
+        order_by (list): Sort the rows by these columns (optional). PLP and Material are sorted
+            by their code, so the rows of each one are together but not in alphabetical order.
+        row_id (bool): Also read the rowid of each row, as the column row_id.
+
+    Returns:
+        tuple: (sql, params, columns).
+    """
+    kinds = {c: kind for c, _, kind in HISTORY_SCHEMA}
+    columns = list(columns or kinds)
+    unknown = [c for c in columns if c not in kinds]
+    if unknown:
+        raise ValueError(f"Unknown columns of the history: {unknown}")
+
+    select = ", ".join(
+        f"{CODE_TABLES[c][0]}.{_quote(c)} AS {_quote(c)}" if kinds[c] == "code" else f"h.{_quote(c)}"
+        for c in columns
+    )
+    if row_id:
+        select = f"h.rowid AS row_id, {select}"
+    where, params = [], []
+    for column, values in (("PLP", plps), ("Material", materials)):
+        if values is not None:
+            values = list(values)
+            where.append(f"{CODE_TABLES[column][0]}.{_quote(column)} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+    if date_from is not None:
+        where.append("h.datetime_creac >= ?")
+        params.append(int(to_epoch(pd.Series([pd.Timestamp(date_from)])).iloc[0]))
+    if date_to is not None:
+        where.append("h.datetime_creac < ?")
+        params.append(int(to_epoch(pd.Series([pd.Timestamp(date_to)])).iloc[0]))
+
+    # Join a dimension table only when its column is read or filtered
+    needed = {"PLP": "PLP" in columns or plps is not None,
+              "Material": "Material" in columns or materials is not None}
+    joins = " ".join(
+        f"JOIN {table} ON {table}.{id_column} = h.{id_column}"
+        for c, (table, id_column) in CODE_TABLES.items() if needed[c]
+    )
+    sql = f"SELECT {select} FROM {HISTORY_TABLE} h {joins}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    if order_by:
+        sql += " ORDER BY " + ", ".join(f"h.{_quote(_storage_column(c))}" for c in order_by)
+    return sql, params, columns
+
+
+def _typed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the epoch columns of a result to datetimes.
+    """
+    kinds = {c: kind for c, _, kind in HISTORY_SCHEMA}
+    for column in df.columns:
+        if kinds.get(column) == "epoch":
+            df[column] = from_epoch(df[column])
+    return df
+
+
+def read_history(conn: sqlite3.Connection, columns: list = None, plps: list = None, materials: list = None,
+                 date_from=None, date_to=None, row_id: bool = False) -> pd.DataFrame:
+    """
+    Read the history with typed columns (datetimes as datetime64, PLP and Material as text).
+
+    Only the columns and rows asked are read from the database (see build_history_query).
+
+    Args:
+        conn (sqlite3.Connection): Open connection to the database.
+        columns (list): Columns to read (default all the columns of HISTORY_SCHEMA).
+        plps (list): Keep only these PLPs (optional).
+        materials (list): Keep only these Materials (optional).
+        date_from: Keep requests with datetime_creac >= date_from (optional).
+        date_to: Keep requests with datetime_creac < date_to (optional).
+        row_id (bool): Also read the rowid of each row (column row_id).
+
+    Returns:
+        pd.DataFrame: History.
+    """
+    sql, params, columns = build_history_query(columns, plps, materials, date_from, date_to, row_id=row_id)
+    return _typed(pd.read_sql(sql, conn, params=params))
+
+
+def load_history(db_name: str, columns: list = None, plps: list = None, materials: list = None,
+                 date_from=None, date_to=None, row_id: bool = False) -> pd.DataFrame:
+    """
+    Open the database, read the history with read_history and close it.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        columns (list): Columns to read (default all).
+        plps (list): Keep only these PLPs (optional).
+        materials (list): Keep only these Materials (optional).
+        date_from: Keep requests with datetime_creac >= date_from (optional).
+        date_to: Keep requests with datetime_creac < date_to (optional).
+        row_id (bool): Also read the rowid of each row (column row_id).
+
+    Returns:
+        pd.DataFrame: History.
+    """
+    conn = connect(db_name)
+    try:
+        return read_history(conn, columns, plps, materials, date_from, date_to, row_id)
+    finally:
+        conn.close()
+
+
+def iter_history_chunks(db_name: str, chunk_rows: int = 100000, columns: list = None, plps: list = None,
+                        materials: list = None, date_from=None, date_to=None, order_by: list = None,
+                        row_id: bool = False):
+    """
+    Read the history in chunks of rows, for analyses that don't need the whole table in memory.
+
+    The query is the same as in load_history, and each chunk has the same types.
+
+    Args:
+        db_name (str): Name of the SQLite database file.
+        chunk_rows (int): Rows per chunk.
+        columns (list): Columns to read (default all).
+        plps (list): Keep only these PLPs (optional).
+        materials (list): Keep only these Materials (optional).
+        date_from: Keep requests with datetime_creac >= date_from (optional).
+        date_to: Keep requests with datetime_creac < date_to (optional).
+        order_by (list): Sort the rows by these columns (optional, see build_history_query).
+        row_id (bool): Also read the rowid of each row (column row_id).
+
+    Yields:
+        pd.DataFrame: Chunks of the history.
+    """
+    sql, params, columns = build_history_query(columns, plps, materials, date_from, date_to, order_by, row_id)
+    conn = connect(db_name)
+    try:
+        for chunk in pd.read_sql(sql, conn, params=params, chunksize=chunk_rows):
+            yield _typed(chunk)
+    finally:
+        conn.close()
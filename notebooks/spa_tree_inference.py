@@ -0,0 +1,264 @@
+"""
+Compact inference of the tree models of script 3 (RandomForest and GradientBoosting).
+
+The nodes of all the trees of a fitted model are copied to a few flat NumPy arrays (feature,
+threshold, left and right child, value), without the statistics of the training kept by
+scikit-learn (impurity, number of samples). The prediction follows all the trees at the same
+time with vectorized NumPy steps (one step per level of the deepest tree, by blocks of rows),
+which avoids the overhead of one call per tree of scikit-learn for small batches.
+
+The predictions are bit-identical to the ones of scikit-learn: the features are converted to
+float32 as scikit-learn does, the thresholds are kept in float64 and the trees are added in the
+same order. Run `python spa_tree_inference.py` to compare the latency and the memory of both
+with the models of the registry.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.dummy import DummyRegressor
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+
+BLOCK_ROWS = 256
+
+
+# -----------------------------
+# 1. Compact Trees
+# -----------------------------
+class CompactForest:
+    """
+    Nodes of the trees of a RandomForest or GradientBoosting regressor in flat arrays.
+
+    The children of a node are indexes in the flat arrays. A leaf has a missing threshold and
+    is its own right child, so a path that reached a leaf stays there until the last step.
+
+    Attributes:
+        roots (np.ndarray): Index of the root node of each tree.
+        feature (np.ndarray): Feature compared in each node (0 for the leaves).
+        threshold (np.ndarray): Threshold of each node (float64 as in scikit-learn, NaN for the leaves).
+        left (np.ndarray): Left child of each node.
+        right (np.ndarray): Right child of each node (the node itself for the leaves).
+        missing_left (np.ndarray): True if a missing value goes to the left child.
+        value (np.ndarray): Prediction of each node.
+        depth (int): Depth of the deepest tree (number of steps of the traversal).
+        kind (str): 'forest' (mean of the trees) or 'boosting' (base + learning rate * sum).
+        base (float): Initial prediction (boosting only).
+        scale (float): Learning rate (boosting only).
+    """
+
+    def __init__(self, model):
+        """
+        Copy the trees of a fitted model.
+
+        Args:
+            model (RandomForestRegressor or GradientBoostingRegressor): Fitted model (one output).
+        """
+        if isinstance(model, RandomForestRegressor):
+            trees = [estimator.tree_ for estimator in model.estimators_]
+            self.kind, self.base, self.scale = "forest", 0.0, 1.0
+        elif isinstance(model, GradientBoostingRegressor):
+            trees = [estimator.tree_ for estimator in model.estimators_[:, 0]]
+            self.kind, self.scale = "boosting", float(model.learning_rate)
+            if isinstance(model.init_, str) and model.init_ == "zero":
+                self.base = 0.0
+            elif isinstance(model.init_, DummyRegressor):
+                self.base = float(np.ravel(model.init_.constant_)[0])
+            else:
+                raise ValueError(f"Init estimator not supported: {model.init_!r}")
+        else:
+            raise ValueError(f"Model not supported: {type(model).__name__}")
+        if trees[0].n_outputs != 1:
+            raise ValueError("Only models with one output are supported")
+
+        sizes = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        nodes = np.concatenate([tree.__getstate__()["nodes"] for tree in trees])
+        shift = np.repeat(offsets, sizes)
+        leaf = nodes["left_child"] == -1
+
+        # Node indexes as np.intp, so NumPy does not convert them in each step
+        self.roots = offsets.astype(np.intp)
+        self.feature = np.where(leaf, 0, nodes["feature"]).astype(np.int32)
+        self.threshold = np.where(leaf, np.nan, nodes["threshold"])
+        self.left = np.where(leaf, -1, nodes["left_child"] + shift).astype(np.intp)
+        self.right = np.where(leaf, np.arange(len(nodes)), nodes["right_child"] + shift).astype(np.intp)
+        self.missing_left = nodes["missing_go_to_left"].astype(bool) & ~leaf
+        self.value = np.concatenate([tree.value[:, 0, 0] for tree in trees]).astype(np.float64)
+        self.depth = max(tree.max_depth for tree in trees)
+
+    @property
+    def n_trees(self) -> int:
+        """
+        Number of trees.
+        """
+        return len(self.roots)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of the arrays in bytes.
+        """
+        arrays = [self.roots, self.feature, self.threshold, self.left, self.right, self.missing_left, self.value]
+        return sum(a.nbytes for a in arrays)
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """
+        Leaf reached by each row in each tree.
+
+        Args:
+            X (np.ndarray): Features (n_rows, n_features) as float32.
+
+        Returns:
+            np.ndarray: Leaf indexes (n_trees, n_rows).
+        """
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        node = np.repeat(self.roots, n_rows)
+        position = np.tile(np.arange(n_rows) * n_features, self.n_trees)
+        missing = bool(np.isnan(values).any())
+        # A leaf has a NaN threshold, so its rows go to the right, to the leaf itself
+        for _ in range(self.depth):
+            x = values[position + self.feature[node]]
+            go_left = x <= self.threshold[node]
+            if missing:
+                go_left |= np.isnan(x) & self.missing_left[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node.reshape(self.n_trees, n_rows)
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predict with the compact trees (same result as the predict of the scikit-learn model).
+
+        Args:
+            X (array-like): Features (n_rows, n_features).
+
+        Returns:
+            np.ndarray: Predictions (float64).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) > BLOCK_ROWS:
+            # Blocks of rows keep the arrays of the traversal in the CPU cache
+            return np.concatenate([self.predict(X[i:i + BLOCK_ROWS]) for i in range(0, len(X), BLOCK_ROWS)])
+        values = self.value[self.leaves(X)]
+        # The trees are added one after the other, in the order of scikit-learn
+        if self.kind == "forest":
+            return np.cumsum(values, axis=0)[-1] / self.n_trees
+        out = np.full(len(X), self.base)
+        for tree_values in values:
+            out += self.scale * tree_values
+        return out
+
+
+class CompactPipeline:
+    """
+    Pipeline of script 3 with the model replaced by a CompactForest (the other steps are kept).
+
+    The StandardScaler steps are applied with NumPy (same operations as their transform),
+    without the checks of the input of scikit-learn, which take most of the time of one row.
+
+    Attributes:
+        preprocess (list): Steps before the model (e.g. the scaler).
+        forest (CompactForest): Compact model.
+    """
+
+    def __init__(self, pipeline):
+        """
+        Compact version of a fitted pipeline (or of a fitted model).
+
+        Args:
+            pipeline (Pipeline or estimator): Fitted pipeline whose last step is a RandomForest or
+                GradientBoosting regressor.
+        """
+        steps = pipeline.steps if isinstance(pipeline, Pipeline) else [("model", pipeline)]
+        self.preprocess = [step for _, step in steps[:-1] if step is not None and step != "passthrough"]
+        self.forest = CompactForest(steps[-1][1])
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predict with the compact model.
+
+        Args:
+            X (pd.DataFrame or array-like): Features, in the order used for training.
+
+        Returns:
+            np.ndarray: Predictions.
+        """
+        for step in self.preprocess:
+            if isinstance(step, StandardScaler):
+                X = np.array(X, dtype=np.float64)
+                if step.with_mean:
+                    X -= step.mean_
+                if step.with_std:
+                    X /= step.scale_
+            else:
+                X = step.transform(X)
+        return self.forest.predict(X)
+
+
+# -----------------------------
+# 2. Benchmark
+# -----------------------------
+def sklearn_nbytes(model) -> int:
+    """
+    Memory of the node and value arrays of the trees of a scikit-learn model, in bytes.
+    """
+    estimators = np.ravel(model.estimators_)
+    return sum(e.tree_.__getstate__()["nodes"].nbytes + e.tree_.value.nbytes for e in estimators)
+
+
+def _median_ms(function, repeats: int) -> float:
+    """
+    Median time of a function in milliseconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def benchmark(pipeline, X: pd.DataFrame, repeats: int = 20) -> pd.DataFrame:
+    """
+    Compare scikit-learn and the compact inference: latency of one row and of a batch, and memory.
+
+    Args:
+        pipeline (Pipeline): Fitted pipeline of script 3.
+        X (pd.DataFrame): Features; the batch is all the rows and the single row is the first one.
+        repeats (int): Number of repetitions of each measure.
+
+    Returns:
+        pd.DataFrame: One row per method with single_row_ms, batch_ms, memory_mb and identical
+            (True if the predictions are bit-identical to scikit-learn).
+    """
+    compact = CompactPipeline(pipeline)
+    row = X.iloc[:1]
+    expected = pipeline.predict(X)
+    model = pipeline.steps[-1][1] if isinstance(pipeline, Pipeline) else pipeline
+    results = []
+    for method, predictor, nbytes in [("sklearn", pipeline, sklearn_nbytes(model)),
+                                      ("compact", compact, compact.forest.nbytes)]:
+        results.append({
+            "method": method,
+            "single_row_ms": _median_ms(lambda: predictor.predict(row), repeats),
+            "batch_ms": _median_ms(lambda: predictor.predict(X), max(1, repeats // 4)),
+            "batch_rows": len(X),
+            "memory_mb": nbytes / 1e6,
+            "identical": bool(np.array_equal(predictor.predict(X), expected)),
+        })
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    import spa_models
+    import spa_storage
+
+    for name in ["rf_grid", "gb"]:
+        predictor = spa_models.load_model(name)
+        X = spa_storage.load_history("SPA_Data_Analytics.db", columns=predictor.features)
+        print(f"Model {name} version {predictor.metadata['version']}")
+        print(benchmark(predictor.pipeline, X))
@@ -0,0 +1,341 @@
+"""
+Faster search of the hyperparameters of the RandomForest of script 3.
+
+The grid search of script 3 fits every combination of parameters on every fold from scratch,
+and fits the StandardScaler again each time. Two faster modes are available:
+- "warm_start": the same search as GridSearchCV (same folds, same scores, same best
+  parameters), but the forests of one fold are grown from the smallest n_estimators to the
+  largest one with warm_start (a forest of 100 trees grown to 200 is the same as a forest of 200
+  trees), and the fits of the scaler are cached with Pipeline(memory=...).
+- "halving": successive halving (HalvingGridSearchCV). All the combinations are tried with a
+  few trees (or on a small sample of the rows) and only the best ones with more trees. The best
+  combination is fitted at the end with the largest n_estimators of the grid. Much faster, but
+  the best parameters can differ from the full grid search.
+
+Run `python spa_tuning.py` to compare the time, best parameters and R² of the three modes.
+"""
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from joblib import Memory, Parallel, delayed
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (needed by HalvingGridSearchCV)
+from sklearn.metrics import get_scorer, r2_score
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, ParameterGrid, check_cv
+
+
+CACHE_DIR = "cache/tuning"
+TUNING_MODES = ["grid", "warm_start", "halving"]
+
+
+@contextmanager
+def _scaler_cache(cache_dir: str):
+    """
+    Cache of the scaler fits of one search, in a temporary folder of cache_dir removed at the end
+    of the search (the fits are only reused inside the search). Gives None when cache_dir is None.
+    """
+    if not cache_dir:
+        yield None
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_dir) as folder:
+        yield Memory(folder, verbose=0)
+
+
+# -----------------------------
+# 1. Warm-Start Grid Search
+# -----------------------------
+def _split_estimators_param(params: dict) -> tuple:
+    """
+    Split a grid into the n_estimators values and the other parameters.
+
+    Returns:
+        tuple: (name of the n_estimators parameter, sorted values, grid of the other parameters).
+    """
+    names = [name for name in params if name.split("__")[-1] == "n_estimators"]
+    if len(names) != 1:
+        raise ValueError("The grid must have one n_estimators parameter for the warm_start mode")
+    name = names[0]
+    others = {k: v for k, v in params.items() if k != name}
+    return name, sorted(params[name]), others
+
+
+def _fit_fold(pipeline, params: dict, estimators_param: str, n_values: list, X, y, train, test, scorer) -> list:
+    """
+    Fit one combination of parameters on one fold, growing the forest for each n_estimators value.
+
+    Returns:
+        list: Score on the test part of the fold for each n_estimators value.
+    """
+    warm_start_param = estimators_param.replace("n_estimators", "warm_start")
+    estimator = clone(pipeline).set_params(**params, **{warm_start_param: True})
+    X_train, y_train = X.iloc[train], y.iloc[train]
+    X_test, y_test = X.iloc[test], y.iloc[test]
+    scores = []
+    for n in n_values:
+        # The trees already fitted are kept, only the new ones are fitted
+        estimator.set_params(**{estimators_param: n})
+        estimator.fit(X_train, y_train)
+        scores.append(scorer(estimator, X_test, y_test))
+    return scores
+
+
+class WarmStartGridSearch:
+    """
+    Grid search of a tree ensemble pipeline with warm_start on n_estimators.
+
+    Gives the same cv_results_ scores, best_params_ and best_estimator_ as GridSearchCV with the
+    same cv and scoring, with fewer trees fitted.
+
+    Attributes:
+        best_params_ (dict): Best parameters.
+        best_score_ (float): Mean score of the best parameters.
+        best_estimator_ (Pipeline): Pipeline fitted on all the data with the best parameters.
+        cv_results_ (pd.DataFrame): Parameters, scores of each fold, mean score and rank.
+    """
+
+    def __init__(self, pipeline, params: dict, cv=3, scoring: str = "r2", n_jobs: int = None,
+                 cache_dir: str = CACHE_DIR):
+        """
+        Search not fitted yet (see fit).
+
+        Args:
+            pipeline (Pipeline): Pipeline of script 3 (scaler and tree ensemble).
+            params (dict): Grid of parameters, with one n_estimators parameter.
+            cv (int or splitter): Folds, as in GridSearchCV.
+            scoring (str): Scoring, as in GridSearchCV.
+            n_jobs (int): Parallel jobs (one job per combination and fold).
+            cache_dir (str): Folder of the cache of the scaler fits (emptied after each search), None to
+                not cache them.
+        """
+        self.pipeline = pipeline
+        self.params = params
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
+
+    def fit(self, X: pd.DataFrame, y: pd.Series):
+        """
+        Run the search and fit the best pipeline on all the data.
+
+        Args:
+            X (pd.DataFrame): Features.
+            y (pd.Series): Target.
+
+        Returns:
+            WarmStartGridSearch: self.
+        """
+        estimators_param, n_values, others = _split_estimators_param(self.params)
+        folds = list(check_cv(self.cv, y, classifier=False).split(X, y))
+        scorer = get_scorer(self.scoring)
+        combinations = list(ParameterGrid(others))
+
+        with _scaler_cache(self.cache_dir) as memory:
+            pipeline = clone(self.pipeline).set_params(memory=memory)
+            scores = Parallel(n_jobs=self.n_jobs)(
+                delayed(_fit_fold)(pipeline, params, estimators_param, n_values, X, y, train, test, scorer)
+                for params, (train, test) in product(combinations, folds))
+
+        # Scores in the order of the candidates of GridSearchCV (ParameterGrid of the whole grid)
+        by_candidate = {}
+        for (params, _), fold_scores in zip(product(combinations, range(len(folds))), scores):
+            for n, score in zip(n_values, fold_scores):
+                by_candidate.setdefault(tuple(sorted({**params, estimators_param: n}.items())), []).append(score)
+        rows = []
+        for candidate in ParameterGrid(self.params):
+            fold_scores = by_candidate[tuple(sorted(candidate.items()))]
+            row = {"params": candidate}
+            row.update({f"split{i}_test_score": s for i, s in enumerate(fold_scores)})
+            row["mean_test_score"] = np.mean(fold_scores)
+            rows.append(row)
+        results = pd.DataFrame(rows)
+        results["rank_test_score"] = results["mean_test_score"].rank(ascending=False, method="min").astype(int)
+
+        best = int(results["mean_test_score"].to_numpy().argmax())
+        self.cv_results_ = results
+        self.best_params_ = results["params"][best]
+        self.best_score_ = results["mean_test_score"][best]
+        self.best_estimator_ = clone(self.pipeline).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predict with the best pipeline.
+        """
+        return self.best_estimator_.predict(X)
+
+
+# -----------------------------
+# 2. Successive Halving
+# -----------------------------
+class HalvingForestSearch:
+    """
+    Successive halving of a tree ensemble pipeline, with the number of trees or of rows as resource.
+
+    Attributes:
+        best_params_ (dict): Best parameters (n_estimators is the largest value of the grid).
+        best_score_ (float): Mean score of the best parameters in the last round of the halving.
+        best_estimator_ (Pipeline): Pipeline fitted on all the data with the best parameters.
+        search_ (HalvingGridSearchCV): Halving search (cv_results_, n_resources_, ...).
+    """
+
+    def __init__(self, pipeline, params: dict, resource: str = "n_estimators", min_resources="exhaust",
+                 factor: int = 3, cv=3, scoring: str = "r2", n_jobs: int = None, cache_dir: str = CACHE_DIR,
+                 random_state: int = 42):
+        """
+        Search not fitted yet (see fit).
+
+        Args:
+            pipeline (Pipeline): Pipeline of script 3 (scaler and tree ensemble).
+            params (dict): Grid of parameters, with one n_estimators parameter.
+            resource (str): 'n_estimators' (the first rounds use fewer trees) or 'n_samples' (the
+                first rounds use fewer rows).
+            min_resources (int or str): Trees or rows of the first round, 'exhaust' to use all of
+                them in the last round (see HalvingGridSearchCV).
+            factor (int): Only 1 / factor of the combinations go to the next round, with factor
+                times more resources.
+            cv (int or splitter): Folds, as in GridSearchCV.
+            scoring (str): Scoring, as in GridSearchCV.
+            n_jobs (int): Parallel jobs.
+            cache_dir (str): Folder of the cache of the scaler fits (emptied after each search), None to
+                not cache them.
+            random_state (int): Seed of the sampling of the rows ('n_samples').
+        """
+        self.pipeline = pipeline
+        self.params = params
+        self.resource = resource
+        self.min_resources = min_resources
+        self.factor = factor
+        self.cv = cv
+        self.scoring = scoring
+        self.n_jobs = n_jobs
+        self.cache_dir = cache_dir
+        self.random_state = random_state
+
+    def fit(self, X: pd.DataFrame, y: pd.Series):
+        """
+        Run the halving and fit the best pipeline on all the data.
+
+        Args:
+            X (pd.DataFrame): Features.
+            y (pd.Series): Target.
+
+        Returns:
+            HalvingForestSearch: self.
+        """
+        estimators_param, n_values, others = _split_estimators_param(self.params)
+        if self.resource == "n_estimators":
+            grid, resource, max_resources = others, estimators_param, max(n_values)
+        elif self.resource == "n_samples":
+            grid, resource, max_resources = self.params, "n_samples", "auto"
+        else:
+            raise ValueError(f"Unknown resource: {self.resource} (expected 'n_estimators' or 'n_samples')")
+
+        with _scaler_cache(self.cache_dir) as memory:
+            pipeline = clone(self.pipeline).set_params(memory=memory)
+            self.search_ = HalvingGridSearchCV(pipeline, grid, factor=self.factor, resource=resource,
+                                               max_resources=max_resources, min_resources=self.min_resources,
+                                               cv=self.cv, scoring=self.scoring, n_jobs=self.n_jobs, refit=False,
+                                               random_state=self.random_state).fit(X, y)
+        # The trees of the last round can be fewer than the largest value of the grid
+        self.best_params_ = dict(sorted({**self.search_.best_params_, estimators_param: max(n_values)}.items()))
+        self.best_score_ = self.search_.best_score_
+        self.best_estimator_ = clone(self.pipeline).set_params(**self.best_params_).fit(X, y)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predict with the best pipeline.
+        """
+        return self.best_estimator_.predict(X)
+
+
+# -----------------------------
+# 3. Search Modes
+# -----------------------------
+def make_search(pipeline, params: dict, mode: str = "warm_start", cv=3, scoring: str = "r2", n_jobs: int = -1,
+                cache_dir: str = CACHE_DIR, random_state: int = 42):
+    """
+    Search of hyperparameters of script 3 (not fitted).
+
+    Args:
+        pipeline (Pipeline): Pipeline to tune.
+        params (dict): Grid of parameters.
+        mode (str): 'grid' (GridSearchCV), 'warm_start' (same result, faster) or 'halving'
+            (successive halving on the number of trees, fastest).
+        cv (int or splitter): Folds.
+        scoring (str): Scoring.
+        n_jobs (int): Parallel jobs.
+        cache_dir (str): Folder of the cache of the scaler fits ('warm_start' and 'halving', emptied
+            after each search), None to not cache them.
+        random_state (int): Seed of the sampling of the rows ('halving' on the rows).
+
+    Returns:
+        Search with fit, predict, best_params_ and best_estimator_.
+    """
+    if mode == "grid":
+        return GridSearchCV(pipeline, params, cv=cv, scoring=scoring, n_jobs=n_jobs)
+    if mode == "warm_start":
+        return WarmStartGridSearch(pipeline, params, cv=cv, scoring=scoring, n_jobs=n_jobs, cache_dir=cache_dir)
+    if mode == "halving":
+        return HalvingForestSearch(pipeline, params, cv=cv, scoring=scoring, n_jobs=n_jobs, cache_dir=cache_dir,
+                                   random_state=random_state)
+    raise ValueError(f"Unknown tuning mode: {mode} (expected one of {TUNING_MODES})")
+
+
+# -----------------------------
+# 4. Benchmark
+# -----------------------------
+def benchmark(pipeline, params: dict, X_train, y_train, X_test, y_test, modes: list = None,
+              n_jobs: int = -1) -> pd.DataFrame:
+    """
+    Compare the search modes: time, best parameters and R² on the test data.
+
+    Args:
+        pipeline (Pipeline): Pipeline to tune.
+        params (dict): Grid of parameters.
+        X_train, y_train: Training data.
+        X_test, y_test: Test data.
+        modes (list): Modes to compare (default all).
+        n_jobs (int): Parallel jobs.
+
+    Returns:
+        pd.DataFrame: One row per mode with seconds, speedup, best_params, cv_score and test_r2.
+    """
+    results = []
+    for mode in modes or TUNING_MODES:
+        # Each search starts with an empty cache, so the time includes the fits of the scaler
+        search = make_search(pipeline, params, mode, n_jobs=n_jobs)
+        start = time.perf_counter()
+        search.fit(X_train, y_train)
+        seconds = time.perf_counter() - start
+        results.append({"mode": mode, "seconds": seconds, "best_params": search.best_params_,
+                        "cv_score": search.best_score_, "test_r2": r2_score(y_test, search.predict(X_test))})
+    results = pd.DataFrame(results)
+    results["speedup"] = results["seconds"].iloc[0] / results["seconds"]
+    return results
+
+
+if __name__ == "__main__":
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    import spa_storage
+
+    features = ["Consumo", "Cap. Sumin", "Supply_time_hours"]
+    target = "time_between_MatReqs"
+    df = spa_storage.load_history("SPA_Data_Analytics.db", columns=features + [target])
+    X_train, X_test, y_train, y_test = train_test_split(df[features], df[target], test_size=0.2, random_state=42)
+    rf_pipeline = Pipeline([("scaler", StandardScaler()), ("model", RandomForestRegressor(random_state=42))])
+    rf_params = {"model__n_estimators": [100, 200], "model__max_depth": [None, 10, 20],
+                 "model__min_samples_split": [2, 5]}
+    print(benchmark(rf_pipeline, rf_params, X_train, y_train, X_test, y_test).to_string())
@@ -0,0 +1,8 @@
+"""
+The helper modules live next to the scripts in notebooks/ and are imported with flat imports.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notebooks"))
@@ -0,0 +1,80 @@
+"""
+Histogram bins of spa_aggregates.
+"""
+
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import spa_aggregates
+import spa_storage
+
+
+VALUES = [0.0, 0.05, 0.1, 0.3, 0.7, 1.0, 1.15, 2.3, 24.6, -0.1, -0.3, -0.35]
+
+
+def test_boundary_values_fall_in_their_own_bin():
+    assert spa_aggregates.value_bins(VALUES).tolist() == [0, 0, 1, 3, 7, 10, 11, 23, 246, -1, -3, -4]
+
+
+def test_sql_bins_match_python_bins():
+    conn = sqlite3.connect(":memory:")
+    sql_bins = [conn.execute(f"SELECT {spa_aggregates._floor_bin('x')} FROM (SELECT ? AS x) h", (v,)).fetchone()[0]
+                for v in VALUES]
+    conn.close()
+    np.testing.assert_array_equal(sql_bins, spa_aggregates.value_bins(VALUES))
+
+
+def _history(days: int = 3, rows_per_day: int = 40) -> pd.DataFrame:
+    """
+    Requests of a few PLPs and Materials over some days.
+    """
+    rng = np.random.default_rng(7)
+    n = days * rows_per_day
+    creac = pd.Timestamp("2025-10-01") + pd.to_timedelta(np.sort(rng.uniform(0, days * 24, n)), unit="h")
+    return pd.DataFrame({
+        "PLP": rng.choice(["10AB_001P1", "08CD_011P1", "10AB_002P1"], n),
+        "Material": rng.choice(["W01", "W02", "W03", "W04"], n),
+        "datetime_creac": creac,
+        "Supply_time_hours": rng.gamma(2.0, 1.5, n),
+        "time_between_MatReqs": np.where(rng.random(n) < 0.1, np.nan, rng.exponential(3.0, n)),
+    })
+
+
+def _tables(conn) -> tuple:
+    daily = pd.read_sql(f"SELECT * FROM {spa_aggregates.DAILY_TABLE}", conn)
+    bins = pd.read_sql(f"SELECT * FROM {spa_aggregates.HISTOGRAM_TABLE}", conn)
+    keys = ["day", "plp_id", "material_id", "target"]
+    return daily.sort_values(keys, ignore_index=True), bins.sort_values(keys + ["bin"], ignore_index=True)
+
+
+def test_refresh_of_a_changed_day_matches_a_full_rebuild(tmp_path):
+    conn = spa_storage.connect(str(tmp_path / "history.db"))
+    spa_storage.write_history(conn, _history(), replace=True)
+    spa_aggregates.refresh_aggregates(conn)
+
+    # Change the rows of the second day: some are deleted and the others get new values
+    day = int(pd.Timestamp("2025-10-02").timestamp()) // spa_aggregates.SECONDS_PER_DAY
+    start, end = day * spa_aggregates.SECONDS_PER_DAY, (day + 1) * spa_aggregates.SECONDS_PER_DAY
+    with conn:
+        conn.execute(f"DELETE FROM {spa_storage.HISTORY_TABLE} WHERE datetime_creac >= ? AND datetime_creac < ? "
+                     f"AND rowid % 3 = 0", (start, end))
+        conn.execute(f"UPDATE {spa_storage.HISTORY_TABLE} SET Supply_time_hours = Supply_time_hours * 2.5 "
+                     f"WHERE datetime_creac >= ? AND datetime_creac < ?", (start, end))
+    spa_aggregates.refresh_aggregates(conn, [day])
+    daily, bins = _tables(conn)
+    histogram = spa_aggregates.read_histogram(conn, "Supply_time_hours")
+
+    spa_aggregates.refresh_aggregates(conn)
+    full_daily, full_bins = _tables(conn)
+    pd.testing.assert_frame_equal(daily, full_daily)
+    pd.testing.assert_frame_equal(bins, full_bins)
+    pd.testing.assert_frame_equal(histogram, spa_aggregates.read_histogram(conn, "Supply_time_hours"))
+
+    # The histogram counts all the stored values, each in the bin of value_bins
+    stored = spa_storage.read_history(conn, columns=["Supply_time_hours"])["Supply_time_hours"]
+    expected = pd.Series(spa_aggregates.value_bins(stored)).value_counts().sort_index()
+    np.testing.assert_allclose(histogram["bin_start"], expected.index * spa_aggregates.BIN_WIDTH)
+    np.testing.assert_array_equal(histogram["count"], expected.to_numpy())
+    conn.close()
@@ -0,0 +1,84 @@
+"""
+Features of spa_features: only the earlier requests of each PLP are used.
+"""
+
+import numpy as np
+import pandas as pd
+
+import spa_features
+import spa_storage
+
+
+TARGET = spa_features.TARGET
+GAP_COLUMNS = ["prev_gap_hours", "rolling_median_gap_hours"]
+
+
+def _history(n: int = 14, seed: int = 0) -> pd.DataFrame:
+    """
+    Requests of two PLPs; the gap of each request is the time since the previous one of its PLP
+    (the first request of each PLP is dropped, like in script 1).
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for plp in ["10AB_001P1", "08CD_011P1"]:
+        seconds = 1759300000 + np.cumsum(rng.integers(600, 60 * 3600, n))
+        frames.append(pd.DataFrame({
+            "PLP": plp, "Material": "W01", "datetime_creac": pd.to_datetime(seconds, unit="s"),
+            TARGET: np.diff(seconds, prepend=np.nan) / 3600,
+        }).iloc[1:])
+    return pd.concat(frames).sort_values("datetime_creac", ignore_index=True)
+
+
+def _requests(history: pd.DataFrame) -> pd.DataFrame:
+    """
+    Input of compute_features (epochs and PLP codes).
+    """
+    return pd.DataFrame({
+        "row_id": np.arange(len(history)), "plp_id": history["PLP"].map({"10AB_001P1": 1, "08CD_011P1": 2}),
+        "datetime_creac": spa_storage.to_epoch(history["datetime_creac"]).astype("int64"), TARGET: history[TARGET],
+    })
+
+
+def test_gap_features_use_only_earlier_requests():
+    requests = _requests(_history())
+    full = spa_features.compute_features(requests).set_index("row_id")[GAP_COLUMNS].astype("float64")
+    for row in requests.itertuples():
+        same_plp = requests[requests["plp_id"] == row.plp_id]
+        earlier = same_plp[same_plp["datetime_creac"] < row.datetime_creac]
+        # Without the later requests and with another gap of the request itself
+        alone = same_plp[same_plp["datetime_creac"] <= row.datetime_creac].copy()
+        alone.loc[alone["row_id"] == row.row_id, TARGET] = 999.0
+        features = spa_features.compute_features(alone).set_index("row_id")[GAP_COLUMNS].astype("float64")
+
+        expected = [earlier[TARGET].iloc[-1] if len(earlier) else np.nan,
+                    earlier[TARGET].tail(spa_features.ROLLING_WINDOW).median()]
+        np.testing.assert_allclose(full.loc[row.row_id], expected)
+        np.testing.assert_allclose(features.loc[row.row_id], expected)
+
+
+def test_next_features_are_the_features_of_the_next_request(tmp_path):
+    history = _history()
+    next_rows = history.groupby("PLP")["datetime_creac"].idxmax()
+
+    full_db = str(tmp_path / "full.db")
+    conn = spa_storage.connect(full_db)
+    spa_storage.write_history(conn, history, replace=True)
+    conn.close()
+    stored = spa_features.load_features(full_db, columns=["PLP", "datetime_creac"])
+    expected = stored[stored["datetime_creac"].isin(history.loc[next_rows, "datetime_creac"])]
+
+    # Without the last request of each PLP, next_features gives the features of that request
+    db = str(tmp_path / "history.db")
+    conn = spa_storage.connect(db)
+    spa_storage.write_history(conn, history.drop(index=next_rows), replace=True)
+    spa_features.refresh_features(conn)
+    conn.close()
+    result = spa_features.next_features(db)
+
+    expected = expected.sort_values("PLP", ignore_index=True)
+    result = result.sort_values("PLP", ignore_index=True)
+    assert result["PLP"].tolist() == expected["PLP"].tolist()
+    pd.testing.assert_frame_equal(result[spa_features.FEATURE_COLUMNS].astype("float64"),
+                                  expected[spa_features.FEATURE_COLUMNS].astype("float64"))
+    last = history.drop(index=next_rows).groupby("PLP")["datetime_creac"].max()
+    assert result["last_request"].tolist() == last.loc[result["PLP"]].tolist()
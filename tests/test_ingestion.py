@@ -0,0 +1,191 @@
+"""
+Full, incremental, late-arriving and changed-file loads give the same tables as a full rebuild.
+"""
+
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import spa_aggregates
+import spa_features
+import spa_ingest
+import spa_master_data
+import spa_prepare
+import spa_sketches
+import spa_storage
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLUMNS_TO_KEEP = [
+    "SFab", "GLin", "UbiLínea", "Material", "Denominación", "Status", "Tipo Sum", "Consumo",
+    "F.Creac", "H.Creac", "F.Conf OT", "H.Conf OT", "Ubic.proc.",
+    "Tp.alm.proc.", "UbicDest", "ÁrSumProd.", "Válido de", "Válido a", "Cap. Sumin", "source_file"
+]
+DAYS = ["20251024", "20251025", "20251026"]
+
+
+def _shifted(requests: pd.DataFrame, days: int) -> pd.DataFrame:
+    """
+    Copy of the requests of a file moved some days (dates as text "DD.MM.YY", like in the files).
+    """
+    shifted = requests.copy()
+    for column in ("F.Creac", "F.Conf OT"):
+        dates = pd.to_datetime(shifted[column], format="%d.%m.%y") + pd.Timedelta(days=days)
+        shifted[column] = dates.dt.strftime("%d.%m.%y")
+    return shifted
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    """
+    Three daily files made from the sample file (in scope rows only), the day 25 file changed, and the master index.
+    """
+    folder = tmp_path_factory.mktemp("data")
+    master_index = spa_master_data.MasterDataIndex.from_excel(
+        os.path.join(REPO_DIR, "master_data", "Parasum_iTLS.xlsx"), in_scope_only=True
+    )
+    requests = pd.read_excel(os.path.join(REPO_DIR, "data", "Peticiones demora_20251025.xlsx"))
+    in_scope = spa_prepare.clean_chunk(requests.assign(source_file=""), master_index, COLUMNS_TO_KEEP)
+    requests = requests.merge(in_scope[spa_master_data.MERGE_KEYS].drop_duplicates(), on=spa_master_data.MERGE_KEYS)
+    # One request per second at most, so the order of the requests of a PLP is unique
+    requests = requests.drop_duplicates(subset=["F.Creac", "H.Creac"])
+
+    files = {}
+    for offset, day in zip((-1, 0, 1), DAYS):
+        files[day] = str(folder / f"Peticiones demora_{day}.xlsx")
+        _shifted(requests, offset).to_excel(files[day], index=False)
+
+    # Day 25 file changed: some requests removed and others with a new consumption
+    changed = pd.read_excel(files["20251025"])
+    changed = changed.drop(changed.index[::7]).assign(Consumo=lambda df: df["Consumo"] * 2)
+    changed_path = folder / "changed" / os.path.basename(files["20251025"])
+    changed_path.parent.mkdir()
+    changed.to_excel(changed_path, index=False)
+
+    return {"files": files, "changed": str(changed_path), "master_index": master_index}
+
+
+def _load(db_path, files, master_index, replace=False, changed=False):
+    """
+    Load some files like the streaming mode of script 1 (the rows of changed files are replaced).
+    """
+    conn = spa_storage.connect(str(db_path))
+    changed_days = []
+    if changed:
+        names = [os.path.basename(f) for f in files]
+        changed_days = spa_aggregates.days_of_files(conn, names)
+        spa_ingest.remove_files(conn, names)
+    spa_prepare.stream_files_to_sqlite(files, master_index, conn, COLUMNS_TO_KEEP, replace=replace,
+                                       keep_sketches=True, keep_features=True)
+    if changed:
+        spa_sketches.rebuild_sketches(conn)
+        spa_aggregates.refresh_aggregates(conn, changed_days)
+        spa_features.refresh_features(conn, changed_days)
+    conn.commit()
+    conn.close()
+
+
+def _named(conn, table):
+    """
+    All the rows of a table, with the PLP and Material codes replaced by their values and sorted.
+    """
+    df = pd.read_sql(f"SELECT * FROM {table}", conn)
+    for column, (dim_table, id_column) in spa_storage.CODE_TABLES.items():
+        if id_column in df.columns:
+            codes = pd.read_sql(f"SELECT {id_column}, {spa_storage._quote(column)} FROM {dim_table}", conn)
+            df = df.merge(codes, on=id_column, how="left").drop(columns=id_column)
+    df = df[sorted(df.columns)]
+    return df.sort_values(by=list(df.columns), ignore_index=True)
+
+
+def _snapshot(db_path) -> dict:
+    """
+    Content of the tables kept by the ingestion, without the row ids that depend on the order of the loads.
+    """
+    conn = sqlite3.connect(str(db_path))
+    features = pd.read_sql(
+        f"SELECT p.PLP, f.datetime_creac, h.source_file, {', '.join('f.' + c for c in spa_features.FEATURE_COLUMNS)} "
+        f"FROM {spa_features.FEATURE_TABLE} f JOIN {spa_storage.HISTORY_TABLE} h ON h.rowid = f.row_id "
+        f"JOIN {spa_storage.PLP_TABLE} p ON p.plp_id = h.plp_id", conn
+    )
+    sketches = pd.read_sql(f"SELECT PLP, Material, target, n, mean, m2, min, max FROM {spa_sketches.SKETCH_TABLE}",
+                           conn)
+    snapshot = {
+        "history": _named(conn, spa_storage.HISTORY_TABLE),
+        "first_requests": _named(conn, spa_storage.FIRST_REQUEST_TABLE),
+        "watermarks": _named(conn, spa_ingest.WATERMARK_TABLE),
+        "daily": _named(conn, spa_aggregates.DAILY_TABLE),
+        "histogram": _named(conn, spa_aggregates.HISTOGRAM_TABLE),
+        "features": features.sort_values(by=["PLP", "datetime_creac"], ignore_index=True),
+        "sketches": sketches.sort_values(by=["PLP", "Material", "target"], ignore_index=True),
+    }
+    conn.close()
+    return snapshot
+
+
+def _assert_same(snapshot, expected):
+    for name, df in expected.items():
+        assert len(snapshot[name]) == len(df), name
+        pd.testing.assert_frame_equal(snapshot[name], df, check_exact=False, rtol=1e-9, obj=name)
+
+
+@pytest.fixture(scope="module")
+def full_rebuild(data, tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("full") / "full.db"
+    _load(db_path, list(data["files"].values()), data["master_index"], replace=True)
+    return _snapshot(db_path)
+
+
+def test_full_rebuild_keeps_one_first_request_per_plp(full_rebuild):
+    first = full_rebuild["first_requests"]
+    assert first["PLP"].is_unique
+    assert first["time_between_MatReqs"].isna().all()
+    assert set(full_rebuild["history"]["PLP"]) <= set(first["PLP"])
+    assert len(first) == len(full_rebuild["watermarks"])
+
+
+def test_incremental_days_match_full_rebuild(data, full_rebuild, tmp_path):
+    db_path = tmp_path / "incremental.db"
+    _load(db_path, [data["files"]["20251024"]], data["master_index"], replace=True)
+    for day in DAYS[1:]:
+        _load(db_path, [data["files"][day]], data["master_index"])
+    _assert_same(_snapshot(db_path), full_rebuild)
+
+
+def test_late_day_matches_full_rebuild(data, full_rebuild, tmp_path):
+    db_path = tmp_path / "late.db"
+    _load(db_path, [data["files"]["20251025"]], data["master_index"], replace=True)
+    _load(db_path, [data["files"]["20251026"]], data["master_index"])
+    _load(db_path, [data["files"]["20251024"]], data["master_index"])
+    _assert_same(_snapshot(db_path), full_rebuild)
+
+
+def test_changed_file_matches_full_rebuild(data, tmp_path):
+    files = data["files"]
+    rebuild_path = tmp_path / "rebuild.db"
+    _load(rebuild_path, [files["20251024"], data["changed"], files["20251026"]], data["master_index"], replace=True)
+
+    db_path = tmp_path / "changed.db"
+    _load(db_path, list(files.values()), data["master_index"], replace=True)
+    _load(db_path, [data["changed"]], data["master_index"], changed=True)
+    _assert_same(_snapshot(db_path), _snapshot(rebuild_path))
+
+
+def test_removed_rows_restore_the_first_request(data, tmp_path):
+    # Without the day 24 file, the first requests are the ones of day 25 again
+    files = data["files"]
+    rebuild_path = tmp_path / "rebuild.db"
+    _load(rebuild_path, [files["20251025"], files["20251026"]], data["master_index"], replace=True)
+
+    db_path = tmp_path / "removed.db"
+    _load(db_path, list(files.values()), data["master_index"], replace=True)
+    conn = spa_storage.connect(str(db_path))
+    spa_ingest.remove_files(conn, [os.path.basename(files["20251024"])])
+    conn.commit()
+    conn.close()
+    expected, snapshot = _snapshot(rebuild_path), _snapshot(db_path)
+    for name in ("history", "first_requests", "watermarks"):
+        pd.testing.assert_frame_equal(snapshot[name], expected[name], check_exact=False, rtol=1e-9, obj=name)
+    assert snapshot["history"]["time_between_MatReqs"].notna().all()
@@ -0,0 +1,46 @@
+"""
+Model registry of spa_models.
+"""
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+import spa_models
+
+
+FEATURES = ["Consumo", "Cap. Sumin", "Supply_time_hours"]
+TARGET = "time_between_MatReqs"
+
+
+def _training_data(seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.random((200, len(FEATURES))), columns=FEATURES)
+    y = pd.Series(rng.random(200) * 5, name=TARGET)
+    return X, y
+
+
+def _fitted(X, y, n_estimators: int = 10) -> Pipeline:
+    return Pipeline([("scaler", StandardScaler()),
+                     ("model", RandomForestRegressor(n_estimators=n_estimators, random_state=42))]).fit(X, y)
+
+
+def test_same_data_and_parameters_reuse_the_version(tmp_path):
+    X, y = _training_data()
+    first = spa_models.save_model(_fitted(X, y), "rf", FEATURES, TARGET, X, y, registry_dir=str(tmp_path))
+    again = spa_models.save_model(_fitted(X, y), "rf", FEATURES, TARGET, X, y, registry_dir=str(tmp_path))
+    assert again["version"] == first["version"] == 1
+    assert spa_models.list_versions("rf", str(tmp_path)) == [1]
+
+
+def test_new_data_or_parameters_save_a_new_version(tmp_path):
+    X, y = _training_data()
+    spa_models.save_model(_fitted(X, y), "rf", FEATURES, TARGET, X, y, registry_dir=str(tmp_path))
+    other_X, other_y = _training_data(seed=1)
+    spa_models.save_model(_fitted(other_X, other_y), "rf", FEATURES, TARGET, other_X, other_y,
+                          registry_dir=str(tmp_path))
+    spa_models.save_model(_fitted(X, y, n_estimators=20), "rf", FEATURES, TARGET, X, y, registry_dir=str(tmp_path))
+    spa_models.save_model(_fitted(X, y), "rf", FEATURES, TARGET, X, y, registry_dir=str(tmp_path), reuse=False)
+    assert spa_models.list_versions("rf", str(tmp_path)) == [1, 2, 3, 4]
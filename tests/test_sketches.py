@@ -0,0 +1,122 @@
+"""
+Sketches of spa_sketches compared with the exact statistics of pandas.
+"""
+
+import numpy as np
+import pandas as pd
+
+import spa_sketches
+import spa_storage
+
+
+# Tolerance of the exact statistics (count, mean, std, min, max): only rounding errors of the merge
+RTOL = 1e-9
+
+# Largest distance between q and the fraction of values below the estimated quantile (t-digest)
+MAX_RANK_ERROR = 0.01
+
+METRICS = ["count", "mean", "std", "min", "max"]
+
+
+def _history() -> pd.DataFrame:
+    """
+    Synthetic requests of 60 groups over 10 days: small groups (all their values kept) and big ones.
+    """
+    return spa_sketches._synthetic_history(n_groups=60, n_days=10, seed=3)
+
+
+def _by_day(df: pd.DataFrame) -> dict:
+    """
+    Sketches built day by day, merging each day into the previous ones.
+    """
+    sketches = {}
+    for _, day in df.groupby("day"):
+        spa_sketches.merge_sketches(sketches, spa_sketches.build_sketches(day, ["time_between_MatReqs"]))
+    return sketches
+
+
+def _exact_stats(df: pd.DataFrame) -> pd.DataFrame:
+    exact = df.groupby(["PLP", "Material"])["time_between_MatReqs"].agg(METRICS)
+    exact.columns = pd.MultiIndex.from_product([["time_between_MatReqs"], METRICS])
+    return exact
+
+
+def test_merge_of_partial_sketches_matches_one_sketch():
+    values = np.random.default_rng(0).lognormal(1.0, 1.0, 5000)
+    merged = spa_sketches.QuantileSketch()
+    for part in np.array_split(values, 7):
+        merged.merge(spa_sketches.QuantileSketch.from_values(part))
+    whole = spa_sketches.QuantileSketch.from_values(values)
+
+    assert merged.n == whole.n == len(values)
+    assert (merged.min, merged.max) == (whole.min, whole.max)
+    np.testing.assert_allclose([merged.mean, merged.std()], [whole.mean, whole.std()], rtol=RTOL)
+    assert len(merged.means) <= merged.compression
+    assert abs(merged.quantile(0.5) - whole.quantile(0.5)) / np.median(values) < 0.02
+
+
+def test_merged_moments_match_pandas():
+    df = _history()
+    stats = spa_sketches.sketch_stats(_by_day(df), ["time_between_MatReqs"], metrics=METRICS)
+    pd.testing.assert_frame_equal(stats, _exact_stats(df), check_dtype=False, rtol=RTOL)
+
+
+def test_quantile_rank_error():
+    df = _history()
+    sketches = _by_day(df)
+    sizes = df.groupby(["PLP", "Material"]).size()
+
+    # Groups with more values than centroids: the rank error is bounded
+    big = sizes.index[sizes > 10 * spa_sketches.COMPRESSION]
+    in_big = df.set_index(["PLP", "Material"]).index.isin(big)
+    errors = spa_sketches.compare_with_exact(df[in_big], "time_between_MatReqs", sketches, (0.1, 0.5, 0.9, 0.99))
+    assert errors["groups"].min() == len(big) > 0
+    assert errors["max_rank_error"].max() <= MAX_RANK_ERROR
+
+    # Groups with few values keep all of them: the quantiles are exact (interpolated like pandas)
+    for plp, material in sizes.index[sizes <= spa_sketches.COMPRESSION]:
+        values = df.loc[(df["PLP"] == plp) & (df["Material"] == material), "time_between_MatReqs"]
+        sketch = sketches[(plp, material, "time_between_MatReqs")]
+        for q in (0.1, 0.5, 0.9):
+            assert np.isclose(sketch.quantile(q), values.quantile(q), rtol=RTOL)
+
+
+def _stored_stats(conn) -> pd.DataFrame:
+    return spa_sketches.sketch_stats(spa_sketches.load_sketches(conn), metrics=METRICS + ["median"])
+
+
+def test_rebuild_after_a_file_change_matches_a_fresh_build(tmp_path):
+    rng = np.random.default_rng(5)
+    n = 600
+    df = pd.DataFrame({
+        "PLP": rng.choice(["10AB_001P1", "08CD_011P1"], n),
+        "Material": rng.choice(["W01", "W02", "W03"], n),
+        "datetime_creac": pd.Timestamp("2025-10-01") + pd.to_timedelta(np.sort(rng.uniform(0, 48, n)), unit="h"),
+        "Supply_time_hours": rng.gamma(2.0, 1.5, n),
+        "time_between_MatReqs": rng.exponential(3.0, n),
+    })
+    df["source_file"] = np.where(df["datetime_creac"] < pd.Timestamp("2025-10-02"), "day1.xlsx", "day2.xlsx")
+
+    conn = spa_storage.connect(str(tmp_path / "history.db"))
+    spa_storage.write_history(conn, df, replace=True)
+    spa_sketches.update_sketches(conn, df, replace=True)
+
+    # The file of the second day is loaded again with other values
+    changed = df[df["source_file"] == "day2.xlsx"].sample(frac=0.7, random_state=1)
+    changed = changed.assign(Supply_time_hours=changed["Supply_time_hours"] * 2.0)
+    spa_storage.delete_rows_of_files(conn, ["day2.xlsx"])
+    spa_storage.write_history(conn, changed)
+    spa_sketches.rebuild_sketches(conn)
+    rebuilt = _stored_stats(conn)
+    conn.close()
+
+    final = pd.concat([df[df["source_file"] == "day1.xlsx"], changed], ignore_index=True)
+    fresh_conn = spa_storage.connect(str(tmp_path / "fresh.db"))
+    spa_storage.write_history(fresh_conn, final, replace=True)
+    spa_sketches.update_sketches(fresh_conn, final, replace=True)
+    pd.testing.assert_frame_equal(rebuilt, _stored_stats(fresh_conn), rtol=RTOL)
+    fresh_conn.close()
+
+    exact = final.groupby(["PLP", "Material"])["Supply_time_hours"].agg(METRICS + ["median"])
+    pd.testing.assert_frame_equal(rebuilt["Supply_time_hours"], exact, check_dtype=False, check_names=False,
+                                  rtol=RTOL)
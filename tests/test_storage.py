@@ -0,0 +1,80 @@
+"""
+Typed history table of spa_storage.
+"""
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import spa_storage
+
+# The old table stored Supply_time as integer nanoseconds, like pandas to_sql does
+pytestmark = pytest.mark.filterwarnings("ignore:the 'timedelta' type is not supported")
+
+
+def _legacy_rows() -> pd.DataFrame:
+    """
+    Rows like the ones written by the first version of script 1 (pandas to_sql).
+    """
+    creac = pd.to_datetime(["2025-10-01 06:00:00", "2025-10-01 08:30:00", "2025-10-02 07:15:00"])
+    conf = creac + pd.Timedelta(hours=2)
+    return pd.DataFrame({
+        "SFab": [441, 441, 402], "GLin": ["01", "01", "07"], "UbiLínea": ["001P1_NO"] * 3,
+        "Material": ["W05FA837901D", "W05FA837901D", "W01234567890"], "Status": 1,
+        "Denominacion": "TORNILLO", "Tipo Sum": "NO", "Consumo": [100.0, 100.0, 20.5],
+        "F.Creac": creac.strftime("%d.%m.%y"), "H.Creac": creac.strftime("%H:%M:%S"),
+        "F.Conf OT": conf.strftime("%d.%m.%y"), "H.Conf OT": conf.strftime("%H:%M"),
+        "Ubic.proc.": "PASILLO2", "Tp.alm.proc.": "AGL", "PLP": ["10AB_001P1", "10AB_001P1", "08CD_011P1"],
+        "PVB": ["10AB_001_", "10AB_001_", "08CD_011_"], "Válido de": pd.Timestamp("2000-01-01"),
+        "Válido a": pd.Timestamp("9999-12-31"), "Cap. Sumin": [20.0, 20.0, 48.0],
+        "datetime_creac": creac, "datetime_conf": conf, "Supply_time": conf - creac,
+        "Supply_time_hours": 2.0, "time_between_MatReqs": [1.5, 2.5, 24.0],
+    })
+
+
+def test_connect_keeps_legacy_table(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    with sqlite3.connect(db_path) as conn:
+        _legacy_rows().to_sql(spa_storage.HISTORY_VIEW, conn, index=False)
+
+    conn = spa_storage.connect(db_path)
+    assert spa_storage.table_exists(conn, spa_storage.HISTORY_VIEW, "table")
+    assert conn.execute(f"SELECT COUNT(*) FROM {spa_storage.HISTORY_VIEW}").fetchone()[0] == 3
+    conn.close()
+
+
+def test_migrate_legacy_history(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    legacy = _legacy_rows()
+    with sqlite3.connect(db_path) as conn:
+        legacy.to_sql(spa_storage.HISTORY_VIEW, conn, index=False)
+
+    conn = spa_storage.connect(db_path)
+    assert spa_storage.migrate_legacy_history(conn) == 3
+    assert spa_storage.table_exists(conn, spa_storage.LEGACY_TABLE, "table")
+    assert spa_storage.table_exists(conn, spa_storage.HISTORY_VIEW, "view")
+    assert spa_storage.migrate_legacy_history(conn) == 0
+    conn.close()
+
+    stored = spa_storage.load_history(db_path).sort_values("datetime_creac", ignore_index=True)
+    pd.testing.assert_series_equal(stored["datetime_creac"], legacy["datetime_creac"], check_dtype=False)
+    assert stored["PLP"].tolist() == legacy["PLP"].tolist()
+    assert stored["F.Creac"].tolist() == legacy["F.Creac"].tolist()
+    assert stored["time_between_MatReqs"].tolist() == legacy["time_between_MatReqs"].tolist()
+
+
+def test_text_columns_are_stored_as_read(tmp_path):
+    db_path = str(tmp_path / "history.db")
+    rows = _legacy_rows().drop(columns="Supply_time")
+    rows["F.Creac"] = ["1.10.25", "01.10.25", "2.10.25"]
+    rows["H.Creac"] = ["6:00:00", "08:30:00", "07:15:00"]
+    rows["F.Conf OT"] = rows["F.Conf OT"].where(rows.index != 2, None)
+    rows.loc[2, "datetime_conf"] = pd.NaT
+    conn = spa_storage.connect(db_path)
+    spa_storage.write_history(conn, rows, replace=True)
+    conn.close()
+
+    stored = spa_storage.load_history(db_path).sort_values("datetime_creac", ignore_index=True)
+    for column in ("F.Creac", "H.Creac", "F.Conf OT", "H.Conf OT"):
+        assert stored[column].tolist() == rows[column].tolist(), column
@@ -0,0 +1,35 @@
+"""
+Parsing of the date and time columns of spa_timestamps.
+"""
+
+import pandas as pd
+import pytest
+
+import spa_timestamps
+
+
+FORMATS = [("%d.%m.%y", "%H:%M:%S"), ("%d.%m.%y", "%H:%M")]
+
+
+def _text_approach(dates, times, date_format, time_format):
+    return pd.to_datetime(dates + " " + times, format=date_format + " " + time_format, errors="coerce")
+
+
+@pytest.mark.parametrize("date_format, time_format", FORMATS)
+def test_parse_of_formatted_datetimes(date_format, time_format):
+    values = pd.Series(pd.to_datetime(["2025-10-25 04:36:02", "2025-10-25 23:59:59", "2025-10-26 00:00:00",
+                                       None, "2025-12-31 12:05:30"]))
+    if time_format == "%H:%M":
+        values = values.dt.floor("min")
+    dates = values.dt.strftime(date_format).where(values.notna(), None)
+    times = values.dt.strftime(time_format).where(values.notna(), None)
+    parsed = spa_timestamps.parse_date_time(dates, times, date_format, time_format)
+    pd.testing.assert_series_equal(parsed, values, check_dtype=False, check_names=False)
+
+
+def test_parse_matches_the_text_approach():
+    dates = pd.Series(["25.10.25", "5.10.25", None, "31.02.25", "26.10.25", "xx"])
+    times = pd.Series(["04:36:02", "4:36:02", "10:00:00", "10:00:00", None, "10:00:00"])
+    parsed = spa_timestamps.parse_date_time(dates, times)
+    expected = _text_approach(dates, times, "%d.%m.%y", "%H:%M:%S")
+    pd.testing.assert_series_equal(parsed, expected, check_dtype=False, check_names=False)
@@ -0,0 +1,44 @@
+"""
+Compact inference of spa_tree_inference gives the same predictions as scikit-learn.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+import spa_tree_inference
+
+
+@pytest.fixture(scope="module")
+def data() -> tuple:
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame({"Consumo": rng.lognormal(5.0, 1.0, 600), "Cap. Sumin": rng.choice([12, 20, 48, 3000], 600),
+                      "Supply_time_hours": rng.gamma(4.0, 0.6, 600)})
+    y = pd.Series(X["Supply_time_hours"] * 2 + rng.normal(0, 1, 600) + 1000 / X["Consumo"], name="y")
+    return X.iloc[:500], y.iloc[:500], X.iloc[500:]
+
+
+@pytest.mark.parametrize("model", [
+    RandomForestRegressor(n_estimators=20, random_state=42),
+    RandomForestRegressor(n_estimators=10, max_depth=4, random_state=1),
+    GradientBoostingRegressor(n_estimators=30, random_state=42),
+])
+def test_compact_forest_matches_sklearn(data, model):
+    X_train, y_train, X_test = data
+    model.fit(X_train.to_numpy(), y_train)
+    compact = spa_tree_inference.CompactForest(model)
+    expected = model.predict(X_test.to_numpy())
+    np.testing.assert_array_equal(compact.predict(X_test.to_numpy()), expected)
+    np.testing.assert_array_equal(compact.predict(X_test.to_numpy()[:1]), expected[:1])
+    assert compact.n_trees == model.n_estimators
+
+
+def test_compact_pipeline_matches_sklearn(data):
+    X_train, y_train, X_test = data
+    pipeline = Pipeline([("scaler", StandardScaler()),
+                         ("model", RandomForestRegressor(n_estimators=20, random_state=42))]).fit(X_train, y_train)
+    compact = spa_tree_inference.CompactPipeline(pipeline)
+    np.testing.assert_array_equal(compact.predict(X_test), pipeline.predict(X_test))